@@ -31,8 +31,9 @@ setup(
     author='Jeffrey Bush',
     author_email='jeff@coderforlife.com',
     url="https://github.com/coderforlife/yarc",
-    packages=['yarc'],
+    packages=['yarc', 'yarc.urlhandler'],
     install_requires=['pyserial'] + [['aenum'] if sys.version_info < (3, 6) else []],
+    extras_require={'asyncio': ['pyserial-asyncio'], 'numpy': ['numpy']},
     python_requires='>=3.5',
     classifiers=[
         "Programming Language :: Python :: 3 :: Only",
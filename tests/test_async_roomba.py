@@ -0,0 +1,91 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from yarc import AsyncRoomba, Emulator
+from yarc.sensor import Sensor
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='requires pseudo-terminals')
+
+def run(test):
+    """Run a test coroutine given an `AsyncRoomba` connected to a new emulator over a pty."""
+    pytest.importorskip('serial_asyncio')
+    emulator = Emulator(clock=time)
+    emulator.set_sensor(Sensor.VOLTAGE, 15000)
+    name = emulator.open_pty()
+    async def main():
+        bot = await AsyncRoomba.open(name, brc=lambda state: None)
+        try:
+            bot.start()
+            await test(bot)
+        finally:
+            await bot.close()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+def test_sensors():
+    async def test(bot):
+        assert await bot.voltage == 15000
+        assert await bot.sensor(Sensor.OI_MODE) == 1 # passive
+        assert await bot.query_list('VOLTAGE', 'OI_MODE') == (15000, 1)
+    run(test)
+
+def test_stream():
+    async def test(bot):
+        frames = []
+        async with bot.stream('VOLTAGE', 'OI_MODE') as stream:
+            async for frame in stream:
+                frames.append(frame)
+                if len(frames) == 3:
+                    break
+        assert frames == [(15000, 1)] * 3
+    run(test)
+
+def test_background_stream():
+    async def test(bot):
+        stream = bot.start_background_stream('VOLTAGE', history=4)
+        assert stream.sensors == (Sensor.VOLTAGE,)
+        with pytest.raises(ValueError):
+            bot.start_background_stream('VOLTAGE')
+        frames = []
+        stream.subscribe(lambda frame: frames.append(frame) or len(frames) < 3)
+        while len(stream.history()) < 4:
+            await asyncio.sleep(0.01)
+        assert len(frames) == 3 # unsubscribed once it returned False
+        assert stream.frame.VOLTAGE == 15000
+        async with stream.paused():
+            assert not stream.running
+            assert await bot.sensor(Sensor.OI_MODE) == 1
+        assert stream.running
+        count = len(stream.history())
+        latest = stream.latest
+        while stream.latest is latest:
+            await asyncio.sleep(0.01)
+        assert len(stream.history()) == count # still bounded
+        bot.stop_background_stream()
+        await stream.wait()
+        assert not stream.running and stream.error is None
+    run(test)
@@ -0,0 +1,104 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import pytest
+
+from yarc import Simulator, Sensor
+from yarc.roomba import CYCLE
+
+class CountingSerial:
+    """Wraps a serial port to keep each write made to it."""
+    def __init__(self, port):
+        self.port, self.writes = port, []
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+    def write(self, data):
+        self.writes.append(bytes(data))
+        return self.port.write(data)
+
+def counting():
+    """Gets a simulator and a Roomba of it in safe mode with a `CountingSerial`."""
+    sim = Simulator()
+    bot = sim.roomba()
+    bot.serial = CountingSerial(bot.serial)
+    bot.start()
+    bot.safe()
+    bot.serial.writes.clear()
+    return sim, bot
+
+def test_single_write():
+    sim, bot = counting()
+    with bot.batch():
+        bot.drive_direct(100, 100)
+        bot.leds(debris=True)
+        with bot.batch(): # part of the outer batch
+            bot.motors(main_brush=True)
+        assert bot.serial.writes == []
+    assert len(bot.serial.writes) == 1
+    sim.clock.sleep(CYCLE)
+    sim.update()
+    assert sim.velocities == (100, 100)
+
+def test_sensors_in_batch():
+    sim, bot = counting()
+    with bot.batch():
+        bot.drive_direct(50, 50)
+        bot.query_list(Sensor.VOLTAGE) # sends the drive command first
+        assert len(bot.serial.writes) == 1
+        bot.drive_direct(0, 0)
+    assert len(bot.serial.writes) == 2
+    assert bot.serial.writes[1][0] == 145 # DRIVE_DIRECT
+    sim.update()
+    assert sim.velocities == (0, 0)
+
+def test_exception_drops_batch():
+    sim, bot = counting()
+    with pytest.raises(RuntimeError):
+        with bot.batch():
+            bot.drive_direct(100, 100)
+            raise RuntimeError('dropped')
+    assert bot.serial.writes == []
+    sim.clock.sleep(CYCLE)
+    sim.update()
+    assert sim.velocities == (0, 0)
+
+def test_align_without_stream():
+    sim, bot = counting()
+    times = []
+    for speed in range(5):
+        with bot.batch(align=True):
+            bot.drive_direct(speed, speed)
+        times.append(sim.clock.monotonic())
+    assert [b - a for a, b in zip(times, times[1:])] == pytest.approx([CYCLE] * 4)
+    assert len(bot.serial.writes) == 5
+    with bot.batch(align=True):
+        pass # nothing to write so there is no wait
+    assert sim.clock.monotonic() == times[-1]
+
+def test_align_to_stream():
+    sim, bot = counting()
+    frames = []
+    def callback(_):
+        frames.append(sim.clock.monotonic())
+        return len(frames) < 3
+    bot.stream(callback, Sensor.VOLTAGE)
+    sim.clock.sleep(0.004) # part way through a cycle
+    with bot.batch(align=True):
+        bot.drive_direct(100, 100)
+    cycles = (sim.clock.monotonic() - frames[-1]) / CYCLE
+    assert cycles == pytest.approx(round(cycles), abs=0.05) and cycles >= 1
@@ -0,0 +1,125 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import pytest
+import serial
+
+from yarc import Day, Emulator, Roomba, VirtualClock
+from yarc.enums import OIMode
+from yarc.sensor import Sensor
+
+def connect(mode=None):
+    """Connect a `Roomba` to a new emulator on a virtual clock and start it in a mode."""
+    emulator = Emulator(VirtualClock())
+    bot = emulator.roomba()
+    bot.start()
+    if mode is not None:
+        getattr(bot, mode)()
+    return emulator, bot
+
+def test_url_handler():
+    bot = Roomba('roomba://', brc=lambda state: None)
+    emulator = bot.serial.emulator
+    assert isinstance(emulator, Emulator)
+    bot.start()
+    assert bot.oi_mode == OIMode.PASSIVE
+    assert emulator.mode == OIMode.PASSIVE
+    bot.close()
+    assert emulator.mode == OIMode.OFF and not bot.serial.is_open
+    with pytest.raises(serial.SerialException):
+        serial.serial_for_url('roomba://robot')
+
+def test_sensors():
+    emulator, bot = connect()
+    assert bot.voltage == Emulator.DEFAULT_VALUES[Sensor.VOLTAGE]
+    emulator.set_sensor(Sensor.VOLTAGE, 15000)
+    emulator.set_sensor(Sensor.ANGLE, -90)
+    assert bot.query_list(Sensor.VOLTAGE, Sensor.ANGLE, Sensor.OI_MODE) == (15000, -90, 1)
+    for sensor in Sensor:
+        bot.sensor(sensor) # every sensor has the right size
+    assert bot.sensor(Sensor.ALL_SENSORS).VOLTAGE == 15000
+
+def test_modes():
+    emulator, bot = connect()
+    bot.drive_direct(100, 100) # not available in passive mode
+    assert emulator.velocities == (0, 0)
+    bot.safe()
+    assert emulator.mode == OIMode.SAFE
+    bot.drive_direct(100, -50)
+    assert emulator.velocities == (-50, 100)
+    emulator.set_sensor(Sensor.CLIFF_LEFT, True) # safe mode drops to passive
+    emulator.clock.sleep(2*Emulator.CYCLE)
+    emulator.update()
+    assert emulator.mode == OIMode.PASSIVE and emulator.velocities == (0, 0)
+    bot.full()
+    bot.stop()
+    assert emulator.mode == OIMode.OFF
+
+def test_actuators():
+    emulator, bot = connect('safe')
+    bot.motors(main_brush=True, side_brush=True, side_brush_cw=True, vacuum=True)
+    assert emulator.motors == (127, -127, 127)
+    assert bot.main_brush_motor_current == Emulator.MAIN_BRUSH_CURRENT
+    bot.leds(debris=True, home=True, power_color=255, power_intensity=128)
+    assert emulator.leds == (5, 255, 128)
+    bot.digit_leds_ascii('AbC')
+    assert emulator.digit_leds == b'ABC '
+    bot.schedule(mon=(9, 30))
+    bot.set_day_time(Day.TUESDAY, 13, 37)
+    assert emulator.schedule == {Day.MONDAY: (9, 30)}
+    assert emulator.day_time == (Day.TUESDAY, 13, 37)
+    bot.safe() # turns off the LEDs
+    assert emulator.leds == (0, 0, 0)
+    bot.clean() # leaving safe mode stops the motors
+    assert emulator.motors == (0, 0, 0)
+
+def test_buttons():
+    emulator, bot = connect('safe')
+    bot.press_buttons(clean=True, dock=True)
+    assert bot.buttons == 5
+    emulator.clock.sleep(Emulator.BUTTON_TIME + Emulator.CYCLE)
+    assert bot.buttons == 0
+
+def test_stream():
+    emulator, bot = connect()
+    emulator.set_sensor(Sensor.VOLTAGE, 15000)
+    emulator.set_sensor(Sensor.DISTANCE, 12)
+    frames = []
+    start = emulator.clock.monotonic()
+    bot.stream(lambda frame: frames.append(frame) or len(frames) < 10,
+               Sensor.VOLTAGE, Sensor.DISTANCE)
+    assert frames == [(15000, 12)] + [(15000, 0)] * 9 # the distance resets once it is read
+    assert emulator.clock.monotonic() - start == pytest.approx(10 * Emulator.CYCLE, abs=0.02)
+    assert bot.stream_stats.frames == 10 and bot.stream_stats.dropped_bytes == 0
+
+def test_baudrate():
+    emulator, bot = connect()
+    bot.baud = 19200
+    assert emulator.baudrate == 19200
+    assert bot.voltage == Emulator.DEFAULT_VALUES[Sensor.VOLTAGE]
+    bot.serial.baudrate = 115200 # mismatched baudrates get nothing through
+    with pytest.raises(serial.SerialTimeoutException):
+        bot.sensor(Sensor.VOLTAGE)
+
+def test_reset():
+    emulator, bot = connect('safe')
+    assert bot.reset().startswith(b'Roomba by iRobot!')
+    assert emulator.mode == OIMode.OFF
+    emulator.clock.sleep(Emulator.BOOT_TIME)
+    bot.start()
+    assert bot.oi_mode == OIMode.PASSIVE
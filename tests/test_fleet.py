@@ -0,0 +1,103 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import threading
+import time
+
+import pytest
+
+from yarc import Fleet, Roomba, Simulator
+from yarc.sensor import Sensor
+
+pytestmark = pytest.mark.skipif(os.name != 'posix', reason='requires pseudo-terminals')
+
+def connect():
+    """Connect a `Roomba` in safe mode to a simulator running in real time over a pty."""
+    sim = Simulator(clock=time)
+    bot = Roomba(sim.open_pty(), brc=lambda state: None)
+    bot.start()
+    bot.safe()
+    return sim, bot
+
+def test_stream_and_commands():
+    fleet = Fleet()
+    frames = {'a': [], 'b': []}
+    def on_frame(name, frame):
+        frames[name].append(frame)
+        return len(frames[name]) < 5
+    try:
+        for name in frames:
+            fleet.add(name, connect()[1])
+            fleet.stream(name, on_frame, Sensor.OI_MODE, Sensor.VOLTAGE)
+        result = fleet.submit('a', lambda roomba: roomba.serial.is_open)
+        failure = fleet.submit('b', lambda roomba: 1/0)
+        fleet.run(0.3)
+        assert result.result(0)
+        with pytest.raises(ZeroDivisionError):
+            failure.result(0)
+        assert [len(found) for found in frames.values()] == [5, 5]
+        assert not fleet.errors # command exceptions only go to their Future
+    finally:
+        fleet.close()
+
+def test_stream_stopped():
+    errors = []
+    fleet = Fleet(on_error=lambda name, ex: errors.append(name))
+    try:
+        fleet.add('a', connect()[1])
+        fleet.stream('a', lambda name, frame: True, Sensor.OI_MODE)
+        fleet.submit('a', lambda roomba: roomba.serial.close()) # no more data will arrive
+        fleet.run(0.3)
+        assert errors == ['a']
+        assert 'a' in fleet.errors
+    finally:
+        fleet.close()
+
+def test_remove_while_running():
+    fleet = Fleet()
+    for name in 'ab':
+        fleet.add(name, connect()[1])
+        fleet.stream(name, lambda name, frame: True, Sensor.OI_MODE)
+    thread = threading.Thread(target=fleet.run, args=(0.5,))
+    thread.start()
+    try:
+        time.sleep(0.1)
+        fleet.remove('a')
+        fleet.add('c', connect()[1])
+        thread.join()
+        assert sorted(fleet) == ['b', 'c']
+        assert not fleet.errors
+    finally:
+        thread.join()
+        fleet.close()
+
+def test_close_after_failure():
+    fleet = Fleet()
+    bots = [connect()[1] for _ in range(3)]
+    def fail():
+        raise OSError('cannot close')
+    bots[1].close = fail
+    for i, bot in enumerate(bots):
+        fleet.add(i, bot)
+    with pytest.raises(OSError):
+        fleet.close()
+    assert len(fleet) == 0
+    assert not bots[0].serial.is_open and not bots[2].serial.is_open
+    del bots[1].close
+    bots[1].close()
@@ -0,0 +1,120 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from concurrent.futures import CancelledError
+import math
+import time
+
+import pytest
+
+from yarc import Simulator
+from yarc.motion import COUNTS_PER_MM, Move
+from yarc.sensor import Sensor
+from yarc.simulator import World
+
+ENCODERS = (Sensor.LEFT_ENCODER_COUNTS, Sensor.RIGHT_ENCODER_COUNTS)
+
+def connect(sim):
+    """Connect a `Roomba` in safe mode to a simulator."""
+    bot = sim.roomba()
+    bot.start()
+    bot.safe()
+    return bot
+
+def test_drive_distance():
+    sim = Simulator()
+    bot = connect(sim)
+    assert bot.drive_distance(300) == pytest.approx(300, abs=5)
+    assert sim.x == pytest.approx(300, abs=5)
+    assert bot.drive_distance(-100, velocity=50) == pytest.approx(-100, abs=5)
+    assert sim.x == pytest.approx(200, abs=5)
+    assert sim.velocities == (0, 0)
+
+def test_turn_angle():
+    sim = Simulator()
+    bot = connect(sim)
+    assert bot.turn_angle(90) == pytest.approx(90, abs=3)
+    assert math.degrees(sim.heading) == pytest.approx(90, abs=3)
+    assert bot.turn_angle(-45) == pytest.approx(-45, abs=3)
+    assert sim.velocities == (0, 0)
+
+def test_encoder_wraparound():
+    # The encoder counts wrap around every 32768 counts, about 14.5 m
+    sim = Simulator()
+    bot = connect(sim)
+    distance = 40000 / COUNTS_PER_MM
+    assert bot.drive_distance(distance, velocity=500) == pytest.approx(distance, abs=5)
+    assert sim.x == pytest.approx(distance, abs=5)
+
+def test_background_stream():
+    sim = Simulator()
+    bot = connect(sim)
+    bot.start_background_stream(*ENCODERS) # the move follows its frames
+    try:
+        assert bot.drive_distance(200) == pytest.approx(200, abs=5)
+    finally:
+        bot.stop_background_stream()
+    stream = bot.start_background_stream(Sensor.OI_MODE) # paused while the move polls
+    try:
+        assert bot.drive_distance(200) == pytest.approx(200, abs=5)
+        assert stream.running
+    finally:
+        bot.stop_background_stream()
+    assert sim.x == pytest.approx(400, abs=10)
+
+def test_stall():
+    # Driving into a wall stalls the wheels so the encoders stop counting
+    sim = Simulator(World(width=1000, height=1000), x=500, y=500)
+    bot = connect(sim)
+    with pytest.raises(TimeoutError, match='stalled'):
+        bot.drive_distance(1000)
+    assert sim.x == pytest.approx(1000 - 174, abs=5)
+    assert sim.velocities == (0, 0)
+
+def test_timeout():
+    sim = Simulator()
+    bot = connect(sim)
+    with pytest.raises(TimeoutError, match='timed out'):
+        bot.drive_distance(1000, timeout=1)
+    assert sim.x == pytest.approx(100, abs=10)
+
+def test_cancel():
+    sim = Simulator(clock=time)
+    bot = connect(sim)
+    future = bot.turn_angle(360, wait=False)
+    assert isinstance(future.move, Move)
+    deadline = time.monotonic() + 5
+    while future.move.traveled < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert future.cancel()
+    assert future.cancelled()
+    with pytest.raises(CancelledError):
+        future.result(5)
+    deadline = time.monotonic() + 5
+    while not future.move.done and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert 10 <= future.move.traveled < 360
+    assert sim.velocities == (0, 0)
+
+def test_cancel_done():
+    sim = Simulator()
+    bot = connect(sim)
+    future = bot.drive_distance(50, wait=False)
+    assert future.result(5) == pytest.approx(50, abs=5)
+    assert not future.cancel()
+    assert not future.cancelled()
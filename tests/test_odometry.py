@@ -0,0 +1,112 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import math
+
+import pytest
+
+from yarc import Simulator
+from yarc.motion import COUNTS_PER_MM, WHEEL_BASE
+from yarc.odometry import Odometry
+
+def counts(mm):
+    """The encoder counts for a distance in mm."""
+    return round(mm * COUNTS_PER_MM)
+
+def test_straight():
+    odometry = Odometry()
+    assert odometry.pose.timestamp is None
+    odometry.update(0, 0, 0.0)
+    pose = odometry.update(counts(100), counts(100), 1.0)
+    assert pose == odometry.pose
+    assert pose.x == pytest.approx(100, abs=0.5) and pose.y == pytest.approx(0)
+    assert pose.heading == 0 and pose.velocity == pytest.approx(100, abs=0.5)
+
+def test_turn():
+    odometry = Odometry(heading=math.pi/2)
+    odometry.update(0, 0, 0.0)
+    quarter = counts(math.pi/2 * WHEEL_BASE / 2) # a quarter turn in place
+    pose = odometry.update(-quarter, quarter, 0.5)
+    assert pose.heading == pytest.approx(math.pi, abs=0.01)
+    pose = odometry.update(-2*quarter, 2*quarter, 1.0) # wraps to -pi/2
+    assert pose.heading == pytest.approx(-math.pi/2, abs=0.01)
+    assert pose.angular_velocity == pytest.approx(math.pi, abs=0.02)
+    assert pose.x == pytest.approx(0) and pose.y == pytest.approx(0)
+
+def test_wraparound():
+    # The counts are signed 16-bit values that wrap around
+    odometry = Odometry()
+    odometry.update(32700, -32700, 0.0)
+    pose = odometry.update(-32736, 32736, 0.1) # +100 and -100 counts
+    assert pose.heading == pytest.approx(-200 / COUNTS_PER_MM / WHEEL_BASE)
+    odometry.reset()
+    odometry.update(32760, 32760, 0.0)
+    pose = odometry.update(-32766, -32766, 0.1) # +10 counts
+    assert pose.x == pytest.approx(10 / COUNTS_PER_MM)
+
+def test_at():
+    odometry = Odometry()
+    for i in range(5):
+        odometry.update(counts(10*i), counts(10*i), 0.1*i)
+    assert odometry.at(0.25).x == pytest.approx(25, abs=0.5) # halfway between 0.2 and 0.3
+    assert odometry.at(0.25).timestamp == 0.25
+    assert odometry.at(0.3).x == pytest.approx(30, abs=0.5)
+    assert odometry.at(0.0).x == 0 and odometry.at(0.4) == odometry.pose
+    with pytest.raises(ValueError):
+        odometry.at(0.5)
+    with pytest.raises(ValueError):
+        odometry.at(-0.1)
+
+def test_at_heading_wraparound():
+    # Interpolating between headings on either side of pi goes the short way around
+    odometry = Odometry(heading=math.radians(170))
+    odometry.update(0, 0, 0.0)
+    turn = counts(math.radians(20) * WHEEL_BASE / 2)
+    odometry.update(-turn, turn, 1.0) # turned to -170 degrees
+    assert math.degrees(odometry.at(0.5).heading) == pytest.approx(180, abs=0.5) or \
+        math.degrees(odometry.at(0.5).heading) == pytest.approx(-180, abs=0.5)
+
+def test_history():
+    odometry = Odometry(history=3)
+    for i in range(5):
+        odometry.update(i, i, float(i))
+    assert [pose.timestamp for pose in odometry.history()] == [2.0, 3.0, 4.0]
+    with pytest.raises(ValueError):
+        odometry.at(1.5) # no longer in the history
+    odometry.reset(x=5)
+    assert odometry.history() == [] and odometry.pose.x == 5
+    with pytest.raises(ValueError):
+        Odometry(history=0)
+
+def test_simulator():
+    sim = Simulator()
+    bot = sim.roomba()
+    bot.start()
+    bot.safe()
+    odometry = Odometry(clock=bot.clock)
+    bot.drive_direct(150, 100)
+    frames = []
+    def on_frame(frame):
+        frames.append(frame)
+        return odometry.on_frame(frame) and len(frames) < 200
+    bot.stream(on_frame, *Odometry.SENSORS)
+    bot.drive_direct(0, 0)
+    pose = odometry.pose
+    assert pose.x == pytest.approx(sim.x, abs=5)
+    assert pose.y == pytest.approx(sim.y, abs=5)
+    assert pose.heading == pytest.approx(sim.heading, abs=0.02)
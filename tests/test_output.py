@@ -0,0 +1,78 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+from yarc import ActuatorFilter, Emulator
+from yarc.opcode import Opcode
+
+def command(opcode, *args):
+    """The bytes of a command."""
+    return opcode.value + bytes(args)
+
+FORWARD = command(Opcode.DRIVE_DIRECT, 0, 100, 0, 100)
+BACKWARD = command(Opcode.DRIVE_DIRECT, 0xFF, 0x9C, 0xFF, 0x9C)
+LEDS = command(Opcode.LEDS, 1, 0, 255)
+
+def test_repeats_suppressed():
+    filt = ActuatorFilter()
+    assert filt.filter([FORWARD], 0.0) == [FORWARD]
+    assert filt.filter([FORWARD], 0.1) == []
+    assert filt.filter([LEDS], 0.2) == [LEDS]
+    assert filt.filter([BACKWARD], 0.3) == [BACKWARD]
+    assert filt.filter([BACKWARD, LEDS], 0.4) == []
+    assert filt.suppressed == 3
+
+def test_refresh():
+    filt = ActuatorFilter(refresh=0.5)
+    assert filt.filter([FORWARD], 0.0) == [FORWARD]
+    assert filt.filter([FORWARD], 0.4) == []
+    assert filt.filter([FORWARD], 0.5) == [FORWARD]
+    assert filt.filter([FORWARD], 0.9) == []
+    filt = ActuatorFilter(refresh=None)
+    assert filt.filter([FORWARD], 0.0) == [FORWARD]
+    assert filt.filter([FORWARD], 100.0) == []
+
+def test_coalesced():
+    filt = ActuatorFilter()
+    assert filt.filter([FORWARD, LEDS, BACKWARD], 0.0) == [LEDS, BACKWARD]
+    assert filt.coalesced == 1
+
+def test_mode_change():
+    filt = ActuatorFilter()
+    filt.filter([FORWARD, LEDS], 0.0)
+    safe = Opcode.SAFE.value
+    assert filt.filter([safe, FORWARD], 0.1) == [safe, FORWARD]
+    assert filt.filter([safe], 0.2) == [safe]
+    assert filt.filter([LEDS], 0.3) == [LEDS]
+    filt.reset()
+    assert filt.filter([LEDS], 0.4) == [LEDS]
+
+def test_roomba_output_filter():
+    emulator = Emulator()
+    bot = emulator.roomba()
+    bot.output_filter = filt = ActuatorFilter()
+    bot.start()
+    bot.safe()
+    for _ in range(3):
+        bot.drive_direct(100, 100)
+    with bot.batch():
+        bot.drive_direct(50, 50)
+        bot.drive_direct(-50, -50)
+    emulator.step(0.015)
+    assert emulator.velocities == (-50, -50)
+    assert filt.suppressed == 2
+    assert filt.coalesced == 1
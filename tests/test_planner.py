@@ -0,0 +1,86 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import itertools
+import random
+
+import pytest
+
+from yarc.planner import GROUPS, plan_query
+from yarc.sensor import Sensor
+
+def sensors(*packet_ids):
+    """Get a tuple of the `Sensor`s with the given packet ids."""
+    return tuple(Sensor(i) for i in packet_ids) # pylint: disable=no-value-for-parameter
+
+def cheapest(requested, stream):
+    """The fewest bytes for the requested sensors found by trying every combination of groups."""
+    wanted = {s for s in requested if s.name[0] != '_'}
+    groups = [g for g in GROUPS if wanted & set(g.sensors)]
+    best = None
+    for count in range(len(groups) + 1):
+        for chosen in itertools.combinations(groups, count):
+            covered = set().union(*(g.sensors for g in chosen))
+            packets = list(chosen) + list(wanted - covered)
+            nbytes = (3 if stream else 2) + sum(p.size + 1 for p in packets)
+            best = nbytes if best is None else min(best, nbytes)
+    return best
+
+
+@pytest.mark.parametrize('stream', [False, True])
+@pytest.mark.parametrize('packet_ids, packets', [
+    (range(21, 27), (Sensor.GROUP_21_26,)),
+    ((22, 23, 25, 26), (Sensor.GROUP_21_26,)),
+    (range(46, 52), (Sensor.GROUP_46_51,)),
+    (range(54, 59), (Sensor.GROUP_54_58,)),
+    (range(7, 59), (Sensor.ALL_SENSORS,)),
+    ((21, 22), (Sensor.CHARGING_STATE, Sensor.VOLTAGE)),
+    ((43, 44), (Sensor.LEFT_ENCODER_COUNTS, Sensor.RIGHT_ENCODER_COUNTS)),
+])
+def test_groups(packet_ids, packets, stream):
+    plan = plan_query(sensors(*packet_ids), stream)
+    assert plan.packets == packets
+    assert plan.nbytes == (3 if stream else 2) + sum(p.size + 1 for p in packets)
+
+def test_group_requested():
+    # A group that is requested directly is never split up
+    plan = plan_query((Sensor.GROUP_21_26, Sensor.VOLTAGE))
+    assert plan.packets == (Sensor.GROUP_21_26,)
+    data = plan.layout.decode(bytes(plan.layout.size))
+    result = plan.extract(data)
+    assert result._fields == ('GROUP_21_26', 'VOLTAGE')
+    assert result.GROUP_21_26._fields == Sensor.GROUP_21_26.datatype._fields
+
+def test_extract():
+    plan = plan_query(sensors(26, 22, 23, 25))
+    data = plan.layout.decode(bytes((0, 0x3A, 0x98, 0xFF, 0x9C, 20, 0x07, 0xD0, 0x0B, 0xB8)))
+    assert plan.extract(data) == (3000, 15000, -100, 2000)
+    assert plan.extract(data)._fields == ('BATTERY_CAPACITY', 'VOLTAGE', 'CURRENT',
+                                          'BATTERY_CHARGE')
+
+@pytest.mark.parametrize('stream', [False, True])
+def test_cheapest(stream):
+    rand = random.Random(1234)
+    individual = [s for s in Sensor if s.name[0] != '_' and not hasattr(s, 'sensors')]
+    for _ in range(50):
+        requested = tuple(rand.sample(individual, rand.randint(1, 12)))
+        plan = plan_query(requested, stream)
+        assert plan.nbytes == cheapest(requested, stream)
+        covered = set()
+        for packet in plan.packets:
+            covered.update(getattr(packet, 'sensors', (packet,)))
+        assert set(requested) <= covered
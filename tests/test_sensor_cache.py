@@ -0,0 +1,126 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import pytest
+
+from yarc import Simulator, Sensor
+
+class CountingSerial:
+    """Wraps a serial port to keep each write made to it."""
+    def __init__(self, port):
+        self.port, self.writes = port, []
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+    def write(self, data):
+        self.writes.append(bytes(data))
+        return self.port.write(data)
+
+def streamed(count, *sensors, **kwargs):
+    """
+    Gets a simulator and a Roomba of it that has just streamed count frames of the sensors while
+    driving forward. Also returns the frames.
+    """
+    sim = Simulator()
+    bot = sim.roomba(**kwargs)
+    bot.start()
+    bot.safe()
+    bot.drive_direct(100, 100)
+    frames = []
+    def callback(frame):
+        frames.append(frame)
+        return len(frames) < count
+    bot.stream(callback, *sensors)
+    bot.serial = CountingSerial(bot.serial)
+    return sim, bot, frames
+
+def test_cached():
+    _, bot, frames = streamed(5, Sensor.VOLTAGE, Sensor.OI_MODE)
+    assert bot.voltage == frames[-1].VOLTAGE
+    assert bot.oi_mode == frames[-1].OI_MODE
+    assert bot.cached_sensor('VOLTAGE') == frames[-1].VOLTAGE
+    assert bot.serial.writes == []
+    bot.wall # pylint: disable=pointless-statement
+    assert len(bot.serial.writes) == 1 # not in the stream so it is read from the robot
+
+def test_accumulated():
+    _, bot, frames = streamed(20, Sensor.DISTANCE, Sensor.ANGLE, Sensor.VOLTAGE)
+    total = sum(frame.DISTANCE for frame in frames)
+    assert total > 0
+    assert bot.distance == total
+    assert bot.distance == 0 # reset once read
+    assert bot.angle == sum(frame.ANGLE for frame in frames)
+    assert bot.angle == 0
+    assert bot.serial.writes == []
+
+def test_accumulated_group():
+    _, bot, frames = streamed(20, Sensor.GROUP_17_20)
+    assert bot.distance == sum(frame.GROUP_17_20.DISTANCE for frame in frames) > 0
+    assert bot.distance == 0
+    assert bot.serial.writes == []
+
+def test_ttl():
+    sim, bot, frames = streamed(5, Sensor.VOLTAGE, Sensor.DISTANCE)
+    sim.clock.sleep(bot.sensor_ttl / 2)
+    assert bot.voltage == frames[-1].VOLTAGE
+    assert bot.serial.writes == []
+    sim.clock.sleep(bot.sensor_ttl) # now too old
+    assert bot.cached_sensor(Sensor.VOLTAGE, ttl=1) == frames[-1].VOLTAGE
+    assert bot.serial.writes == []
+    bot.voltage # pylint: disable=pointless-statement
+    assert len(bot.serial.writes) == 1
+    with pytest.raises(KeyError):
+        bot._cached_value(Sensor.VOLTAGE) # pylint: disable=protected-access
+
+    # The accumulated distance is still only reset by reading it
+    sim.clock.sleep(1)
+    assert bot.cached_sensor(Sensor.DISTANCE, ttl=2) == sum(frame.DISTANCE for frame in frames)
+    assert bot.distance > 50 # read from the robot
+    assert len(bot.serial.writes) == 2
+
+def test_no_ttl():
+    _, bot, _ = streamed(5, Sensor.VOLTAGE, sensor_ttl=None)
+    bot.voltage # pylint: disable=pointless-statement
+    assert len(bot.serial.writes) == 1
+
+def test_snapshot():
+    sim, bot, _ = streamed(1, Sensor.VOLTAGE)
+    sim.clock.sleep(1)
+    with bot.snapshot('BATTERY_CHARGE', Sensor.BATTERY_CAPACITY, Sensor.DISTANCE) as data:
+        assert len(bot.serial.writes) == 1
+        assert bot.battery_charge == data.BATTERY_CHARGE
+        assert bot.battery_capacity == data.BATTERY_CAPACITY
+        assert bot.distance == data.DISTANCE > 0
+        assert bot.distance == 0 # reset once read
+        sim.clock.sleep(1) # never too old
+        assert bot.battery_charge == data.BATTERY_CHARGE
+        assert len(bot.serial.writes) == 1
+        bot.voltage # pylint: disable=pointless-statement
+        assert len(bot.serial.writes) == 2 # not in the snapshot
+    bot.battery_charge # pylint: disable=pointless-statement
+    assert len(bot.serial.writes) == 3
+
+def test_snapshot_all():
+    _, bot, _ = streamed(1, Sensor.VOLTAGE)
+    with bot.snapshot() as data:
+        assert bot.voltage == data.ALL_SENSORS.VOLTAGE
+        assert bot.wall == data.ALL_SENSORS.WALL
+        assert bot.left_encoder_counts == data.ALL_SENSORS.LEFT_ENCODER_COUNTS
+        with bot.snapshot(Sensor.LEFT_ENCODER_COUNTS) as inner:
+            assert bot.left_encoder_counts == inner.LEFT_ENCODER_COUNTS
+        assert bot.left_encoder_counts == data.ALL_SENSORS.LEFT_ENCODER_COUNTS
+    assert len(bot.serial.writes) == 2
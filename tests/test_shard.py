@@ -0,0 +1,132 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from yarc import Simulator
+from yarc.sensor import Sensor
+
+pytest.importorskip('multiprocessing.shared_memory')
+from yarc.shard import SharedFrames, ShardedFleet # pylint: disable=wrong-import-position
+
+SENSORS = [Sensor.VOLTAGE, Sensor.LEFT_ENCODER_COUNTS]
+
+def make_frame(layout, number):
+    """A frame (not a valid stream packet) with every byte set to the low byte of a number."""
+    return bytes([number & 0xFF]) * layout.frame_size
+
+def write_frames(name, count):
+    """Publish count frames to robot 0 of the `SharedFrames` with the given name."""
+    frames = SharedFrames(SENSORS, 1, name)
+    try:
+        for number in range(1, count + 1):
+            frames.publish(0, make_frame(frames.layout, number), float(number))
+    finally:
+        frames.close()
+
+def no_brc(state): # pylint: disable=unused-argument
+    """A picklable `brc` function for robots on pseudo-terminals."""
+
+
+def test_publish_and_read():
+    frames = SharedFrames(SENSORS, 2)
+    try:
+        assert frames.read_raw(0) == (0, None, None)
+        assert frames.latest(1) is None
+        data = frames.layout.header + bytes([Sensor.VOLTAGE.packet_id, 0x3A, 0x98,
+                                             Sensor.LEFT_ENCODER_COUNTS.packet_id, 0, 5])
+        data += bytes((-sum(data) & 0xFF,))
+        frames.publish(1, data, 12.5)
+        frames.publish(1, data, 13.0)
+        assert frames.read_raw(1) == (4, 13.0, data)
+        assert frames.latest(1) == (13.0, (15000, 5))
+        assert frames.read_raw(0) == (0, None, None)
+    finally:
+        frames.close()
+
+def test_attach():
+    frames = SharedFrames(SENSORS, 1)
+    try:
+        other = SharedFrames(SENSORS, 1, frames.name)
+        frames.publish(0, make_frame(frames.layout, 7), 1.0)
+        assert other.read_raw(0) == (2, 1.0, make_frame(frames.layout, 7))
+        other.close()
+    finally:
+        frames.close()
+
+@pytest.mark.skipif(os.name != 'posix', reason='requires fork')
+def test_consistent_reads():
+    # Every frame read while another process is writing is a whole frame with its own timestamp
+    frames = SharedFrames(SENSORS, 1)
+    count = 20000
+    writer = multiprocessing.get_context('fork').Process(target=write_frames,
+                                                         args=(frames.name, count))
+    try:
+        writer.start()
+        last, reads = 0, 0
+        while last < 2*count:
+            seq, timestamp, frame = frames.read_raw(0, 5)
+            if seq == 0:
+                continue
+            assert seq % 2 == 0 and seq >= last
+            assert timestamp == seq // 2
+            assert frame == make_frame(frames.layout, seq // 2)
+            last, reads = seq, reads + 1
+        assert reads > 1
+    finally:
+        writer.join(5)
+        frames.close()
+
+def test_stuck_writer():
+    frames = SharedFrames(SENSORS, 1)
+    seqs = frames.memory.buf.cast('Q')
+    try:
+        seqs[0] = 3 # a writer that never finished
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            frames.read_raw(0, 0.05)
+        assert time.monotonic() - start < 1
+        seqs[0] = 4
+        assert frames.read_raw(0)[0] == 4
+    finally:
+        seqs.release()
+        frames.close()
+
+@pytest.mark.skipif(os.name != 'posix', reason='requires pseudo-terminals')
+def test_sharded_fleet():
+    sims = [Simulator(clock=time) for _ in range(3)]
+    for i, sim in enumerate(sims):
+        sim.set_sensor(Sensor.VOLTAGE, 15000 + i)
+    with ShardedFleet([sim.open_pty() for sim in sims], SENSORS, workers=2, brc=no_brc) as fleet:
+        assert len(fleet) == 3
+        assert fleet.submit(2, 'safe').result(5) is None
+        assert fleet.submit(2, 'drive_direct', 100, 100).result(5) is None
+        with pytest.raises(AttributeError):
+            fleet.submit(0, 'no_such_method').result(5)
+        with pytest.raises(TypeError):
+            fleet.submit(1, 'batch').result(5) # a context manager cannot be sent back
+        deadline = time.monotonic() + 5
+        while any(fleet.latest(i) is None for i in range(3)) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert [fleet.latest(i)[1].VOLTAGE for i in range(3)] == [15000, 15001, 15002]
+        assert not fleet.errors
+    assert sims[2].velocities == (0, 0) # stopped when the robots were closed
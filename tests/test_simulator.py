@@ -0,0 +1,106 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import math
+import time
+
+import pytest
+
+from yarc import Simulator, VirtualClock
+from yarc.enums import BumpAndWheelDrops
+from yarc.sensor import Sensor
+from yarc.simulator import ROBOT_RADIUS, World
+
+def connect(sim):
+    """Connect a `Roomba` in full mode to a simulator."""
+    bot = sim.roomba()
+    bot.start()
+    bot.full()
+    return bot
+
+def wait(sim, seconds):
+    """Let time pass for a simulator, the emulator only catches up when it is used."""
+    sim.clock.sleep(seconds)
+    sim.update()
+
+def test_virtual_clock():
+    clock = VirtualClock(10.0)
+    assert clock.monotonic() == clock.time() == clock.perf_counter() == 10.0
+    clock.sleep(1.5)
+    clock.sleep(-1)
+    assert clock.monotonic() == 11.5
+
+def test_world():
+    world = World(1000, 1000, obstacles=[(600, 400, 500, 600)], cliffs=[(0, 900, 1000, 1000)])
+    assert len(world.contacts(500, 500, 100)) == 1 # inside the obstacle
+    assert world.contacts(300, 300, 100) == []
+    assert world.contacts(50, 300, 100) == [math.pi]
+    assert world.contacts(300, 500, 250) == [0.0]
+    assert world.is_cliff(500, 950) and not world.is_cliff(500, 850)
+
+def test_drive():
+    sim = Simulator()
+    bot = connect(sim)
+    start = time.perf_counter()
+    bot.drive_direct(100, 100)
+    wait(sim, 1)
+    assert sim.x == pytest.approx(100, abs=2) and sim.y == pytest.approx(0, abs=1e-6)
+    assert bot.distance == pytest.approx(100, abs=2)
+    assert time.perf_counter() - start < 0.5 # much faster than real time
+    bot.drive_direct(100, -100) # turn in place counter clockwise
+    wait(sim, math.radians(90) * 235 / 2 / 100)
+    bot.drive_direct(0, 0)
+    assert math.degrees(sim.heading) == pytest.approx(90, abs=2)
+    assert bot.angle == pytest.approx(90, abs=2)
+    assert sim.x == pytest.approx(100, abs=2)
+
+def test_bump():
+    sim = Simulator(World(1000, 1000), x=500, y=500)
+    bot = connect(sim)
+    bot.drive_direct(200, 200)
+    wait(sim, 3)
+    assert sim.x == pytest.approx(1000 - ROBOT_RADIUS, abs=5)
+    bumps = BumpAndWheelDrops(bot.bumps_and_wheel_drops)
+    assert bumps == BumpAndWheelDrops.BUMP_LEFT | BumpAndWheelDrops.BUMP_RIGHT
+    counts = bot.left_encoder_counts
+    wait(sim, 0.5)
+    assert bot.left_encoder_counts == counts # the wheels are stalled
+    bot.drive_direct(-200, -200)
+    wait(sim, 0.5)
+    assert sim.x < 1000 - ROBOT_RADIUS - 50
+    assert bot.bumps_and_wheel_drops == 0
+
+def test_cliff():
+    sim = Simulator(World(cliffs=[(400, -1000, 1000, 1000)]))
+    bot = connect(sim)
+    assert not bot.cliff_front_left and bot.cliff_signal_front_left > 0
+    bot.drive_direct(200, 200)
+    wait(sim, 2)
+    bot.drive_direct(0, 0)
+    assert bot.cliff_front_left and bot.cliff_front_right
+    assert bot.cliff_signal_front_left == 0
+
+def test_stream():
+    sim = Simulator()
+    bot = connect(sim)
+    bot.drive_direct(100, 100)
+    frames = []
+    bot.stream(lambda frame: frames.append(frame) or len(frames) < 100,
+               Sensor.DISTANCE, Sensor.LEFT_ENCODER_COUNTS)
+    assert sum(frame.DISTANCE for frame in frames) == pytest.approx(150, abs=3)
+    assert frames[-1].LEFT_ENCODER_COUNTS > frames[0].LEFT_ENCODER_COUNTS
@@ -0,0 +1,161 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import struct
+import threading
+import time
+
+import pytest
+
+from yarc import Emulator
+from yarc.enums import OIMode
+from yarc.sensor import Sensor
+from yarc.stream import StreamLayout, StreamParser, StreamStats
+
+LAYOUT = StreamLayout([Sensor.VOLTAGE, Sensor.OI_MODE])
+
+def make_frame(voltage, mode=OIMode.SAFE, layout=LAYOUT):
+    """Make a stream packet (header through checksum) of the VOLTAGE and OI_MODE sensors."""
+    data = layout.header + struct.pack('>BHBB', Sensor.VOLTAGE.packet_id, voltage,
+                                       Sensor.OI_MODE.packet_id, mode)
+    return data + bytes((-sum(data) & 0xFF,))
+
+def wait_for(condition, timeout=5):
+    """Wait for a condition to be True."""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert condition()
+
+def voltages(frames):
+    """The voltages of a list of frames returned by `StreamParser.feed()`."""
+    return [LAYOUT.decode(frame, 2).VOLTAGE for frame in frames]
+
+
+def test_layout():
+    assert LAYOUT.size == 5
+    assert LAYOUT.frame_size == 8
+    frame = make_frame(15000)
+    assert StreamLayout.checksum_ok(frame)
+    assert LAYOUT.check_ids(frame[2:-1])
+    assert LAYOUT.decode(frame, 2) == (15000, OIMode.SAFE)
+
+def test_clean_feed():
+    parser = StreamParser(LAYOUT)
+    frames = parser.feed(b''.join(make_frame(v) for v in range(10, 15)))
+    assert voltages(frames) == [10, 11, 12, 13, 14]
+    assert parser.stats == StreamStats(5, 0, 0, 0)
+
+def test_split_feed():
+    parser = StreamParser(LAYOUT)
+    data = b''.join(make_frame(v) for v in range(20, 24))
+    found = []
+    for i in range(0, len(data), 3): # splits the frames at every possible position
+        found.extend(parser.feed(data[i:i+3]))
+    assert voltages(found) == [20, 21, 22, 23]
+    assert parser.stats == StreamStats(4, 0, 0, 0)
+
+def test_byte_at_a_time():
+    parser = StreamParser(LAYOUT)
+    found = []
+    for byte in make_frame(1) + make_frame(2):
+        found.extend(parser.feed(bytes((byte,))))
+    assert voltages(found) == [1, 2]
+
+def test_leading_garbage():
+    parser = StreamParser(LAYOUT)
+    frames = parser.feed(b'\x00\xff\x13' + make_frame(30) + make_frame(31))
+    assert voltages(frames) == [30, 31]
+    assert parser.stats == StreamStats(2, 3, 0, 0)
+
+def test_bad_checksum():
+    parser = StreamParser(LAYOUT)
+    bad = bytearray(make_frame(41))
+    bad[-1] ^= 0x55
+    frames = parser.feed(make_frame(40) + bytes(bad) + make_frame(42))
+    assert voltages(frames) == [40, 42]
+    stats = parser.stats
+    assert stats.frames == 2
+    assert stats.bad_checksums == 1
+    assert stats.dropped_bytes == len(bad)
+    assert stats.resyncs == 1
+
+def test_truncated_frame():
+    parser = StreamParser(LAYOUT)
+    frames = parser.feed(make_frame(50) + make_frame(51)[:5] + make_frame(52) + make_frame(53))
+    assert voltages(frames)[0] == 50
+    assert voltages(frames)[-2:] == [52, 53]
+    assert parser.stats.resyncs == 1
+
+def test_first_frame_ids_checked():
+    # A frame of other sensors that happens to have the same length and a valid checksum is not
+    # accepted before the parser is synchronized
+    other = StreamLayout([Sensor.CURRENT, Sensor.CHARGING_STATE])
+    data = other.header + struct.pack('>BhBB', Sensor.CURRENT.packet_id, -100,
+                                      Sensor.CHARGING_STATE.packet_id, 0)
+    data += bytes((-sum(data) & 0xFF,))
+    assert other.header == LAYOUT.header
+    parser = StreamParser(LAYOUT)
+    frames = parser.feed(data + make_frame(60))
+    assert voltages(frames) == [60]
+    assert parser.stats.dropped_bytes == len(data)
+
+def test_reset():
+    parser = StreamParser(LAYOUT)
+    assert parser.feed(make_frame(70)[:4]) == []
+    parser.reset()
+    assert voltages(parser.feed(make_frame(71))) == [71]
+
+def test_background_stream():
+    emulator = Emulator(clock=time)
+    emulator.set_sensor(Sensor.VOLTAGE, 15000)
+    bot = emulator.roomba()
+    bot.start()
+    stream = bot.start_background_stream(Sensor.VOLTAGE, history=4)
+    try:
+        frames = []
+        stream.subscribe(lambda frame: frames.append(frame) or len(frames) < 3)
+        wait_for(lambda: len(stream.history()) == 4)
+        assert len(frames) == 3 # unsubscribed once it returned False
+        timestamp, frame = stream.latest
+        assert frame.VOLTAGE == 15000 and stream.frame is frame
+        assert timestamp <= time.monotonic()
+        with stream.paused():
+            assert not stream.running
+            assert bot.voltage == 15000
+        assert stream.running
+    finally:
+        bot.stop_background_stream()
+    assert not stream.running and stream.error is None
+
+def test_background_stream_blocked():
+    bot = Emulator(clock=time).roomba()
+    bot.start()
+    stream = bot.start_background_stream(Sensor.VOLTAGE)
+    release = threading.Event()
+    stream.subscribe(lambda frame: release.wait(5))
+    try:
+        wait_for(lambda: stream.latest is not None)
+        with pytest.raises(TimeoutError):
+            with stream.paused(0.05):
+                pass
+        assert not stream.stop(0.05)
+        assert stream.running
+    finally:
+        release.set()
+        bot.stop_background_stream()
+    assert not stream.running
@@ -0,0 +1,220 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import time
+
+import pytest
+
+from yarc import Simulator, Sensor, TelemetryRecorder, Replay
+from yarc.simulator import VirtualClock
+from yarc.telemetry import flag_columns
+
+SENSORS = (Sensor.DISTANCE, Sensor.ANGLE, Sensor.GROUP_7_26)
+
+def driving():
+    """Get a Roomba of a simulator that is driving in a circle."""
+    sim = Simulator()
+    bot = sim.roomba()
+    bot.start()
+    bot.safe()
+    bot.drive_direct(100, 120)
+    return bot
+
+def record(bot, path, count, *sensors, **kwargs):
+    """Record count frames of a stream to the log at the path, returning the decoded frames."""
+    frames = []
+    def callback(frame):
+        frames.append(frame)
+        return len(frames) < count
+    with TelemetryRecorder(path, **kwargs) as recorder:
+        bot.stream(callback, *(sensors or SENSORS), recorder=recorder)
+    assert recorder.frames == count
+    return frames
+
+def test_record_and_replay(tmp_path):
+    path = str(tmp_path / 'run.tlm')
+    bot = driving()
+    frames = record(bot, path, 100)
+    replay = Replay(path)
+    assert len(replay) == 100 and replay.sensors == SENSORS
+    assert [frame for _, frame in replay.decoded()] == frames
+    timestamps = [timestamp for timestamp, _ in replay]
+    assert timestamps == sorted(timestamps)
+    assert all(len(frame) == replay.record_size - 8 for _, frame in replay)
+
+    played = []
+    stats = replay.play(lambda frame: played.append(frame) or True, speed=None)
+    assert played == frames and stats.frames == 100
+    assert [frame.DISTANCE for _, frame in replay.decoded(lazy=True)] == \
+        [frame.DISTANCE for frame in frames]
+
+def test_play_speed(tmp_path):
+    path = str(tmp_path / 'run.tlm')
+    record(driving(), path, 50)
+    replay = Replay(path)
+    recorded = [timestamp for timestamp, _ in replay]
+    for speed in (1.0, 2.0):
+        clock, times = VirtualClock(), []
+        replay.play(lambda frame: times.append(clock.monotonic()) or True, speed=speed, clock=clock)
+        assert len(times) == 50
+        assert times[-1] - times[0] == pytest.approx((recorded[-1] - recorded[0]) / speed, abs=0.02)
+
+def test_append(tmp_path):
+    path = str(tmp_path / 'run.tlm')
+    bot = driving()
+    frames = record(bot, path, 30)
+    with open(path, 'ab') as file:
+        file.write(b'\x00\x01\x02') # an incomplete record, like from a crash
+    frames += record(bot, path, 20)
+    replay = Replay(path)
+    assert len(replay) == 50
+    assert [frame for _, frame in replay.decoded()] == frames
+
+    with pytest.raises(ValueError):
+        record(bot, path, 1, Sensor.VOLTAGE) # a different stream
+    assert len(Replay(path)) == 50
+
+def test_not_a_log(tmp_path):
+    path = tmp_path / 'other.tlm'
+    path.write_bytes(b'something else')
+    with pytest.raises(ValueError):
+        Replay(str(path))
+    path.write_bytes(b'YARCTLM\x01\x03\x13')
+    with pytest.raises(ValueError):
+        Replay(str(path))
+
+def test_array(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    path = str(tmp_path / 'run.tlm')
+    frames = record(driving(), path, 100)
+    replay = Replay(path)
+    array = replay.array()
+    assert isinstance(array, numpy.memmap) and len(array) == 100
+    assert array.dtype.names[:4] == ('timestamp', 'DISTANCE', 'ANGLE', 'BUMPS_AND_WHEEL_DROPS')
+    assert list(array['timestamp']) == [timestamp for timestamp, _ in replay]
+    assert list(array['DISTANCE']) == [frame.DISTANCE for frame in frames]
+    assert list(array['ANGLE']) == [frame.ANGLE for frame in frames]
+    assert list(array['VOLTAGE']) == [frame.GROUP_7_26.VOLTAGE for frame in frames]
+    assert list(array['CHARGING_STATE']) == [frame.GROUP_7_26.CHARGING_STATE for frame in frames]
+    assert list(array['WALL']) == [frame.GROUP_7_26.WALL for frame in frames]
+    with pytest.raises(ValueError):
+        array['VOLTAGE'][0] = 0 # read-only
+
+def test_flag_columns():
+    numpy = pytest.importorskip('numpy')
+    values = numpy.array([0, 1, 2, 3, 12], 'u1')
+    flags = flag_columns(values, Sensor.BUMPS_AND_WHEEL_DROPS)
+    assert list(flags['BUMP_RIGHT']) == [False, True, False, True, False]
+    assert list(flags['BUMP_LEFT']) == [False, False, True, True, False]
+    assert list(flags['WHEEL_DROP_RIGHT']) == [False, False, False, False, True]
+    assert list(flags['WHEEL_DROP_LEFT']) == [False, False, False, False, True]
+    with pytest.raises(TypeError):
+        flag_columns(values, Sensor.VOLTAGE)
+
+def check_ranges(replay):
+    """Check that the frames found in ranges of time are the same as filtering all of them."""
+    timestamps = [timestamp for timestamp, _ in replay]
+    assert timestamps == sorted(timestamps)
+    middle = timestamps[len(timestamps) // 2]
+    ranges = [(None, None), (timestamps[0] - 1, timestamps[0]), (timestamps[-1] + 1, None),
+              (middle, middle), (middle, None), (None, middle),
+              (timestamps[10], timestamps[300]), (timestamps[63], timestamps[64] + 0.001),
+              ((timestamps[100] + timestamps[101]) / 2, timestamps[-1])]
+    for t0, t1 in ranges:
+        expected = [timestamp for timestamp in timestamps
+                    if (t0 is None or timestamp >= t0) and (t1 is None or timestamp < t1)]
+        assert [timestamp for timestamp, _ in replay.frames(t0, t1)] == expected
+        assert replay.range(t0, t1)[1] - replay.range(t0, t1)[0] == len(expected)
+
+def test_index(tmp_path):
+    path = str(tmp_path / 'run.tlm')
+    record(driving(), path, 500, index_interval=64)
+    replay = Replay(path)
+    index = replay.index
+    assert [entry[0] for entry in index] == list(range(0, 500, 64))
+    timestamps = [timestamp for timestamp, _ in replay]
+    assert [entry[1] for entry in index] == timestamps[::64]
+    assert all(entry[2] == entry[2] for entry in index) # wall-clock times are known
+    check_ranges(replay)
+    out = []
+    replay.play(lambda frame: out.append(frame) or True, speed=None, t0=timestamps[10],
+                t1=timestamps[20])
+    assert len(out) == 10
+
+def test_index_repair(tmp_path):
+    path = str(tmp_path / 'run.tlm')
+    bot = driving()
+    record(bot, path, 300, index_interval=64)
+    size = os.path.getsize(path + '.idx')
+    with open(path + '.idx', 'r+b') as file:
+        file.truncate(size - 30) # loses the last entry and part of another
+    with open(path, 'ab') as file:
+        file.write(b'xx')
+    record(bot, path, 200)
+    replay = Replay(path)
+    assert len(replay) == 500
+    assert [entry[0] for entry in replay.index] == list(range(0, 500, 64))
+    timestamps = [timestamp for timestamp, _ in replay]
+    assert [entry[1] for entry in replay.index] == timestamps[::64]
+    check_ranges(replay)
+
+    # The index is rebuilt from the log if it is missing, without the wall-clock times
+    os.remove(path + '.idx')
+    replay = Replay(path)
+    assert [entry[1] for entry in replay.index] == timestamps[::256]
+    check_ranges(replay)
+    with pytest.raises(ValueError):
+        replay.to_timestamp(time.time())
+
+def test_to_timestamp(tmp_path):
+    path = str(tmp_path / 'run.tlm')
+    record(driving(), path, 100, index_interval=10)
+    replay = Replay(path)
+    _, timestamp, wall = replay.index[-1]
+    assert replay.to_timestamp(wall) == timestamp
+    assert replay.to_timestamp(wall + 5) == pytest.approx(timestamp + 5)
+    _, timestamp, wall = replay.index[0]
+    assert replay.to_timestamp(wall - 5) == pytest.approx(timestamp - 5)
+
+def test_summarize(tmp_path):
+    numpy = pytest.importorskip('numpy')
+    path = str(tmp_path / 'run.tlm')
+    record(driving(), path, 300, Sensor.VOLTAGE, Sensor.LEFT_ENCODER_COUNTS, Sensor.WALL)
+    replay = Replay(path)
+    array = replay.array()
+    summary = replay.summarize(0.5)
+    assert summary.dtype.names == ('start', 'count', 'VOLTAGE', 'LEFT_ENCODER_COUNTS', 'WALL')
+    assert summary['count'].sum() == 300
+    assert list(summary['start'] % 0.5) == pytest.approx([0] * len(summary), abs=1e-9)
+    for interval in summary:
+        frames = array[(array['timestamp'] >= interval['start']) &
+                       (array['timestamp'] < interval['start'] + 0.5)]
+        assert len(frames) == interval['count']
+        for name in ('VOLTAGE', 'LEFT_ENCODER_COUNTS', 'WALL'):
+            column = frames[name].astype('f8')
+            assert interval[name]['min'] == column.min() and interval[name]['max'] == column.max()
+            assert interval[name]['mean'] == pytest.approx(column.mean())
+
+    t0, t1 = summary['start'][1], summary['start'][3]
+    part = replay.summarize(0.5, sensors=[Sensor.VOLTAGE, 'WALL'], t0=t0, t1=t1)
+    assert part.dtype.names == ('start', 'count', 'VOLTAGE', 'WALL')
+    assert list(part['start']) == [t0, summary['start'][2]]
+    assert list(part['VOLTAGE']['mean']) == list(summary['VOLTAGE']['mean'][1:3])
+    assert len(replay.summarize(0.5, t0=t1, t1=t0)) == 0
+    assert isinstance(part, numpy.ndarray)
@@ -0,0 +1,71 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import os
+import time
+
+import pytest
+
+from yarc import AsyncRoomba, Simulator
+from yarc.motion import CYCLE
+
+# Drive forward, turn left, and then drive backward
+SETPOINTS = [(0.0, 100, 100), (0.15, 150, 50), (0.3, -100, -100)]
+
+def check_stats(stats, sim, max_error=CYCLE):
+    """Check the stats of playing the `SETPOINTS` and that the robot is doing the last one."""
+    assert stats.sent == len(SETPOINTS)
+    assert stats.skipped == 0
+    assert stats.max_error <= max_error
+    assert sim.velocities == (-100, -100)
+
+def test_play_trajectory():
+    sim = Simulator()
+    bot = sim.roomba()
+    bot.start()
+    bot.safe()
+    check_stats(bot.play_trajectory(SETPOINTS), sim)
+
+def test_play_trajectory_passive():
+    sim = Simulator()
+    bot = sim.roomba()
+    bot.start()
+    with pytest.raises(RuntimeError):
+        bot.play_trajectory(SETPOINTS)
+
+@pytest.mark.skipif(os.name != 'posix', reason='requires pseudo-terminals')
+def test_async_play_trajectory():
+    pytest.importorskip('serial_asyncio')
+    sim = Simulator(clock=time)
+    name = sim.open_pty()
+    async def play():
+        bot = await AsyncRoomba.open(name, brc=lambda state: None)
+        bot.start()
+        bot.safe()
+        try:
+            stats = await bot.play_trajectory(SETPOINTS)
+            await asyncio.sleep(0.05) # let the robot recieve the last setpoint
+            return stats
+        finally:
+            bot.serial.close()
+    loop = asyncio.new_event_loop()
+    try:
+        stats = loop.run_until_complete(play())
+    finally:
+        loop.close()
+    check_stats(stats, sim, 2*CYCLE) # in real time over a pseudo-terminal
@@ -0,0 +1,82 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import pytest
+
+from yarc import Roomba, Simulator, TranscriptRecorder, TranscriptReplay
+from yarc.sensor import Sensor
+from yarc.transcript import READ, RESET_INPUT, WRITE, read_transcript
+
+SENSORS = (Sensor.DISTANCE, Sensor.LEFT_ENCODER_COUNTS)
+
+def session(bot):
+    """Drive a robot while reading its sensors, returning everything that was read."""
+    bot.start()
+    bot.safe()
+    results = [bot.query_list(Sensor.VOLTAGE, Sensor.OI_MODE)]
+    bot.drive_direct(200, 200)
+    frames = []
+    bot.stream(lambda frame: frames.append(frame) or len(frames) < 10, *SENSORS)
+    results.append(frames)
+    bot.stop()
+    return results
+
+def record(path, close=True):
+    """Record a session on the simulator, returning what was read."""
+    sim = Simulator()
+    bot = sim.roomba()
+    bot.serial = TranscriptRecorder(bot.serial, path, clock=sim.clock)
+    results = session(bot)
+    if close:
+        bot.close()
+    else:
+        bot.serial.close()
+    return results
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / 'session.ytx')
+    expected = record(path)
+    kinds = [kind for _, kind, _ in read_transcript(path)]
+    assert WRITE in kinds and READ in kinds and RESET_INPUT in kinds
+    replay = TranscriptReplay(path)
+    bot = Roomba(replay, brc=lambda state: None)
+    assert session(bot) == expected
+    assert not replay.finished
+    bot.close() # the close was recorded too
+    assert replay.finished and not replay.is_open
+
+def test_mismatch(tmp_path):
+    path = str(tmp_path / 'session.ytx')
+    record(path)
+    bot = Roomba(TranscriptReplay(path), brc=lambda state: None)
+    bot.start()
+    with pytest.raises(ValueError):
+        bot.full() # the transcript has safe()
+    bot.serial.close()
+
+def test_close_after_end(tmp_path):
+    # The robot was not closed in the transcript so closing it after the replay ends (which also
+    # happens when the Roomba is garbage collected) only closes the port
+    path = str(tmp_path / 'session.ytx')
+    expected = record(path, close=False)
+    replay = TranscriptReplay(path)
+    bot = Roomba(replay, brc=lambda state: None)
+    assert session(bot) == expected
+    assert replay.finished
+    bot.close()
+    assert not replay.is_open
@@ -19,3 +19,12 @@ from .enums import * # pylint: disable=wildcard-import
 from .opcode import Opcode
 from .sensor import Sensor
 from .roomba import Roomba
+from .async_roomba import AsyncRoomba
+from .emulator import Emulator
+from .simulator import Simulator, VirtualClock, World
+from .telemetry import TelemetryRecorder, Replay
+from .transcript import TranscriptRecorder, TranscriptReplay
+from .output import ActuatorFilter
+from .odometry import Odometry, Pose
+from .fleet import Fleet
+from .shard import ShardedFleet, SharedFrames
@@ -0,0 +1,555 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+
+import serial
+try:
+    import serial_asyncio
+except ImportError:
+    serial_asyncio = None
+
+from .motion import Move
+from .opcode import Opcode
+from .roomba import Roomba, BAUD_CODES
+from .stream import StreamParser, BaseBackgroundStream
+from .trajectory import TrajectoryPlayer
+
+class _SerialProtocol(asyncio.Protocol):
+    """Collects the data recieved from the serial port so it can be read with deadlines."""
+    def __init__(self):
+        self.transport = None
+        self.buffer = bytearray()
+        self.closed = False
+        self.__waiter = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def data_received(self, data):
+        self.buffer += data
+        self.__wake()
+
+    def connection_lost(self, exc):
+        self.closed = True
+        self.__wake()
+
+    def __wake(self):
+        if self.__waiter is not None and not self.__waiter.done():
+            self.__waiter.set_result(None)
+
+    async def wait(self, deadline):
+        """Wait for more data to arrive or the deadline (in event loop time) to pass."""
+        loop = asyncio.get_event_loop()
+        timeout = deadline - loop.time()
+        if timeout <= 0 or self.closed:
+            return
+        self.__waiter = loop.create_future()
+        try:
+            await asyncio.wait_for(self.__waiter, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self.__waiter = None
+
+    async def read(self, nbytes, timeout):
+        """
+        Reads nbytes from the buffer, waiting up to timeout seconds for them to arrive. If they
+        don't all arrive in time then fewer bytes are returned.
+        """
+        deadline = asyncio.get_event_loop().time() + timeout
+        while len(self.buffer) < nbytes and not self.closed:
+            if asyncio.get_event_loop().time() >= deadline:
+                break
+            await self.wait(deadline)
+        return self.take(nbytes)
+
+    def take(self, nbytes=None):
+        """Removes and returns up to nbytes (or all) bytes from the buffer without waiting."""
+        if nbytes is None or nbytes > len(self.buffer):
+            nbytes = len(self.buffer)
+        data = bytes(self.buffer[:nbytes])
+        del self.buffer[:nbytes]
+        return data
+
+class _TransportSerial:
+    """
+    Makes an asyncio serial transport look enough like a `serial.Serial` for the `Roomba` methods
+    that only write to it. Writes never block, they are buffered by the transport.
+    """
+    def __init__(self, transport, protocol, timeout):
+        self.transport = transport
+        self.protocol = protocol
+        self.timeout = timeout
+
+    def write(self, data):
+        """Queue the data to be written."""
+        self.transport.write(data)
+        return len(data)
+
+    def read(self, nbytes=1):
+        """Read up to nbytes that have already been recieved, never waiting."""
+        return self.protocol.take(nbytes)
+
+    def reset_input_buffer(self):
+        """Throw away all recieved data."""
+        self.protocol.buffer.clear()
+
+    def close(self):
+        """Close the transport once all queued data is written."""
+        self.transport.close()
+
+    @property
+    def in_waiting(self):
+        """The number of bytes recieved that haven't been read."""
+        return len(self.protocol.buffer)
+
+    @property
+    def is_open(self):
+        """True if the transport is still open."""
+        return not self.protocol.closed and not self.transport.is_closing()
+
+    @property
+    def baudrate(self):
+        """The baudrate of the underlying serial port."""
+        return self.transport.serial.baudrate
+    @baudrate.setter
+    def baudrate(self, baudrate):
+        self.transport.serial.baudrate = baudrate
+
+    @property
+    def rts(self):
+        """The RTS pin of the underlying serial port."""
+        return self.transport.serial.rts
+    @rts.setter
+    def rts(self, state):
+        self.transport.serial.rts = state
+
+    @property
+    def dtr(self):
+        """The DTR pin of the underlying serial port."""
+        return self.transport.serial.dtr
+    @dtr.setter
+    def dtr(self, state):
+        self.transport.serial.dtr = state
+
+
+class AsyncRoomba(Roomba):
+    """
+    A connection to a Roomba over a serial port for use with `asyncio`. This requires the
+    pyserial-asyncio package.
+
+    This is created with `await AsyncRoomba.open(port)` instead of the constructor. All of the
+    command methods (like `drive()` or `leds()`) are the same as for `Roomba` and never block since
+    the data is buffered by the transport. The methods that need to wait or read data from the
+    robot are coroutines instead, and instead of sleeping for a fixed amount of time they return as
+    soon as the data arrives (or raise an exception if it doesn't arrive before a deadline):
+      * `close()`, `wake()`, `reset()`, and `set_baud()` (which replaces setting `baud`)
+      * `sensor()`, `cached_sensor()`, and `query_list()`
+      * `drive_distance()`, `turn_angle()`, and `play_trajectory()`
+      * the sensor attributes, for example `await bot.voltage`
+      * `snapshot()` is an asynchronous context manager (`async with bot.snapshot(): ...`)
+      * `stream()` is an asynchronous iterator (`async for frame in bot.stream(...): ...`)
+      * `resume_stream_raw()` which calls the callback for each frame like `Roomba`
+
+    Background streams are read by a task on the event loop instead of a thread. Commands can be
+    gathered with `with bot.batch():` but aligning the batch to the robot's cycles would block so
+    it is not supported.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__last_stream = None # the layout and plan of the last stream started
+
+    @classmethod
+    async def open(cls, port, baudrate=115200, timeout=0.045, brc=None, sensor_ttl=0.045): # pylint: disable=too-many-arguments
+        """
+        Connect to the Roomba on the given port. The arguments are the same as the `Roomba`
+        constructor except that port must be the name of the port (or a pyserial URL).
+        """
+        if serial_asyncio is None:
+            raise ImportError('AsyncRoomba requires the pyserial-asyncio package')
+        if baudrate not in [19200, 115200]:
+            raise ValueError('baudrate')
+        transport, protocol = await serial_asyncio.create_serial_connection(
+            asyncio.get_event_loop(), _SerialProtocol, port, baudrate=baudrate)
+        return cls(_TransportSerial(transport, protocol, timeout), baudrate,
+                   timeout=timeout, brc=brc, sensor_ttl=sensor_ttl)
+
+    def __del__(self):
+        try:
+            if self.serial.is_open:
+                self.serial.close()
+        except RuntimeError:
+            pass # the event loop is already closed
+
+    async def _read(self, nbytes, timeout=None):
+        """
+        Reads exactly nbytes, waiting no longer than the time needed to transfer them plus the
+        timeout (which defaults to the timeout given when opening).
+        """
+        if timeout is None:
+            timeout = self.serial.timeout
+        data = await self.serial.protocol.read(nbytes, self._required_time(nbytes) + timeout)
+        if len(data) != nbytes:
+            raise serial.SerialTimeoutException('did not recieve expected data from Roomba')
+        return data
+
+    async def close(self): # pylint: disable=invalid-overridden-method
+        """
+        Stop the Roomba and close the serial connection. After this method is called this object is
+        not usable.
+        """
+        if not self.serial.is_open:
+            return
+        self.stop_background_stream()
+        self.power() # causes all LEDs and motors to stop and the Roomba returns to passive mode
+        await asyncio.sleep(0.03)
+        await self.wake()
+        self.stop()
+        self.serial.close()
+
+    async def reset(self, welcome_msg_bytes=6): # pylint: disable=invalid-overridden-method
+        """
+        This command resets the robot, as if you had removed and reinserted the battery. See
+        `Roomba.reset()` for more information. Unlike that method, this returns as soon as the
+        requested number of bytes of the welcome message arrive.
+        """
+        protocol = self.serial.protocol
+        self.serial.reset_input_buffer()
+        self._write(Opcode.RESET, True)
+        self.serial.baudrate = self._default_baudrate
+        if await protocol.read(12, 0.03) != b'Soft reset!\n':
+            raise ValueError()
+        if await protocol.read(1, 1.5) != b'\xfe':
+            raise ValueError()
+        return await protocol.read(welcome_msg_bytes, 5) + protocol.take()
+
+    async def wake(self, sleep_time=0.015): # pylint: disable=invalid-overridden-method
+        """Wake up robot. See `Roomba.wake()` for more information."""
+        self._brc(False)
+        await asyncio.sleep(sleep_time)
+        self._brc(True)
+        await asyncio.sleep(sleep_time)
+
+    def batch(self, align=False):
+        """
+        Gathers all commands sent in the `with` block and writes them with a single write. See
+        `Roomba.batch()` for more information. Aligning to the robot's cycles is not supported.
+        """
+        if align:
+            raise ValueError('AsyncRoomba batches cannot be aligned')
+        return super().batch()
+
+    baud = property(Roomba.baud.fget, doc="Get the current serial port baudrate.")
+    async def set_baud(self, baudrate):
+        """
+        This command sets the baud rate in bits per second (bps) at which OI commands and data are
+        sent. See `Roomba.baud` for more information.
+        """
+        self._write(Opcode.BAUD + BAUD_CODES[baudrate], True)
+        await asyncio.sleep(0.1) # required
+        self.serial.baudrate = baudrate
+
+    # Convience functions
+    async def turn_angle(self, angle, velocity=100, timeout=None): # pylint: disable=invalid-overridden-method, arguments-differ
+        """
+        Rotates a specific angle (in degrees) in place at a given velocity (the default is 100
+        mm/s). Returns the angle in degrees turned. See `Roomba.turn_angle()` for more information.
+        This is a coroutine so `asyncio.ensure_future()` can be used to run it without waiting.
+        """
+        return await self.__move(Move(self, angle=angle, velocity=velocity, timeout=timeout))
+    async def drive_distance(self, distance, velocity=100, timeout=None): # pylint: disable=invalid-overridden-method, arguments-differ
+        """
+        Drives a specific distance (in mm) at a given velocity (the default is 100 mm/s). Returns
+        the distance travelled in mm. See `Roomba.drive_distance()` for more information. This is a
+        coroutine so `asyncio.ensure_future()` can be used to run it without waiting.
+        """
+        return await self.__move(Move(self, distance=distance, velocity=velocity, timeout=timeout))
+    async def play_trajectory(self, setpoints, command='drive_direct'): # pylint: disable=invalid-overridden-method, arguments-differ
+        """
+        Plays a precomputed trajectory, sending each setpoint in step with the robot's 15 ms cycles
+        using a stream. Returns the `yarc.trajectory.TrajectoryStats` of how far off the timing of
+        the setpoints was. See `Roomba.play_trajectory()` for more information. This is a coroutine
+        so `asyncio.ensure_future()` can be used to run it without waiting.
+        """
+        return await self.__move(TrajectoryPlayer(self, setpoints, command))
+    async def __move(self, move):
+        try:
+            async with self.stream(*move.SENSORS) as frames:
+                async for frame in frames:
+                    if not move.update(frame):
+                        break
+        finally:
+            if not move.done:
+                self.drive_direct(0, 0)
+        return move.result()
+
+    # Input Commands
+    async def sensor(self, sensor, lazy=False): # pylint: disable=invalid-overridden-method
+        """
+        This command requests the OI to send a packet of sensor data bytes. See `Roomba.sensor()`
+        for more information.
+        """
+        sensor = Roomba._get_sensor(sensor)
+        self.serial.reset_input_buffer()
+        self._write(Opcode.SENSORS + bytes((sensor.packet_id,)), True)
+        data = await self._read(sensor.size)
+        if lazy and hasattr(sensor, 'layout'):
+            return sensor.layout.view(data)
+        return sensor.parse(data)
+    async def cached_sensor(self, sensor, ttl=None): # pylint: disable=invalid-overridden-method
+        """
+        Gets the value of a single sensor from the most recent streamed data if it is available
+        and no older than `ttl` seconds, otherwise the sensor is read from the robot. See
+        `Roomba.cached_sensor()` for more information.
+        """
+        try:
+            return self._cached_value(Roomba._get_sensor(sensor), ttl)
+        except KeyError:
+            return await self.sensor(sensor)
+    async def query_list(self, *sensors, optimize=False, lazy=False): # pylint: disable=invalid-overridden-method
+        """
+        This command lets you ask for a list of sensor packets. See `Roomba.query_list()` for more
+        information.
+        """
+        plan, layout = self._query_layout(sensors, optimize)
+        self.serial.reset_input_buffer()
+        self._write(Opcode.QUERY_LIST + layout.request, True)
+        data = await self._read(layout.size)
+        data = layout.view(data) if lazy else layout.decode(data)
+        return data if plan is None else plan.extract(data)
+    def snapshot(self, *sensors):
+        """
+        Reads a list of sensors with a single `query_list()` and, for the rest of the `async with`
+        block, answers all sensor attribute reads for those sensors from that one response. See
+        `Roomba.snapshot()` for more information.
+        """
+        return _AsyncSnapshot(self, sensors)
+    def stream(self, *sensors, optimize=False, lazy=False, recorder=None): # pylint: disable=arguments-differ
+        """
+        This command starts a stream of data packets. The list of packets requested is sent every
+        15 ms, which is the rate Roomba uses to update data.
+
+        Unlike `Roomba.stream()` this does not take a callback and instead returns an asynchronous
+        iterator of the frames. The stream is started when the first frame is requested and paused
+        when the iterator is closed, for example:
+
+            async with bot.stream('VOLTAGE', 'CURRENT') as frames:
+                async for frame in frames:
+                    ...
+
+        See `Roomba.stream()` for information about the other arguments.
+        """
+        plan, layout = self._stream_layout(sensors, optimize)
+        self.__last_stream = (layout, plan)
+        return AsyncStream(self, layout, plan, lazy, recorder)
+    async def resume_stream_raw(self, callback, lazy=False, recorder=None): # pylint: disable=invalid-overridden-method
+        """
+        This command lets you start the stream using the list of packets last requested. Like
+        `Roomba.resume_stream_raw()` the callback is given each frame until it returns False or the
+        stream is paused (which raises a `serial.SerialTimeoutException`). This can only be used
+        after `stream()` has been called on this object.
+        """
+        if self.__last_stream is None:
+            raise ValueError('no stream has been started')
+        layout, plan = self.__last_stream
+        async with AsyncStream(self, layout, plan, lazy, recorder, True) as frames:
+            async for frame in frames:
+                if not callback(frame):
+                    break
+    def start_background_stream(self, *sensors, history=256, optimize=False, lazy=False, # pylint: disable=too-many-arguments
+                                recorder=None):
+        """
+        Starts a stream of data packets that is read by a task on the event loop. Returns an
+        `AsyncBackgroundStream` (which is also saved as the `background_stream` attribute) that
+        always has the most recent frame available along with a history of the last `history`
+        frames. See `Roomba.start_background_stream()` for more information. This must be called
+        from a running event loop.
+        """
+        if self.background_stream is not None and self.background_stream.running:
+            raise ValueError('a background stream is already running')
+        sensors = [Roomba._get_sensor(sensor) for sensor in sensors] # checked by stream()
+        self.background_stream = AsyncBackgroundStream(self, sensors, history, optimize, lazy,
+                                                       recorder)
+        return self.background_stream
+
+
+class _AsyncSnapshot:
+    """Asynchronous context manager returned by `AsyncRoomba.snapshot()`."""
+    def __init__(self, roomba, sensors):
+        self.__roomba = roomba
+        self.__sensors = Roomba._snapshot_sensors(sensors) # pylint: disable=protected-access
+        self.__previous = None
+
+    async def __aenter__(self):
+        roomba, sensors = self.__roomba, self.__sensors
+        data = await roomba.query_list(*sensors, optimize=True)
+        self.__previous = roomba._snapshot # pylint: disable=protected-access
+        roomba._snapshot = Roomba._make_snapshot(sensors, data) # pylint: disable=protected-access
+        return data
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.__roomba._snapshot = self.__previous # pylint: disable=protected-access
+
+
+class AsyncStream: # pylint: disable=too-many-instance-attributes
+    """
+    Asynchronous iterator of the frames of a stream returned by `AsyncRoomba.stream()`. Corrupted
+    data is skipped like with `Roomba.stream()`. If no data is recieved before the deadline a
+    `serial.SerialTimeoutException` is raised. If resume is True then the paused stream is
+    resumed instead of starting a new one.
+    """
+    def __init__(self, roomba, layout, plan, lazy, recorder=None, resume=False): # pylint: disable=too-many-arguments
+        self.roomba = roomba
+        self.layout = layout
+        self.parser = StreamParser(layout)
+        self.recorder = recorder
+        self.__plan = plan
+        self.__lazy = lazy
+        self.__resume = resume
+        self.__frames = []
+        self.__started = self.__closed = False
+
+    @property
+    def stats(self):
+        """The `StreamStats` of the stream."""
+        return self.parser.stats
+
+    def __aiter__(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        await self.aclose()
+
+    async def aclose(self):
+        """Pause the stream."""
+        if self.__started and not self.__closed:
+            self.roomba.pause_stream()
+        self.__closed = True
+
+    def __start(self):
+        roomba = self.roomba
+        roomba._stream_parser = self.parser # pylint: disable=protected-access
+        if self.recorder is not None:
+            self.recorder.begin(self.layout)
+        roomba.serial.reset_input_buffer()
+        if self.__resume:
+            roomba._write(Opcode.STREAM_PAUSE_RESUME + b'\x01', True) # pylint: disable=protected-access
+        else:
+            roomba._write(Opcode.STREAM + self.layout.request, True) # pylint: disable=protected-access
+        self.__started = True
+
+    async def __anext__(self):
+        if self.__closed:
+            raise StopAsyncIteration
+        if not self.__started:
+            self.__start()
+            timeout = 0.1 # first iteration needs a bit longer wait time
+        else:
+            timeout = 0.03
+        protocol = self.roomba.serial.protocol
+        deadline = asyncio.get_event_loop().time() + timeout
+        while not self.__frames:
+            data = protocol.take()
+            if data:
+                self.__frames.extend(self.parser.feed(data))
+                deadline = asyncio.get_event_loop().time() + timeout
+            elif protocol.closed or asyncio.get_event_loop().time() >= deadline:
+                await self.aclose()
+                raise serial.SerialTimeoutException('stream stopped')
+            else:
+                await protocol.wait(deadline)
+        layout = self.layout
+        frame = self.__frames.pop(0)
+        timestamp = self.roomba._cycle = self.roomba.clock.monotonic() # pylint: disable=protected-access
+        if self.recorder is not None:
+            self.recorder.record(timestamp, frame)
+        frame = layout.view(frame, 2) if self.__lazy else layout.decode(frame, 2)
+        self.roomba._sensor_cache.update(layout.paths, frame, timestamp) # pylint: disable=protected-access
+        return frame if self.__plan is None else self.__plan.extract(frame)
+
+
+class AsyncBackgroundStream(BaseBackgroundStream):
+    """
+    A stream of sensor data being read by a task on the event loop. This is created with
+    `AsyncRoomba.start_background_stream()` and has the same attributes and methods as
+    `BackgroundStream` except that:
+      * the callbacks given to `subscribe()` are called on the event loop
+      * `stop()` does not wait for the task to finish, `wait()` does
+      * `paused()` is an asynchronous context manager (used with `async with`)
+    """
+    def __init__(self, roomba, sensors, history=256, optimize=False, lazy=False, recorder=None): # pylint: disable=too-many-arguments
+        super().__init__(roomba, sensors, history, optimize, lazy, recorder)
+        self.__task = None
+        self.__start()
+
+    def __start(self):
+        frames = self.roomba.stream(*self.sensors, optimize=self.optimize, lazy=self.lazy,
+                                    recorder=self.recorder)
+        self.__task = asyncio.ensure_future(self.__run(frames))
+
+    async def __run(self, frames):
+        try:
+            async with frames:
+                async for frame in frames:
+                    self._publish(frame)
+        except asyncio.CancelledError:
+            pass # stopped
+        except Exception as ex: # pylint: disable=broad-except
+            self.error = ex
+
+    @property
+    def running(self):
+        """True if the reader task is still running."""
+        return not self.__task.done()
+
+    def stop(self):
+        """Stop the stream, the task pauses the stream as it finishes."""
+        self.__task.cancel()
+
+    async def wait(self):
+        """Wait for the reader task to finish."""
+        await asyncio.wait([self.__task])
+
+    def paused(self):
+        """
+        Stops the stream for the `async with` block so that other sensors can be read from the
+        robot and then starts it again with the same sensors. The latest frame and history are
+        kept.
+        """
+        return _AsyncPaused(self, self.__start)
+
+
+class _AsyncPaused:
+    """Asynchronous context manager returned by `AsyncBackgroundStream.paused()`."""
+    def __init__(self, stream, start):
+        self.__stream = stream
+        self.__start = start
+        self.__running = False
+
+    async def __aenter__(self):
+        stream = self.__stream
+        self.__running = stream.running
+        stream.stop()
+        await stream.wait()
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        if self.__running:
+            self.__start()
@@ -0,0 +1,272 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+Benchmarks of the encoding, decoding, and round-trip costs of the library. Run with:
+
+    python -m yarc.benchmark [--quick] [--only NAME] [--output FILE]
+
+The results are written as JSON. Every benchmark reports the number of operations per second and
+the mean, median (p50), and 99th percentile (p99) time of a single operation in microseconds.
+Except for the round trips, the robot is emulated on a virtual clock so that only the time spent
+in this library (and the emulator) is measured and not any time waiting on the serial connection.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+
+from .emulator import Emulator
+from .opcode import Opcode
+from .roomba import Roomba
+from .sensor import Sensor
+from .simulator import VirtualClock
+from .stream import StreamLayout, STREAM_HEADER
+
+SENSOR_TYPES = (
+    ('int', Sensor.VOLTAGE),
+    ('bool', Sensor.WALL),
+    ('enum', Sensor.CHARGING_STATE),
+    ('flags', Sensor.BUMPS_AND_WHEEL_DROPS),
+    ('group', Sensor.GROUP_7_26),
+    ('all', Sensor.ALL_SENSORS),
+)
+
+QUERY_LISTS = (
+    ('1', (Sensor.VOLTAGE,)),
+    ('4', (Sensor.VOLTAGE, Sensor.CURRENT, Sensor.DISTANCE, Sensor.ANGLE)),
+    ('16', tuple(s for s in Sensor.ALL_SENSORS.sensors if s.name[0] != '_')[:16]), # pylint: disable=no-member
+    ('group', (Sensor.GROUP_7_26,)),
+    ('all', (Sensor.ALL_SENSORS,)),
+)
+
+STREAMS = (
+    ('voltage', (Sensor.VOLTAGE,)),
+    ('odometry', (Sensor.DISTANCE, Sensor.ANGLE, Sensor.LEFT_ENCODER_COUNTS,
+                  Sensor.RIGHT_ENCODER_COUNTS)),
+    ('group', (Sensor.GROUP_7_26,)),
+    ('all', (Sensor.ALL_SENSORS,)),
+)
+
+
+class _NullSerial: # pylint: disable=too-few-public-methods
+    """A serial port that throws away everything written to it."""
+    baudrate = 115200
+    timeout = 0.045
+    is_open = False
+    def write(self, data):
+        """Throw away the data."""
+        return len(data)
+
+
+class _Emulator(Emulator):
+    """An emulated robot that responds right away so that only the library is measured."""
+    LATENCY = 0
+
+
+class _StreamSerial:
+    """
+    A serial port that endlessly sends the same stream packet as fast as it is read, ignoring
+    everything written to it.
+    """
+    baudrate = 115200
+    timeout = 0.045
+    is_open = False
+    def __init__(self, frame, count=256):
+        self.__data = frame * count
+        self.__pos = 0
+    def write(self, data):
+        """Throw away the data."""
+        return len(data)
+    def reset_input_buffer(self):
+        """Nothing to reset."""
+    def readinto(self, buffer):
+        """Fill the buffer with the repeated stream packets."""
+        nbytes = len(buffer)
+        if self.__pos + nbytes > len(self.__data):
+            self.__pos %= len(self.__data) // 2
+        buffer[:] = self.__data[self.__pos:self.__pos+nbytes]
+        self.__pos += nbytes
+        return nbytes
+
+
+def _percentile(values, percent):
+    """Gets a percentile from a sorted list of values using the nearest rank."""
+    index = max(int(round(percent / 100 * len(values))) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+def _summarize(samples):
+    """Summarize the time of each operation (in seconds) for the JSON output."""
+    samples = sorted(samples)
+    mean = sum(samples) / len(samples)
+    return {
+        'ops_per_sec': 1 / mean if mean else None,
+        'mean_us': mean * 1e6,
+        'p50_us': _percentile(samples, 50) * 1e6,
+        'p99_us': _percentile(samples, 99) * 1e6,
+        'samples': len(samples),
+    }
+
+def measure(func, samples, number=1):
+    """
+    Calls func number times for each of the samples, returning the summary of the time taken per
+    call. A single warm-up sample is run first.
+    """
+    for _ in range(number):
+        func()
+    times = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return _summarize(times)
+
+
+##### Benchmarks #####
+def bench_sensor_parse(samples, number):
+    """`Sensor.parse()` and `Sensor.convert()` for each type of sensor."""
+    # pylint: disable=no-member
+    results = {}
+    for name, sensor in SENSOR_TYPES:
+        raw = bytes(sensor.size)
+        values = sensor.layout.struct.unpack(raw) if hasattr(sensor, 'layout') else (0,)
+        results['parse_' + name] = measure(lambda s=sensor, raw=raw: s.parse(raw), samples, number)
+        results['convert_' + name] = measure(lambda s=sensor, values=values: s.convert(values),
+                                             samples, number)
+    return results
+
+def bench_query_list(samples, number):
+    """`Roomba.query_list()` of different numbers of sensors against an emulated robot."""
+    clock = VirtualClock()
+    emulator = _Emulator(clock)
+    emulator.write(Opcode.START)
+    bot = emulator.roomba()
+    results = {}
+    for name, sensors in QUERY_LISTS:
+        results[name] = measure(lambda s=sensors: bot.query_list(*s), samples, number)
+        results[name + '_optimized'] = measure(
+            lambda s=sensors: bot.query_list(*s, optimize=True), samples, number)
+    return results
+
+def bench_stream(samples, number):
+    """Stream packets read per second for different sensors with `Roomba.stream()`."""
+    results = {}
+    for name, sensors in STREAMS:
+        layout = StreamLayout.of(sensors)
+        data = bytes(layout.size)
+        data = b''.join(bytes((sensor.packet_id,)) + data[offset:offset+sensor.size]
+                        for sensor, offset in zip(layout.sensors, layout.offsets))
+        frame = bytes((STREAM_HEADER, len(data))) + data
+        frame += bytes(((-sum(frame)) & 0xFF,))
+        bot = Roomba(_StreamSerial(frame), clock=VirtualClock())
+        for lazy in (False, True):
+            def read_frames(bot=bot, sensors=sensors, lazy=lazy):
+                remaining = [number]
+                def callback(_):
+                    remaining[0] -= 1
+                    return remaining[0] > 0
+                bot.stream(callback, *sensors, lazy=lazy)
+            result = measure(read_frames, samples)
+            for key in ('mean_us', 'p50_us', 'p99_us'):
+                result[key] /= number
+            result['ops_per_sec'] *= number
+            results[name + ('_lazy' if lazy else '')] = result
+    return results
+
+def bench_commands(samples, number):
+    """The cost of encoding and sending commands."""
+    bot = Roomba(_NullSerial())
+    return {
+        'drive': measure(lambda: bot.drive(200, 500), samples, number),
+        'drive_direct': measure(lambda: bot.drive_direct(200, -200), samples, number),
+        'create_song': measure(lambda: bot.create_song(0, ['C4', 'E4', 'G4', 'C5'],
+                                                       [16, 16, 16, 32]), samples, number),
+        'schedule': measure(lambda: bot.schedule(mon=(9, 30), wed=(9, 30), fri=(17, 0)),
+                            samples, number),
+    }
+
+def bench_round_trip(samples, _):
+    """
+    The wall-clock time to read sensors from an emulated robot on a pseudo-terminal (or in-process
+    if pseudo-terminals are not available), which includes waiting for the data to be sent.
+    """
+    emulator = _Emulator()
+    if os.name == 'posix':
+        transport = 'pty'
+        bot = Roomba(emulator.open_pty(), brc=lambda state: None)
+    else:
+        transport = 'in-process'
+        bot = emulator.roomba()
+    bot.start()
+    try:
+        return {
+            'transport': transport,
+            'sensor_voltage': measure(lambda: bot.sensor(Sensor.VOLTAGE), samples),
+            'sensor_all': measure(lambda: bot.sensor(Sensor.ALL_SENSORS), samples),
+            'query_list_4': measure(lambda: bot.query_list(*QUERY_LISTS[1][1]), samples),
+        }
+    finally:
+        bot.serial.close()
+
+BENCHMARKS = {
+    'sensor_parse': bench_sensor_parse,
+    'query_list': bench_query_list,
+    'stream': bench_stream,
+    'commands': bench_commands,
+    'round_trip': bench_round_trip,
+}
+
+
+def run(names=None, quick=False):
+    """
+    Run the benchmarks with the given names (defaulting to all of them) and return the results as
+    a `dict` that can be saved as JSON. Quick runs take fewer samples.
+    """
+    samples, number = (20, 50) if quick else (200, 200)
+    results = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'platform': platform.platform(),
+        'quick': quick,
+        'benchmarks': {},
+    }
+    for name in names or BENCHMARKS:
+        results['benchmarks'][name] = BENCHMARKS[name](samples, number)
+    return results
+
+def main(args=None):
+    """Run the benchmarks from the command line and output the results as JSON."""
+    parser = argparse.ArgumentParser(prog='python -m yarc.benchmark',
+                                     description='Benchmark yarc and output the results as JSON.')
+    parser.add_argument('--quick', action='store_true', help='take fewer samples')
+    parser.add_argument('--only', action='append', choices=sorted(BENCHMARKS),
+                        help='only run the given benchmark (can be given multiple times)')
+    parser.add_argument('--output', help='the file to write the JSON to instead of stdout')
+    args = parser.parse_args(args)
+    results = run(args.only, args.quick)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,541 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import select
+import struct
+import threading
+import time
+
+import serial
+
+from .enums import Day, Drive, OIMode
+from .motion import WHEEL_BASE
+from .opcode import Opcode
+from .roomba import Roomba
+from .sensor import Sensor
+from .stream import STREAM_HEADER
+
+# Register the roomba:// URL handler with pyserial
+if 'yarc.urlhandler' not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append('yarc.urlhandler')
+
+# The number of bytes of arguments that follow each opcode (SONG, QUERY_LIST, and STREAM are
+# variable length and handled separately)
+ARGUMENT_SIZES = {
+    Opcode.START: 0, Opcode.RESET: 0, Opcode.STOP: 0, Opcode.BAUD: 1,
+    Opcode.SAFE: 0, Opcode.SAFE_ALT: 0, Opcode.FULL: 0,
+    Opcode.CLEAN: 0, Opcode.MAX: 0, Opcode.SPOT: 0, Opcode.SEEK_DOCK: 0, Opcode.POWER: 0,
+    Opcode.SCHEDULE: 15, Opcode.SET_DAY_TIME: 3,
+    Opcode.DRIVE: 4, Opcode.DRIVE_DIRECT: 4, Opcode.DRIVE_PWM: 4,
+    Opcode.MOTORS: 1, Opcode.MOTORS_PWM: 3, Opcode.LEDS: 3, Opcode.LEDS_SCHEDULING: 2,
+    Opcode.LEDS_DIGIT_RAW: 4, Opcode.LEDS_DIGIT_ASCII: 4, Opcode.BUTTONS: 1, Opcode.PLAY: 1,
+    Opcode.SENSORS: 1, Opcode.STREAM_PAUSE_RESUME: 1,
+}
+
+BAUDRATES = (300, 600, 1200, 2400, 4800, 9600, 14400, 19200, 28800, 38400, 57600, 115200)
+
+# The modes that each opcode is available in, the ones not listed are available in every mode
+_ACTIVE = (OIMode.PASSIVE, OIMode.SAFE, OIMode.FULL)
+_CONTROL = (OIMode.SAFE, OIMode.FULL)
+AVAILABLE_MODES = {
+    Opcode.BAUD: _ACTIVE, Opcode.STOP: _ACTIVE, Opcode.SAFE: _ACTIVE, Opcode.SAFE_ALT: _ACTIVE,
+    Opcode.FULL: _ACTIVE, Opcode.CLEAN: _ACTIVE, Opcode.MAX: _ACTIVE, Opcode.SPOT: _ACTIVE,
+    Opcode.SEEK_DOCK: _ACTIVE, Opcode.POWER: _ACTIVE, Opcode.SCHEDULE: _ACTIVE,
+    Opcode.SET_DAY_TIME: _ACTIVE, Opcode.BUTTONS: _ACTIVE, Opcode.SONG: _ACTIVE,
+    Opcode.SENSORS: _ACTIVE, Opcode.QUERY_LIST: _ACTIVE, Opcode.STREAM: _ACTIVE,
+    Opcode.STREAM_PAUSE_RESUME: _ACTIVE,
+    Opcode.DRIVE: _CONTROL, Opcode.DRIVE_DIRECT: _CONTROL, Opcode.DRIVE_PWM: _CONTROL,
+    Opcode.MOTORS: _CONTROL, Opcode.MOTORS_PWM: _CONTROL, Opcode.LEDS: _CONTROL,
+    Opcode.LEDS_SCHEDULING: _CONTROL, Opcode.LEDS_DIGIT_RAW: _CONTROL,
+    Opcode.LEDS_DIGIT_ASCII: _CONTROL, Opcode.PLAY: _CONTROL,
+}
+
+# Lookup tables from the raw bytes to the opcodes and sensors, much faster than the constructors
+OPCODES = {ord(opcode.value): opcode for opcode in Opcode}
+SENSORS = {sensor.packet_id: sensor for sensor in Sensor}
+_HANDLERS = {opcode: '_op_' + opcode.name.lower() for opcode in Opcode}
+
+
+class Emulator: # pylint: disable=too-many-instance-attributes
+    """
+    An emulation of the byte protocol of the Open Interface of a Roomba / Create 2. This lets the
+    library (and programs using it) be run without a physical robot, for example for testing or
+    benchmarking.
+
+    Bytes sent to the robot are given to `write()` and the bytes the robot sends back are taken with
+    `read()`. Like the real robot it works in 15 ms cycles based on the `monotonic()` function of
+    `clock` (which defaults to the `time` module), emitting a stream packet every cycle while a
+    stream is running. Instead of running a thread the cycles are caught up on each time the
+    emulator is used (or `update()` is called).
+
+    Every opcode is accepted with the right number of argument bytes and only has an effect in the
+    modes it is available in. The mode, the commanded wheel velocities, the motors, the LEDs, songs,
+    and the other commands are tracked and every sensor can be read by `SENSORS`, `QUERY_LIST`, and
+    `STREAM` with the same sizes as the real robot. The values of the sensors are in `values` (a
+    `dict` of each individual `Sensor` to its raw integer value) and can be changed at any time
+    with `set_sensor()`. The robot does not move, subclasses can override `step()` to simulate that.
+
+    The easiest way to use this is through pyserial with the URL `roomba://`, for example
+    `Roomba('roomba://')`, and the emulator is then available from `bot.serial.emulator`. To use it
+    from another process, `open_pty()` serves it over a pseudo-terminal (`python -m yarc.emulator`
+    does this as well).
+
+    The attributes describing the state of the emulated robot are:
+      * `mode` and `baudrate`
+      * `velocities` - the left and right wheel velocities in mm/s
+      * `motors` - the main brush, side brush, and vacuum duty cycles from -127 to 127 (negative
+        is the opposite of the cleaning direction), which also set the brush motor current sensors
+      * `leds` - the LED bits (debris, spot, home, and check), power color, and power intensity
+      * `scheduling_leds` - the day bits and the other bits of the scheduling LEDs
+      * `digit_leds` - the argument bytes of the last digit LED command, raw segments or ASCII
+      * `songs`, `schedule` (a `dict` of `Day` to `(hour, minute)`), and `day_time` (the
+        `(day, hour, minute)` last set or None, the clock does not advance)
+      * `commands` - the most recent argument bytes of each `Opcode`
+    The `BUTTONS` command sets the `BUTTONS` sensor until the buttons are released 1/6 of a second
+    later. Safe mode turns off the LEDs and leaving safe and full modes stops the motors.
+    """
+    CYCLE = 0.015 # seconds
+    LATENCY = 0.001 # seconds from recieving a request until the response starts being sent
+    BUFFER_SIZE = 4096 # bytes that can be waiting to be read before they are dropped
+
+    # The messages printed after a reset as (seconds after the reset, bytes) and how long it takes
+    # until the robot accepts commands again
+    RESET_MESSAGES = (
+        (0.015, b'Soft reset!\n'),
+        (1.0, b'\xfe'),
+        (3.0, b'Roomba by iRobot!\r\nstm32\r\n2015-12-18-1607-L   \r\n'
+              b'battery-current-zero 254\r\n'),
+        (4.0, b'\r\n2015-12-18-1607-L   \r\nr3-robot/tags/release-stm32-3.7.1:6174 CLEAN\r\n\r\n'
+              b'bootloader id: 3115 C200 0033 5860 \r\nassembly: 3.5-lite\r\nrevision: 8\r\n'
+              b'flash version: 10\r\nflash info crc passed: 1\r\n\r\n'
+              b'battery-current-zero 252\r\n'
+              b'estimate-battery-level-from-voltage 2697 mAH 17734 mV\r\n'
+              b'start-charge: 2015-12-18-1607-L   \r\nDetermining battery type.\r\n'),
+    )
+    BOOT_TIME = 3.0
+    BUTTON_TIME = 1/6 # seconds that buttons pressed with the BUTTONS command stay pressed
+
+    # The current (in mA) of the main and side brush motors at full power
+    MAIN_BRUSH_CURRENT = 250
+    SIDE_BRUSH_CURRENT = 100
+
+    # The values of sensors that don't start out as 0
+    DEFAULT_VALUES = {
+        Sensor.VOLTAGE: 16000, Sensor.TEMPERATURE: 25,
+        Sensor.BATTERY_CHARGE: 2500, Sensor.BATTERY_CAPACITY: 2696,
+    }
+
+    def __init__(self, clock=time):
+        self.clock = clock
+        self.__lock = threading.RLock()
+        self.__input = bytearray()
+        self.__output = bytearray()
+        self.__scheduled = [] # list of (time, bytes) to be output in order
+        self.__next_cycle = clock.monotonic()
+        self.__ready = 0
+        self.__song_end = None
+        self.__buttons_end = None
+        self.__stream = None
+        self.__stream_paused = False
+        self.dropped_bytes = 0
+        self.mode = OIMode.OFF
+        self.baudrate = 115200
+        self.values = {}
+        self.velocities = (0, 0)
+        self.motors = (0, 0, 0)
+        self.leds = (0, 0, 0)
+        self.scheduling_leds = (0, 0)
+        self.digit_leds = b'\x00\x00\x00\x00'
+        self.songs = {}
+        self.schedule = {}
+        self.day_time = None
+        self.commands = {}
+        self.__power_on()
+
+    def __power_on(self):
+        self.mode = OIMode.OFF
+        self.baudrate = 115200
+        self.values = {sensor: 0 for sensor in Sensor
+                       if not hasattr(sensor, 'sensors') and sensor.name[0] != '_'}
+        self.values.update(self.DEFAULT_VALUES)
+        self.values[Sensor.OI_MODE] = int(OIMode.OFF)
+        self.velocities = (0, 0)
+        self.motors = (0, 0, 0)
+        self.leds = (0, 0, 0)
+        self.scheduling_leds = (0, 0)
+        self.digit_leds = b'\x00\x00\x00\x00'
+        self.songs = {}
+        self.schedule = {}
+        self.day_time = None
+        self.commands = {}
+        self.__stream = None
+        self.__song_end = self.__buttons_end = None
+
+    def set_sensor(self, sensor, value):
+        """
+        Sets the value of an individual sensor. The value can be an `int`, `bool`, or one of the
+        values from `enums`.
+        """
+        if hasattr(sensor, 'sensors') or sensor.name[0] == '_':
+            raise ValueError('can only set individual sensors')
+        with self.__lock:
+            self.values[sensor] = int(value)
+
+    def __set_mode(self, mode):
+        self.mode = mode
+        self.values[Sensor.OI_MODE] = int(mode)
+        if mode not in _CONTROL:
+            self._set_velocities(0, 0)
+            self.__set_motors(0, 0, 0)
+
+    ##### Serial Interface #####
+    def write(self, data):
+        """Give bytes sent to the robot to the emulator."""
+        with self.__lock:
+            self.update()
+            self.__input += data
+            while self.__input and self.__process():
+                pass
+        return len(data)
+
+    def read(self, nbytes=None):
+        """Take up to nbytes (or all) of the bytes that the robot has sent, never waiting."""
+        with self.__lock:
+            self.update()
+            if nbytes is None or nbytes > len(self.__output):
+                nbytes = len(self.__output)
+            data = bytes(self.__output[:nbytes])
+            del self.__output[:nbytes]
+            return data
+
+    @property
+    def in_waiting(self):
+        """The number of bytes the robot has sent that have not been read."""
+        with self.__lock:
+            self.update()
+            return len(self.__output)
+
+    def reset_input_buffer(self):
+        """Throw away all of the bytes the robot has sent that have not been read."""
+        with self.__lock:
+            self.update()
+            self.__output.clear()
+
+    def next_output(self):
+        """
+        The time (according to the clock) when more data may be sent by the robot or None if no
+        more data will be sent without being asked.
+        """
+        with self.__lock:
+            times = [self.__scheduled[0][0]] if self.__scheduled else []
+            if self.__stream is not None and not self.__stream_paused:
+                times.append(self.__next_cycle)
+            return min(times) if times else None
+
+    def __send(self, data):
+        room = self.BUFFER_SIZE - len(self.__output)
+        if len(data) > room:
+            self.dropped_bytes += len(data) - room
+            data = data[:room]
+        self.__output += data
+
+    def __send_later(self, data):
+        """Sends data after the latency and the amount of time it takes to transfer it."""
+        self.__schedule(self.clock.monotonic() + self.LATENCY + len(data)*10/self.baudrate, data)
+
+    def __schedule(self, when, data):
+        self.__scheduled.append((when, data))
+        self.__scheduled.sort(key=lambda item: item[0])
+
+    ##### Cycles #####
+    def update(self):
+        """Catch up on all of the 15 ms cycles and scheduled output up to the current time."""
+        with self.__lock:
+            now = self.clock.monotonic()
+            while self.__next_cycle <= now:
+                self.__send_scheduled(self.__next_cycle)
+                self.__cycle()
+                self.__next_cycle += self.CYCLE
+            self.__send_scheduled(now)
+
+    def __send_scheduled(self, now):
+        while self.__scheduled and self.__scheduled[0][0] <= now:
+            self.__send(self.__scheduled.pop(0)[1])
+
+    def __cycle(self):
+        if self.__song_end is not None and self.__next_cycle >= self.__song_end:
+            self.values[Sensor.SONG_PLAYING] = 0
+            self.__song_end = None
+        if self.__buttons_end is not None and self.__next_cycle >= self.__buttons_end:
+            self.values[Sensor.BUTTONS] = 0
+            self.__buttons_end = None
+        self.step(self.CYCLE)
+        if self.mode == OIMode.SAFE and self.__unsafe():
+            self.__set_mode(OIMode.PASSIVE)
+        if self.__stream is not None and not self.__stream_paused:
+            data = b''.join(bytes((sensor.packet_id,)) + self.__pack(sensor)
+                            for sensor in self.__stream)
+            frame = bytes((STREAM_HEADER, len(data))) + data
+            self.__send(frame + bytes(((-sum(frame)) & 0xFF,)))
+
+    def __unsafe(self):
+        """Checks if any of the conditions that cause safe mode to switch to passive are set."""
+        values = self.values
+        return (values[Sensor.BUMPS_AND_WHEEL_DROPS] & 0x0C or values[Sensor.CLIFF_LEFT] or
+                values[Sensor.CLIFF_FRONT_LEFT] or values[Sensor.CLIFF_FRONT_RIGHT] or
+                values[Sensor.CLIFF_RIGHT])
+
+    def step(self, seconds):
+        """
+        Called at the start of every 15 ms cycle to advance the state of the robot by the given
+        number of seconds. The emulated robot doesn't move, subclasses can override this to
+        simulate movement by changing the sensor values.
+        """
+
+    ##### Sensors #####
+    def __pack(self, sensor):
+        """Packs the current data for a sensor packet into bytes as the robot sends it."""
+        sensors = sensor.sensors if hasattr(sensor, 'sensors') else (sensor,)
+        values = [self.values[s] for s in sensors if s.name[0] != '_']
+        for accumulated in (Sensor.DISTANCE, Sensor.ANGLE):
+            if accumulated in sensors:
+                self.values[accumulated] = 0 # these are reset each time they are sent
+        return struct.pack(sensor.struct_format, *values)
+
+    ##### Commands #####
+    def __process(self):
+        """Process the next command in the input. Returns False if it is not complete yet."""
+        data = self.__input
+        opcode = OPCODES.get(data[0])
+        if opcode is None:
+            del data[:1] # not an opcode, skip it
+            return True
+        if opcode == Opcode.SONG:
+            size = 2 + 2*data[2] if len(data) >= 3 else 3
+        elif opcode in (Opcode.QUERY_LIST, Opcode.STREAM):
+            size = 1 + data[1] if len(data) >= 2 else 2
+        else:
+            size = ARGUMENT_SIZES[opcode]
+        if len(data) < size + 1:
+            return False
+        args = bytes(data[1:size+1])
+        del data[:size+1]
+        if self.clock.monotonic() < self.__ready:
+            return True # still booting
+        if self.mode not in AVAILABLE_MODES.get(opcode, OIMode):
+            return True
+        self.commands[opcode] = args
+        handler = getattr(self, _HANDLERS[opcode], None)
+        if handler is not None:
+            handler(args)
+        return True
+
+    def _op_start(self, _):
+        self.__set_mode(OIMode.PASSIVE)
+
+    def _op_reset(self, _):
+        self.__power_on()
+        now = self.clock.monotonic()
+        self.__scheduled = []
+        for delay, message in self.RESET_MESSAGES:
+            self.__schedule(now + delay, message)
+        self.__ready = now + self.BOOT_TIME
+
+    def _op_stop(self, _):
+        self.__set_mode(OIMode.OFF)
+        self.__stream = None
+
+    def _op_baud(self, args):
+        if args[0] < len(BAUDRATES):
+            self.baudrate = BAUDRATES[args[0]]
+
+    def _op_safe(self, _):
+        self.__set_mode(OIMode.SAFE)
+        self.leds = (0, 0, 0)
+        self.scheduling_leds = (0, 0)
+        self.digit_leds = b'\x00\x00\x00\x00'
+    _op_safe_alt = _op_safe
+
+    def _op_full(self, _):
+        self.__set_mode(OIMode.FULL)
+
+    def _op_passive(self, _):
+        self.__set_mode(OIMode.PASSIVE)
+    _op_clean = _op_max = _op_spot = _op_seek_dock = _op_power = _op_passive
+
+    def _op_drive(self, args):
+        velocity, radius = struct.unpack('>hh', args)
+        self.values[Sensor.REQ_VELOCITY], self.values[Sensor.REQ_RADIUS] = velocity, radius
+        if radius in (Drive.STRAIGHT, Drive.STRAIGHT_ALT, 0):
+            self._set_velocities(velocity, velocity)
+        elif radius == Drive.TURN_CW:
+            self._set_velocities(velocity, -velocity)
+        elif radius == Drive.TURN_CCW:
+            self._set_velocities(-velocity, velocity)
+        else:
+            # velocity is of the center of the robot, the outside wheel goes faster
+            half = WHEEL_BASE / 2
+            self._set_velocities(velocity*(radius-half)/radius, velocity*(radius+half)/radius)
+
+    def _op_drive_direct(self, args):
+        right, left = struct.unpack('>hh', args)
+        self.values[Sensor.REQ_RIGHT_VELOCITY], self.values[Sensor.REQ_LEFT_VELOCITY] = right, left
+        self._set_velocities(left, right)
+
+    def _op_drive_pwm(self, args):
+        right, left = struct.unpack('>hh', args)
+        self._set_velocities(left*500/255, right*500/255) # full power is about 500 mm/s
+
+    def _set_velocities(self, left, right):
+        self.velocities = (left, right)
+
+    def _op_motors(self, args):
+        bits = args[0]
+        side_brush = (-127 if bits & 0x08 else 127) if bits & 0x01 else 0
+        main_brush = (-127 if bits & 0x10 else 127) if bits & 0x04 else 0
+        self.__set_motors(main_brush, side_brush, 127 if bits & 0x02 else 0)
+
+    def _op_motors_pwm(self, args):
+        main_brush, side_brush, vacuum = struct.unpack('bbb', args)
+        self.__set_motors(main_brush, side_brush, max(vacuum, 0))
+
+    def __set_motors(self, main_brush, side_brush, vacuum):
+        self.motors = (main_brush, side_brush, vacuum)
+        values = self.values
+        values[Sensor.MAIN_BRUSH_MOTOR_CURRENT] = round(main_brush*self.MAIN_BRUSH_CURRENT/127)
+        values[Sensor.SIDE_BRUSH_MOTOR_CURRENT] = round(side_brush*self.SIDE_BRUSH_CURRENT/127)
+
+    def _op_leds(self, args):
+        self.leds = tuple(args)
+
+    def _op_leds_scheduling(self, args):
+        self.scheduling_leds = tuple(args)
+
+    def _op_leds_digit_raw(self, args):
+        self.digit_leds = args
+    _op_leds_digit_ascii = _op_leds_digit_raw
+
+    def _op_buttons(self, args):
+        self.values[Sensor.BUTTONS] = args[0]
+        self.__buttons_end = self.clock.monotonic() + self.BUTTON_TIME
+
+    def _op_schedule(self, args):
+        self.schedule = {day: (args[1+2*day], args[2+2*day]) for day in Day
+                         if args[0] & (1 << day)}
+
+    def _op_set_day_time(self, args):
+        if args[0] < len(Day):
+            self.day_time = (Day(args[0]), args[1], args[2])
+
+    def _op_song(self, args):
+        self.songs[args[0]] = [(args[i], args[i+1]) for i in range(2, len(args), 2)]
+
+    def _op_play(self, args):
+        song = self.songs.get(args[0])
+        if song is None:
+            return
+        self.values[Sensor.SONG_NUMBER] = args[0]
+        self.values[Sensor.SONG_PLAYING] = 1
+        self.__song_end = self.clock.monotonic() + sum(duration for _, duration in song) / 64
+
+    def _op_sensors(self, args):
+        sensor = SENSORS.get(args[0])
+        if sensor is None:
+            return
+        self.__send_later(self.__pack(sensor))
+
+    def _op_query_list(self, args):
+        sensors = [SENSORS.get(packet_id) for packet_id in args[1:]]
+        if None in sensors:
+            return
+        self.__send_later(b''.join(self.__pack(sensor) for sensor in sensors))
+
+    def _op_stream(self, args):
+        sensors = [SENSORS.get(packet_id) for packet_id in args[1:]]
+        if None in sensors:
+            return
+        self.__stream = sensors
+        self.__stream_paused = False
+        self.values[Sensor.NUM_STREAM_PACKETS] = len(sensors)
+
+    def _op_stream_pause_resume(self, args):
+        self.__stream_paused = not args[0]
+
+    ##### Connecting #####
+    def roomba(self, **kwargs):
+        """
+        Connect a new `Roomba` to this emulated robot. The keyword arguments are given to the
+        `Roomba` constructor, the `clock` is always the emulator's clock. The default `brc`
+        function does nothing.
+        """
+        port = serial.serial_for_url('roomba://', do_not_open=True,
+                                     timeout=kwargs.pop('timeout', 0.045),
+                                     baudrate=kwargs.pop('baudrate', self.baudrate))
+        port.emulator = self
+        port.open()
+        kwargs.setdefault('brc', lambda state: None)
+        return Roomba(port, clock=self.clock, **kwargs)
+
+    ##### Pseudo-terminal #####
+    def open_pty(self):
+        """
+        Serve the emulator over a new pseudo-terminal from a background thread. Returns the name of
+        the device to connect to, for example with `Roomba(name, brc=...)`. Since a pseudo-terminal
+        has no RTS or DTR pins, a `brc` function has to be given to `Roomba` for `wake()` and
+        `close()` to work. Only available on POSIX systems.
+        """
+        import tty # pylint: disable=import-outside-toplevel
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        name = os.ttyname(slave)
+        thread = threading.Thread(target=self.__serve, args=(master, slave),
+                                  name='yarc-emulator', daemon=True)
+        thread.start()
+        return name
+
+    def __serve(self, master, slave):
+        try:
+            while True:
+                next_output = self.next_output()
+                timeout = (None if next_output is None else
+                           max(next_output - self.clock.monotonic(), 0))
+                readable, _, _ = select.select([master], [], [], timeout)
+                if readable:
+                    self.write(os.read(master, 1024))
+                data = self.read()
+                if data:
+                    os.write(master, data)
+        except OSError:
+            pass # the pseudo-terminal was closed
+        finally:
+            os.close(master)
+            os.close(slave)
+
+
+def main():
+    """Serve an emulated robot over a pseudo-terminal until interrupted."""
+    emulator = Emulator()
+    print(emulator.open_pty(), flush=True)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import deque
+from concurrent.futures import Future
+from contextlib import ExitStack
+import os
+import selectors
+import threading
+import time
+
+import serial
+
+from .opcode import Opcode
+from .stream import StreamParser
+
+class _Member: # pylint: disable=too-few-public-methods, too-many-instance-attributes
+    """A robot in a `Fleet` along with the state of its stream."""
+    def __init__(self, name, roomba):
+        self.name = name
+        self.roomba = roomba
+        self.fileno = roomba.serial.fileno()
+        self.parser = self.layout = self.plan = self.callback = None
+        self.lazy = self.raw = False
+        self.deadline = None # when the next stream packet must arrive by
+
+
+class Fleet: # pylint: disable=too-many-instance-attributes
+    """
+    Many robots whose streams and commands are all handled by a single thread using a `selectors`
+    loop instead of a thread (or blocking call) for each robot. For example:
+
+        fleet = Fleet()
+        for i, port in enumerate(ports):
+            fleet.add(i, Roomba(port))
+            fleet.submit(i, 'start')
+            fleet.submit(i, 'safe')
+            fleet.stream(i, on_frame, 'VOLTAGE', 'BUMPS_AND_WHEEL_DROPS')
+        fleet.run()
+
+    The robots are added with a name (anything hashable) and a `Roomba` that is connected to a
+    serial port with a file descriptor (so only on POSIX systems). The stream callbacks are given
+    the name and the frame and return True to keep recieving frames, like `Roomba.stream()`.
+
+    Commands can be given to `submit()` from any thread and are run by the loop in order, so all
+    communication with the robots happens on the thread in `run()`. Commands that wait for a
+    response (like reading a sensor) block the whole loop and should be avoided while streaming.
+    Robots can also be added and removed from any thread, the loop holds a lock while it uses them
+    so they only change while it is waiting for data.
+
+    If a robot's stream stops (no data for `timeout` seconds) then the robot is removed from the
+    loop, its `SerialTimeoutException` is saved in `errors`, and `on_error` (if given) is called
+    with the name and exception. Exceptions from callbacks and reading the ports are handled the
+    same way. Exceptions from commands are only given to the `Future` returned by `submit()`.
+    """
+    def __init__(self, timeout=0.1, on_error=None, clock=time):
+        self.timeout = timeout
+        self.on_error = on_error
+        self.clock = clock
+        self.errors = {}
+        self.__members = {}
+        self.__commands = deque()
+        self.__lock = threading.RLock()
+        self.__selector = selectors.DefaultSelector()
+        self.__wakeup_read, self.__wakeup_write = os.pipe()
+        os.set_blocking(self.__wakeup_read, False)
+        os.set_blocking(self.__wakeup_write, False)
+        self.__selector.register(self.__wakeup_read, selectors.EVENT_READ)
+        self.__running = False
+
+    def __len__(self):
+        return len(self.__members)
+
+    def __getitem__(self, name):
+        return self.__members[name].roomba
+
+    def __iter__(self):
+        return iter(self.__members)
+
+    def add(self, name, roomba):
+        """Add a robot with the given name to the fleet."""
+        with self.__lock:
+            if name in self.__members:
+                raise ValueError('a robot named %r is already in the fleet' % (name,))
+            self.__members[name] = _Member(name, roomba)
+
+    def remove(self, name):
+        """Remove a robot from the fleet, pausing its stream if it is running."""
+        with self.__lock:
+            member = self.__members.pop(name)
+            if member.callback is not None:
+                self.__stop_stream(member)
+
+    def close(self):
+        """
+        Remove and close all of the robots and release the loop's resources. Everything is closed
+        even if closing one of the robots raises an exception.
+        """
+        with self.__lock, ExitStack() as stack:
+            stack.callback(os.close, self.__wakeup_write)
+            stack.callback(os.close, self.__wakeup_read)
+            stack.callback(self.__selector.close)
+            for name in list(self.__members):
+                stack.callback(self.__close_member, name)
+
+    def __close_member(self, name):
+        member = self.__members.pop(name)
+        try:
+            if member.callback is not None:
+                self.__stop_stream(member)
+        finally:
+            member.roomba.close()
+
+    def submit(self, name, command, *args, **kwargs):
+        """
+        Queue a command for a robot. The command is the name of a `Roomba` method (or a function
+        that takes the `Roomba` as the first argument) which will be called with the arguments by
+        the loop. Returns a `concurrent.futures.Future` of the result. This can be called from any
+        thread.
+        """
+        future = Future()
+        self.__commands.append((name, command, args, kwargs, future))
+        self.__wakeup()
+        return future
+
+    def stream(self, name, callback, *sensors, optimize=False, lazy=False, raw=False): # pylint: disable=too-many-arguments
+        """
+        Queue starting a stream of sensor data for a robot. See `Roomba.stream()` for information
+        about the arguments, except that the callback is given both the name of the robot and the
+        frame. Returns a `concurrent.futures.Future` of the `StreamLayout` once the stream is
+        started.
+
+        If raw is True then the callback is given the bytes of each frame (from the header through
+        the checksum) without decoding them, they can be decoded with `layout.decode(frame, 2)`.
+        Raw frames do not update the sensor attributes of the robot and are not optimized.
+        """
+        if raw and optimize:
+            raise ValueError('raw frames cannot be optimized')
+        return self.submit(name, self.__start_stream, callback, sensors, optimize, lazy, raw)
+
+    def pause(self, name):
+        """Queue pausing the stream of a robot."""
+        return self.submit(name, self.__pause_stream)
+
+    def stop(self):
+        """Stop `run()`, can be called from any thread or from a callback."""
+        self.__running = False
+        self.__wakeup()
+
+    def __wakeup(self):
+        try:
+            os.write(self.__wakeup_write, b'\x00')
+        except BlockingIOError:
+            pass # already going to wake up
+
+    def __start_stream(self, roomba, callback, sensors, optimize, lazy, raw): # pylint: disable=too-many-arguments
+        member = self.__member(roomba)
+        if member.callback is not None:
+            self.__stop_stream(member)
+        member.plan, member.layout = roomba._stream_layout(sensors, optimize) # pylint: disable=protected-access
+        member.parser = roomba._stream_parser = StreamParser(member.layout) # pylint: disable=protected-access
+        member.callback, member.lazy, member.raw = callback, lazy, raw
+        member.deadline = self.clock.monotonic() + max(self.timeout, 0.1)
+        roomba._write(Opcode.STREAM + member.layout.request, True) # pylint: disable=protected-access
+        roomba.serial.reset_input_buffer()
+        self.__selector.register(member.fileno, selectors.EVENT_READ, member)
+        return member.layout
+
+    def __pause_stream(self, roomba):
+        member = self.__member(roomba)
+        if member.callback is not None:
+            self.__stop_stream(member)
+
+    def __stop_stream(self, member):
+        self.__selector.unregister(member.fileno)
+        member.callback = member.deadline = None
+        member.roomba.pause_stream()
+
+    def __member(self, roomba):
+        for member in self.__members.values():
+            if member.roomba is roomba:
+                return member
+        raise KeyError(roomba)
+
+    def __fail(self, member, ex):
+        if member.callback is not None:
+            try:
+                self.__stop_stream(member)
+            except Exception: # pylint: disable=broad-except
+                pass
+        self.errors[member.name] = ex
+        if self.on_error is not None:
+            self.on_error(member.name, ex)
+
+    def __run_commands(self):
+        commands = self.__commands
+        while commands:
+            name, command, args, kwargs, future = commands.popleft()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                roomba = self.__members[name].roomba
+                if isinstance(command, str):
+                    result = getattr(roomba, command)(*args, **kwargs)
+                else:
+                    result = command(roomba, *args, **kwargs)
+            except Exception as ex: # pylint: disable=broad-except
+                future.set_exception(ex)
+            else:
+                future.set_result(result)
+
+    def __read(self, member, now):
+        port = member.roomba.serial
+        data = port.read(port.in_waiting or 1)
+        if not data:
+            return
+        member.deadline = now + self.timeout
+        roomba, layout, plan, lazy = member.roomba, member.layout, member.plan, member.lazy
+        cache = roomba._sensor_cache # pylint: disable=protected-access
+        for frame in member.parser.feed(data):
+            roomba._cycle = now # pylint: disable=protected-access
+            if not member.raw:
+                frame = layout.view(frame, 2) if lazy else layout.decode(frame, 2)
+                cache.update(layout.paths, frame, now)
+                if plan is not None:
+                    frame = plan.extract(frame)
+            if not member.callback(member.name, frame):
+                self.__stop_stream(member)
+                return
+
+    def run(self, duration=None):
+        """
+        Run the loop on this thread until `stop()` is called, reading the streams, calling the
+        callbacks, and running the commands. If a duration (in seconds) is given then this returns
+        after that long.
+        """
+        clock, selector = self.clock, self.__selector
+        end = None if duration is None else clock.monotonic() + duration
+        self.__running = True
+        while self.__running:
+            with self.__lock:
+                self.__run_commands()
+                now = clock.monotonic()
+                deadlines = [member.deadline for member in self.__members.values()
+                             if member.deadline is not None]
+            if end is not None:
+                deadlines.append(end)
+            timeout = max(min(deadlines) - now, 0) if deadlines else None
+            events = selector.select(timeout)
+            with self.__lock:
+                now = clock.monotonic()
+                for key, _ in events:
+                    if key.data is None:
+                        try:
+                            os.read(self.__wakeup_read, 4096)
+                        except BlockingIOError:
+                            pass
+                        continue
+                    if key.data.callback is None:
+                        continue # removed while waiting
+                    try:
+                        self.__read(key.data, now)
+                    except Exception as ex: # pylint: disable=broad-except
+                        self.__fail(key.data, ex)
+                for member in list(self.__members.values()):
+                    if member.deadline is not None and now >= member.deadline:
+                        self.__fail(member, serial.SerialTimeoutException('stream stopped'))
+            if end is not None and now >= end:
+                break
+        self.__running = False
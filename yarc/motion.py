@@ -0,0 +1,236 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from concurrent.futures import Future
+import math
+import threading
+
+import serial
+
+from .sensor import Sensor
+
+WHEEL_BASE = 235 # mm between the wheels
+COUNTS_PER_MM = 508.8 / (72*math.pi) # encoder counts per revolution / wheel circumference
+CYCLE = 0.015 # the robot updates its sensors and actuators every 15 ms
+
+def int16(value):
+    """Wrap a value around to a signed 16-bit integer like the robot's counters."""
+    return (value + 0x8000) % 0x10000 - 0x8000
+
+
+class MoveFuture(Future):
+    """
+    The `concurrent.futures.Future` of a `Move` (or a `yarc.trajectory.TrajectoryPlayer`) running
+    on another thread. Until the move is done the future stays pending (`running()` is False) so
+    that cancelling it cancels both the move and the future: the robot stops on its next cycle and
+    how far it got is still in the move's `traveled`. Once the move is done it cannot be cancelled.
+    """
+    def __init__(self, move):
+        super().__init__()
+        self.move = move
+
+    def cancel(self):
+        if self.move.cancel():
+            return super().cancel()
+        return self.cancelled()
+
+
+def run_move(roomba, move, wait=True):
+    """
+    Runs a `Move` (or a `yarc.trajectory.TrajectoryPlayer`) by giving it frames of its `SENSORS`
+    every cycle, stopping the robot if the move ends early, and returns the `result()` of the move.
+    If not waiting then the move is run on another thread and a `MoveFuture` of the result is
+    returned immediately.
+
+    Normally the frames come from a new stream. If the roomba has a background stream running that
+    includes all of the `SENSORS` then its frames are used instead. If it does not include them
+    then the background stream is paused during the move and the sensors are read with
+    `query_list()` every cycle.
+    """
+    if wait:
+        return _run_move(roomba, move)
+    future = MoveFuture(move)
+    def run():
+        if future.cancelled():
+            return
+        try:
+            result = _run_move(roomba, move)
+        except Exception as ex: # pylint: disable=broad-except
+            if future.set_running_or_notify_cancel():
+                future.set_exception(ex)
+        else:
+            if future.set_running_or_notify_cancel():
+                future.set_result(result)
+    threading.Thread(target=run, name='yarc-move', daemon=True).start()
+    return future
+
+def _run_move(roomba, move):
+    stream = roomba.background_stream
+    try:
+        if stream is None or not stream.running:
+            roomba.stream(move.update, *move.SENSORS)
+        elif all(sensor in stream.sensors for sensor in move.SENSORS):
+            _follow_stream(stream, move)
+        else:
+            with stream.paused():
+                _poll(roomba, move)
+    finally:
+        if not move.done:
+            roomba.drive_direct(0, 0)
+    return move.result()
+
+def _follow_stream(stream, move):
+    """Updates a move with the frames of a background stream until it is done."""
+    done = threading.Event()
+    names = [sensor.name for sensor in move.SENSORS]
+    def update(frame):
+        if move.update([getattr(frame, name) for name in names]):
+            return True
+        done.set()
+        return False
+    stream.subscribe(update)
+    try:
+        while not done.wait(0.05):
+            if not stream.running and not done.is_set():
+                raise serial.SerialTimeoutException('stream stopped')
+    finally:
+        stream.unsubscribe(update)
+
+def _poll(roomba, move):
+    """Updates a move with the sensors read at the start of every cycle until it is done."""
+    next_cycle = roomba.clock.monotonic()
+    while move.update(roomba.query_list(*move.SENSORS)):
+        next_cycle += CYCLE
+        roomba.clock.sleep(max(next_cycle - roomba.clock.monotonic(), 0))
+
+
+class Move: # pylint: disable=too-many-instance-attributes
+    """
+    Drives a distance (in mm) or turns an angle (in degrees counter clockwise) in place using the
+    wheel encoder counts from a stream. The `update()` method is given each frame of a stream of
+    the `SENSORS` and sends the drive commands, so the robot is checked every 15 ms instead of
+    whenever a sensor can be read. This is used by `Roomba.drive_distance()` and
+    `Roomba.turn_angle()`.
+
+    The wheels slow down near the end (with the given deceleration in mm/s/s) down to a minimum
+    velocity so that the robot doesn't overshoot. If the wheels stop turning for `stall_time`
+    seconds (for example stuck against a wall) or the move takes longer than `timeout` seconds
+    (default no limit), the robot is stopped and `result()` raises a `TimeoutError`.
+    """
+    SENSORS = (Sensor.LEFT_ENCODER_COUNTS, Sensor.RIGHT_ENCODER_COUNTS)
+    MIN_VELOCITY = 20 # mm/s
+
+    def __init__(self, roomba, distance=None, angle=None, velocity=100, decel=500, timeout=None, # pylint: disable=too-many-arguments
+                 stall_time=0.5):
+        if (distance is None) == (angle is None):
+            raise ValueError('either distance or angle must be given')
+        if velocity <= 0:
+            raise ValueError('velocity')
+        self.roomba = roomba
+        self.turn = angle is not None
+        self.target = angle if self.turn else distance
+        self.velocity = min(velocity, 500)
+        self.decel, self.timeout, self.stall_time = decel, timeout, stall_time
+        self.traveled = 0.0 # mm or degrees so far
+        self.error = None
+        self.done = False
+        self.__counts = None # the last left and right encoder counts
+        self.__total = [0, 0] # the total left and right counts since the start
+        self.__start = self.__moved = None # time of the start and last time the wheels turned
+        self.__speed = 0
+        self.__cancelled = False
+
+    def __remaining(self):
+        """The distance left to go in mm along the path of the wheels."""
+        remaining = self.target - self.traveled if self.target >= 0 else self.traveled - self.target
+        return math.radians(remaining) * WHEEL_BASE / 2 if self.turn else remaining
+
+    def __drive(self, speed):
+        """Drives the wheels in the direction of the target at the given speed."""
+        if speed != self.__speed:
+            self.__speed = speed
+            speed = int(math.copysign(speed, self.target or 1))
+            if self.turn:
+                self.roomba.drive_direct(speed, -speed)
+            else:
+                self.roomba.drive_direct(speed, speed)
+
+    def __finish(self, error=None):
+        self.__speed = None # always stop
+        self.__drive(0)
+        self.error = error
+        self.done = True
+        return False
+
+    def update(self, frame):
+        """
+        Updates the move with a frame of a stream of the `SENSORS`. Returns True until the move is
+        done, at which point the robot has been stopped.
+        """
+        if self.done:
+            return False
+        if self.__cancelled:
+            return self.__finish()
+        now = self.roomba.clock.monotonic()
+        counts = frame[0], frame[1]
+        if self.__counts is None:
+            self.__start = self.__moved = now
+        else:
+            left = int16(counts[0] - self.__counts[0])
+            right = int16(counts[1] - self.__counts[1])
+            if left or right:
+                self.__moved = now
+            self.__total[0] += left
+            self.__total[1] += right
+            left, right = self.__total
+            if self.turn:
+                self.traveled = math.degrees((right - left) / COUNTS_PER_MM / WHEEL_BASE)
+            else:
+                self.traveled = (left + right) / 2 / COUNTS_PER_MM
+        self.__counts = counts
+
+        # Stop if the robot will reach the target before the next frame
+        remaining = self.__remaining()
+        speed = math.sqrt(2 * self.decel * max(remaining, 0))
+        speed = min(self.velocity, max(self.MIN_VELOCITY, speed))
+        if remaining <= speed * CYCLE / 2:
+            return self.__finish()
+        if self.timeout is not None and now - self.__start >= self.timeout:
+            return self.__finish(TimeoutError('move timed out after %.1f of %.1f %s' % (
+                self.traveled, self.target, 'degrees' if self.turn else 'mm')))
+        if self.stall_time is not None and now - self.__moved >= self.stall_time:
+            return self.__finish(TimeoutError('wheels stalled after %.1f of %.1f %s' % (
+                self.traveled, self.target, 'degrees' if self.turn else 'mm')))
+        self.__drive(int(speed))
+        return True
+
+    def cancel(self):
+        """
+        Stop the move early. The robot is stopped on the next frame. Returns False if the move was
+        already done.
+        """
+        self.__cancelled = True
+        return not self.done
+
+    def result(self):
+        """
+        The distance (in mm) or angle (in degrees) traveled. Raises a `TimeoutError` if the move
+        timed out or stalled.
+        """
+        if self.error is not None:
+            raise self.error
+        return self.traveled
@@ -0,0 +1,164 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import namedtuple
+import math
+import threading
+import time
+
+from .motion import WHEEL_BASE, COUNTS_PER_MM, int16
+from .sensor import Sensor
+
+Pose = namedtuple('Pose', ('timestamp', 'x', 'y', 'heading', 'velocity', 'angular_velocity'))
+Pose.__doc__ = """
+The position of the robot at a time. The x and y are in mm, the heading is in radians counter
+clockwise from the x axis (between -pi and pi), the velocity is the forward speed in mm/s, and the
+angular_velocity is the turning speed in radians/s (positive is counter clockwise).
+"""
+
+def _angle_diff(angle1, angle0):
+    """The difference between two angles in radians wrapped to be between -pi and pi."""
+    diff = angle1 - angle0
+    return math.atan2(math.sin(diff), math.cos(diff))
+
+
+class Odometry:
+    """
+    Dead reckoning of the position of the robot from its wheel encoder counts. Each frame of a
+    stream that includes the `SENSORS` is given to `on_frame()` (or the counts are given to
+    `update()`) which updates the pose in constant time. For example:
+
+        odometry = Odometry(clock=bot.clock)
+        bot.stream(odometry.on_frame, *Odometry.SENSORS)
+
+    The encoder counts are signed 16-bit values that wrap around, which is handled. The first
+    counts only set the starting counts. The most recent pose is available from `pose` and a fixed
+    number (`history`) of the previous poses are kept so that the pose at a recent time can be
+    looked up with `at()`, which interpolates between the poses on either side of it.
+
+    The timestamps are from the `monotonic()` function of the clock unless given to `update()`.
+    This is safe to update from one thread while reading from others.
+    """
+    SENSORS = (Sensor.LEFT_ENCODER_COUNTS, Sensor.RIGHT_ENCODER_COUNTS)
+
+    def __init__(self, x=0.0, y=0.0, heading=0.0, history=256, clock=time): # pylint: disable=too-many-arguments
+        if history < 1:
+            raise ValueError('history')
+        self.clock = clock
+        self.__lock = threading.Lock()
+        self.__ring = [None] * history
+        self.__next = 0 # index in the ring of the next pose
+        self.__count = 0 # number of poses in the ring
+        self.__counts = None # the last left and right encoder counts
+        self.__pose = Pose(None, float(x), float(y), heading, 0.0, 0.0)
+
+    def reset(self, x=0.0, y=0.0, heading=0.0):
+        """Sets the current pose and clears the history. The next counts are the new start."""
+        with self.__lock:
+            self.__next = self.__count = 0
+            self.__counts = None
+            self.__pose = Pose(None, float(x), float(y), heading, 0.0, 0.0)
+
+    @property
+    def pose(self):
+        """The most recent `Pose`, the timestamp is None if there have not been any updates."""
+        return self.__pose
+
+    def on_frame(self, frame):
+        """
+        Updates the pose with a frame from a stream that has the `LEFT_ENCODER_COUNTS` and
+        `RIGHT_ENCODER_COUNTS` sensors. Always returns True so it can be the callback of
+        `Roomba.stream()`.
+        """
+        self.update(frame.LEFT_ENCODER_COUNTS, frame.RIGHT_ENCODER_COUNTS)
+        return True
+
+    def update(self, left, right, timestamp=None):
+        """
+        Updates the pose with the left and right encoder counts recieved at the timestamp
+        (defaulting to now). Returns the new `Pose`.
+        """
+        if timestamp is None:
+            timestamp = self.clock.monotonic()
+        with self.__lock:
+            last = self.__pose
+            if self.__counts is None:
+                pose = last._replace(timestamp=timestamp)
+            else:
+                dleft = int16(left - self.__counts[0]) / COUNTS_PER_MM
+                dright = int16(right - self.__counts[1]) / COUNTS_PER_MM
+                forward, turn = (dleft + dright) / 2, (dright - dleft) / WHEEL_BASE
+                direction = last.heading + turn / 2
+                heading = last.heading + turn
+                elapsed = timestamp - last.timestamp
+                pose = Pose(timestamp,
+                            last.x + forward * math.cos(direction),
+                            last.y + forward * math.sin(direction),
+                            math.atan2(math.sin(heading), math.cos(heading)),
+                            forward / elapsed if elapsed > 0 else last.velocity,
+                            turn / elapsed if elapsed > 0 else last.angular_velocity)
+            self.__counts = (left, right)
+            self.__pose = pose
+            self.__ring[self.__next] = pose
+            self.__next = (self.__next + 1) % len(self.__ring)
+            self.__count = min(self.__count + 1, len(self.__ring))
+        return pose
+
+    def history(self):
+        """Gets a list of the poses in the history, oldest first."""
+        with self.__lock:
+            return [self.__ring[i] for i in self.__indices()]
+
+    def __indices(self):
+        """The indices in the ring of the history, oldest first."""
+        size = len(self.__ring)
+        start = (self.__next - self.__count) % size
+        return [(start + i) % size for i in range(self.__count)]
+
+    def at(self, timestamp):
+        """
+        Gets the `Pose` at the given time by interpolating between the poses in the history before
+        and after it. Raises a `ValueError` if the time is not within the history.
+        """
+        with self.__lock:
+            ring, size, count = self.__ring, len(self.__ring), self.__count
+            start = (self.__next - count) % size
+            if count == 0 or not ring[start].timestamp <= timestamp <= self.__pose.timestamp:
+                raise ValueError('time is not within the history')
+
+            # Binary search for the first pose after the timestamp
+            low, high = 0, count - 1
+            while low < high:
+                mid = (low + high) // 2
+                if ring[(start + mid) % size].timestamp <= timestamp:
+                    low = mid + 1
+                else:
+                    high = mid
+            after = ring[(start + low) % size]
+            if low == 0 or after.timestamp <= timestamp:
+                return after._replace(timestamp=timestamp)
+            before = ring[(start + low - 1) % size]
+
+        frac = (timestamp - before.timestamp) / (after.timestamp - before.timestamp)
+        heading = before.heading + frac * _angle_diff(after.heading, before.heading)
+        return Pose(timestamp,
+                    before.x + frac * (after.x - before.x),
+                    before.y + frac * (after.y - before.y),
+                    math.atan2(math.sin(heading), math.cos(heading)),
+                    before.velocity + frac * (after.velocity - before.velocity),
+                    before.angular_velocity + frac * (after.angular_velocity -
+                                                      before.angular_velocity))
@@ -0,0 +1,107 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from .opcode import Opcode
+
+# The actuator that each actuator command sets, commands that set the same actuator replace each
+# other (for example DRIVE_DIRECT replaces the speeds set by DRIVE)
+ACTUATORS = {
+    ord(Opcode.DRIVE.value): 'wheels',
+    ord(Opcode.DRIVE_DIRECT.value): 'wheels',
+    ord(Opcode.DRIVE_PWM.value): 'wheels',
+    ord(Opcode.MOTORS.value): 'motors',
+    ord(Opcode.MOTORS_PWM.value): 'motors',
+    ord(Opcode.LEDS.value): 'leds',
+    ord(Opcode.LEDS_SCHEDULING.value): 'scheduling_leds',
+    ord(Opcode.LEDS_DIGIT_RAW.value): 'digit_leds',
+    ord(Opcode.LEDS_DIGIT_ASCII.value): 'digit_leds',
+}
+
+# The commands that change the mode of the robot which stops the motors and turns off the LEDs
+MODE_CHANGES = frozenset(ord(op.value) for op in (
+    Opcode.START, Opcode.RESET, Opcode.STOP, Opcode.SAFE, Opcode.SAFE_ALT, Opcode.FULL,
+    Opcode.CLEAN, Opcode.MAX, Opcode.SPOT, Opcode.SEEK_DOCK, Opcode.POWER))
+
+class ActuatorFilter:
+    """
+    An output stage for a `Roomba` (set as its `output_filter` attribute) that removes actuator
+    commands that would not change anything:
+      * a command that sets an actuator (the wheels, motors, LEDs, scheduling LEDs, or digit LEDs)
+        to the same value as the last command sent for that actuator is not sent again
+      * when several commands set the same actuator in a single `Roomba.batch()` only the last of
+        them is sent (in its place among the other commands), like the robot would only act on
+        the last one given during one of its 15 ms cycles
+
+    Commands written outside of a batch are sent right away since there is no way to know if
+    another command for the same actuator will follow within the same cycle. A control loop that
+    gives the commands of each of its ticks in `Roomba.batch(align=True)` has them written together
+    at the start of the robot's next cycle so only the last command of each cycle is sent.
+
+    Once `refresh` seconds (defaulting to 1 second) have passed since a command was sent, repeating
+    it sends it again as a keep-alive in case the robot changed on its own (such as dropping to
+    passive mode after a wheel drop in safe mode). The filter has no timer of its own, it never
+    sends anything that was not given to it, so all writes stay on the thread giving the commands.
+    Setting it to None never refreshes them. The commands that change the mode of the robot forget
+    all of the previous actuator values since the robot resets them.
+
+    The number of commands that were not sent are available in the `suppressed` and `coalesced`
+    attributes.
+    """
+    def __init__(self, refresh=1.0):
+        self.refresh = refresh
+        self.suppressed = 0 # the number of repeated commands not sent
+        self.coalesced = 0 # the number of commands replaced by a later one in the same batch
+        self.__last = {} # actuator -> (command, time sent)
+
+    def reset(self):
+        """Forget the last value sent to every actuator so that the next commands are all sent."""
+        self.__last.clear()
+
+    def filter(self, commands, now):
+        """
+        Filters a list of commands (each being the bytes of a single command) that are about to be
+        sent at the time `now` (in seconds), returning the list of commands to actually send.
+        """
+        latest = {}
+        for i, command in enumerate(commands):
+            actuator = ACTUATORS.get(command[0])
+            if actuator is not None:
+                latest[actuator] = i
+        if not latest:
+            if any(command[0] in MODE_CHANGES for command in commands):
+                self.__last.clear()
+            return commands
+
+        output, last_sent, refresh = [], self.__last, self.refresh
+        for i, command in enumerate(commands):
+            opcode = command[0]
+            actuator = ACTUATORS.get(opcode)
+            if actuator is None:
+                if opcode in MODE_CHANGES:
+                    last_sent.clear()
+                output.append(command)
+            elif latest[actuator] != i:
+                self.coalesced += 1
+            else:
+                last = last_sent.get(actuator)
+                if (last is not None and last[0] == command and
+                        (refresh is None or now - last[1] < refresh)):
+                    self.suppressed += 1
+                else:
+                    last_sent[actuator] = (command, now)
+                    output.append(command)
+        return output
@@ -0,0 +1,123 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from functools import lru_cache
+
+from .sensor import Sensor, FrameLayout
+
+GROUPS = tuple(s for s in Sensor if hasattr(s, 'sensors'))
+
+class QueryPlan:
+    """
+    A plan for reading a set of sensors using the fewest bytes over the serial connection by
+    replacing individual sensor packets with group packets where that is cheaper. These are created
+    with `plan_query()`.
+
+    Attributes:
+      * `requested` - the tuple of `Sensor`s that were requested
+      * `packets` - the tuple of `Sensor`s (individual and group packets) to actually request
+      * `layout` - the `FrameLayout` for the packets that are actually requested
+      * `datatype` - the `namedtuple` type that the requested values are returned as
+      * `nbytes` - the number of bytes sent and recieved for a query or recieved for each stream
+        packet
+    """
+    def __init__(self, requested, packets, nbytes):
+        self.requested = requested
+        self.packets = packets
+        self.layout = FrameLayout.of(packets)
+        self.datatype = Sensor.summarize_group(requested)[0]
+        self.nbytes = nbytes
+
+        # Figure out where each requested value will come from
+        paths = self.layout.paths
+        self.__getters = []
+        for sensor in requested:
+            if sensor.name[0] == '_':
+                continue
+            if hasattr(sensor, 'sensors'):
+                self.__getters.append((sensor.datatype, [paths[sub] for sub in sensor.sensors
+                                                         if sub.name[0] != '_']))
+            else:
+                self.__getters.append((None, paths[sensor]))
+
+    def __repr__(self):
+        return 'QueryPlan(%s -> %s)' % (', '.join(s.name for s in self.requested),
+                                        ', '.join(s.name for s in self.packets))
+
+    def required_time(self, baudrate):
+        """The number of seconds needed to transfer the planned bytes at the given baudrate."""
+        return self.nbytes*10/baudrate
+
+    def extract(self, data):
+        """
+        Takes the decoded data for the planned packets (as returned by `layout.decode()`) and
+        returns just the values that were requested as an instance of `datatype`.
+        """
+        def get(path):
+            return data[path[0]] if len(path) == 1 else data[path[0]][path[1]]
+        return self.datatype._make(get(info) if group is None else group._make(map(get, info))
+                                   for group, info in self.__getters)
+
+
+def _leaves(sensor):
+    """Get the individual sensors that make up a sensor, excluding filler."""
+    if hasattr(sensor, 'sensors'):
+        return frozenset(s for s in sensor.sensors if s.name[0] != '_')
+    return frozenset() if sensor.name[0] == '_' else frozenset((sensor,))
+
+def _antichains(groups, chosen=()):
+    """
+    Generate every combination of groups where no group is contained within another one. Including
+    a group along with one that contains it would never be cheaper than just the larger group.
+    """
+    yield chosen
+    for i, group in enumerate(groups):
+        leaves = _leaves(group)
+        rest = [g for g in groups[i+1:] if not (_leaves(g) <= leaves or leaves <= _leaves(g))]
+        yield from _antichains(rest, chosen + (group,))
+
+@lru_cache(maxsize=128)
+def plan_query(sensors, stream=False):
+    """
+    Plans reading the given sequence of sensors (which must be `Sensor` values) with the fewest
+    bytes transferred by using a combination of individual and group packets. Returns a
+    `QueryPlan`.
+
+    For a query list both the request (the opcode, the number of packets, and the packet ids) and
+    the response cost time since each query waits for the entire response. For a stream the
+    request is only sent once so only the response matters, but each packet in the response is
+    preceded by its packet id.
+
+    Since the sensors are the same at every baudrate, the baudrate only scales the time the plan
+    takes and not which plan is the cheapest. Use `QueryPlan.required_time()` to get the time.
+    """
+    requested = tuple(sensors)
+    wanted = frozenset().union(*(_leaves(sensor) for sensor in requested))
+    per_packet = 1                # the packet id in the request or before each stream packet
+    overhead = 3 if stream else 2 # header, length, and checksum or opcode and count
+
+    # Only groups that include at least one wanted sensor could be useful
+    groups = [g for g in GROUPS if wanted & _leaves(g)]
+    best = (float('inf'), 0, None) # the bytes, number of packets, and packets of the best plan
+    for chosen in _antichains(groups):
+        covered = frozenset().union(*(_leaves(g) for g in chosen))
+        packets = list(chosen) + list(wanted - covered)
+        nbytes = overhead + sum(p.size + per_packet for p in packets)
+        if (nbytes, len(packets)) < best[:2]:
+            best = (nbytes, len(packets), packets)
+    nbytes, _, packets = best
+    return QueryPlan(requested, tuple(sorted(packets, key=lambda s: s.packet_id)), nbytes)
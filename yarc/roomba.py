@@ -17,11 +17,23 @@ along with this program. If not, see <http://www.gnu.org/licenses/>.
 
 import struct
 import time
+from contextlib import contextmanager
+
 import serial
 
 from .enums import Days, Day, Drive, Buttons
 from .opcode import Opcode
-from .sensor import Sensor
+from .sensor import Sensor, FrameLayout
+from .planner import plan_query
+from .stream import (StreamLayout, StreamReader, StreamStats, BackgroundStream, SensorCache,
+                     readinto)
+from .motion import Move, CYCLE, run_move
+from .trajectory import TrajectoryPlayer
+
+# The baudrates the robot supports and the bytes used to select them with the baud command
+BAUD_CODES = {300:b'\x00', 600:b'\x01', 1200:b'\x02', 2400:b'\x03', 4800:b'\x04',
+              9600:b'\x05', 14400:b'\x06', 19200:b'\x07', 28800:b'\x08', 38400:b'\x09',
+              57600:b'\x0A', 115200:b'\x0B'}
 
 def clamp(val, low, high):
     """Clamps a value between the low and high value."""
@@ -36,9 +48,9 @@ def bitflags(*args):
     return val
 def make_sensor_property(sensor):
     """Make a property for a sensor with the given name"""
-    return property(lambda self: self.sensor(sensor))
+    return property(lambda self: self.cached_sensor(sensor))
 
-class Roomba: # pylint: disable=too-many-public-methods
+class Roomba: # pylint: disable=too-many-public-methods, too-many-instance-attributes
     """A connection to a Roomba over a serial port."""
 
     # The following functions are untested:
@@ -49,12 +61,16 @@ class Roomba: # pylint: disable=too-many-public-methods
 	#  * schedule
     #  * set_day_time
 
-    def __init__(self, port, baudrate=115200, timeout=0.045, brc=None):
+    def __init__(self, port, baudrate=115200, timeout=0.045, brc=None, sensor_ttl=0.045, # pylint: disable=too-many-arguments
+                 clock=time):
         """
         Connect to the Roomba on the given port (such as /dev/ttyUSB0 on Linux or COM3 on Windows).
-        This defaults to the default baudrate of Roombas (which can be changed howeevr) and has a
-        timeout of 45ms which is equivilent to 3 data cycles on the Roomba (it does things in 15ms
-        cycles). For some circumstances alternative timeouts are used and cannot be adjusted.
+        The port can be any pyserial URL, including roomba:// to connect to an emulated robot (see
+        `yarc.emulator.Emulator`). The port can also be an already open `serial.Serial` (or an
+        object that acts like one) in which case the baudrate and timeout arguments are not used to
+        open it. This defaults to the default baudrate of Roombas (which can be changed howeevr) and
+        has a timeout of 45ms which is equivilent to 3 data cycles on the Roomba (it does things in
+        15ms cycles). For some circumstances alternative timeouts are used and cannot be adjusted.
 
         The `wake()` method requires pulsing the BRC pin on the Roomba. For the offical Create 2
         cables (except older ones) this pin is connected to the RTS pin of the serial port. The
@@ -64,11 +80,38 @@ class Roomba: # pylint: disable=too-many-public-methods
         you can provide a `brc` function to this constructor. This function takes two arguments.
         The first will be a reference to the Roomba and the second will be False or True to cause
         the pin to be turned off and on.
+
+        While a stream is running (or recently stopped) the sensor attributes are given from the
+        most recent streamed data as long as it is no older than `sensor_ttl` seconds, otherwise
+        they are read from the robot. This can be changed later with the `sensor_ttl` attribute and
+        setting it to None will always read from the robot.
+
+        All waiting and timestamps use the `sleep()` and `monotonic()` functions of `clock` which
+        defaults to the `time` module. A simulated robot can give a virtual clock so that time
+        passes without actually waiting (see `yarc.simulator`).
+
+        Setting the `output_filter` attribute to a `yarc.output.ActuatorFilter` stops repeated
+        actuator commands from being sent and only sends the last command for each actuator in a
+        `batch()`.
         """
         if baudrate not in [19200, 115200]:
             raise ValueError('baudrate')
-        self.__default_baudrate = baudrate
-        self.serial = serial.Serial(port, baudrate=baudrate, timeout=timeout)
+        self._default_baudrate = baudrate
+        self.__stream_layout = None
+        self.__stream_plan = None
+        self._stream_parser = None
+        self.background_stream = None
+        self.sensor_ttl = sensor_ttl
+        self.clock = clock
+        self._sensor_cache = SensorCache(clock)
+        self._snapshot = None
+        self._batch = None # the commands waiting to be written in a batch
+        self._cycle = None # the time of a known start of one of the robot's cycles
+        self.output_filter = None
+        self.__read_buffer = bytearray(Sensor.ALL_SENSORS.size)
+        if isinstance(port, str):
+            port = serial.serial_for_url(port, baudrate=baudrate, timeout=timeout)
+        self.serial = port
         if brc is not None:
             self._brc = brc
     def __del__(self):
@@ -77,11 +120,18 @@ class Roomba: # pylint: disable=too-many-public-methods
         """
         Stop the Roomba and close the serial connection. After this method is called this object is
         not usable. This will block for 60 ms.
+
+        If the serial port is a `yarc.transcript.TranscriptReplay` that has already finished then
+        the port is just closed since the robot was not stopped in the transcript.
         """
         if not self.serial.is_open:
             return
+        self.stop_background_stream()
+        if getattr(self.serial, 'finished', False):
+            self.serial.close()
+            return
         self.power() # causes all LEDs and motors to stop and the Roomba returns to passive mode
-        time.sleep(0.03)
+        self.clock.sleep(0.03)
         self.wake()
         self.stop()
         self.serial.close()
@@ -92,6 +142,80 @@ class Roomba: # pylint: disable=too-many-public-methods
         it. Note that any sensor attribute or method will clear this buffer automatically.
         """
         return self.serial.read(self.serial.in_waiting)
+    def _write(self, data, flush=False):
+        """
+        Write a command to the robot. Within a `batch()` the command is saved to be written with
+        the rest of the batch unless flush is True in which case it is written immediately along
+        with everything before it in the batch. Commands that wait for a response must flush.
+        """
+        batch = self._batch
+        if batch is None:
+            if self.output_filter is None:
+                self.serial.write(data)
+            else:
+                self.__write_all([data])
+        else:
+            batch.append(data)
+            if flush:
+                self.__write_all(batch)
+                del batch[:]
+    def __filter(self, commands):
+        """Filters a list of commands with the `output_filter` (if there is one)."""
+        if self.output_filter is None:
+            return commands
+        return self.output_filter.filter(commands, self.clock.monotonic())
+    def __write_all(self, commands):
+        """Writes a list of commands with a single write after filtering them."""
+        commands = self.__filter(commands)
+        if commands:
+            self.serial.write(b''.join(commands))
+    @contextmanager
+    def batch(self, align=False):
+        """
+        Gathers all commands sent in the `with` block and writes them to the robot with a single
+        write at the end of the block instead of one write per command. For example:
+
+            with bot.batch():
+                bot.drive_direct(100, 100)
+                bot.leds(debris=True)
+                bot.motors(main_brush=True)
+
+        The commands are still sent in the order they were given. Reading sensors within the block
+        first sends the commands given before it so that they are still in order. Nested batches
+        are part of the outer batch.
+
+        If align is True then the batch is written at the start of the robot's next 15 ms cycle,
+        blocking until then. The cycles are found from the times that stream packets are recieved
+        (since they are sent at the start of each cycle). Without a stream, the first aligned batch
+        is written immediately and later ones are kept at least 15 ms apart and on the same
+        schedule so that a control loop writes at most once per cycle.
+
+        If the block raises an exception then the commands in the batch that have not been written
+        yet are thrown away.
+        """
+        if self._batch is not None:
+            yield
+            return
+        self._batch = batch = []
+        try:
+            yield
+        finally:
+            self._batch = None
+        batch = self.__filter(batch)
+        if batch:
+            if align:
+                self.__wait_for_cycle()
+            self.serial.write(b''.join(batch))
+    def __wait_for_cycle(self):
+        """Waits until the start of the robot's next cycle."""
+        now = self.clock.monotonic()
+        if self._cycle is not None:
+            wait = (self._cycle - now) % CYCLE
+            if now + wait - self._cycle < CYCLE * 0.5:
+                wait += CYCLE # never write twice in the same cycle
+            self.clock.sleep(wait)
+            now += wait
+        self._cycle = now
 
     # Getting Started Commands
     def start(self):
@@ -102,7 +226,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Available: all modes
         Changes mode to: passive, beeps if coming from "off" mode.
         """
-        self.serial.write(Opcode.START)
+        self._write(Opcode.START)
     def reset(self, welcome_msg_bytes=6):
         """
         This command resets the robot, as if you had removed and reinserted the battery.
@@ -121,9 +245,9 @@ class Roomba: # pylint: disable=too-many-public-methods
         Changes mode to: off
         """
         self.serial.reset_input_buffer()
-        self.serial.write(Opcode.RESET)
+        self._write(Opcode.RESET, True)
         self.serial.reset_input_buffer()
-        self.serial.baudrate = self.__default_baudrate
+        self.serial.baudrate = self._default_baudrate
 
         # pylint: disable=line-too-long
 
@@ -159,7 +283,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Available: passive, safe, full
         Changes mode to: off, beeps
         """
-        self.serial.write(Opcode.STOP)
+        self._write(Opcode.STOP)
     def wake(self, sleep_time=0.015):
         """
         Wake up robot. This is useful in at least two different cases:
@@ -173,9 +297,9 @@ class Roomba: # pylint: disable=too-many-public-methods
         The `Roomba` constructor takes a `brc` function that is used with this function.
         """
         self._brc(False)
-        time.sleep(sleep_time)
+        self.clock.sleep(sleep_time)
         self._brc(True)
-        time.sleep(sleep_time)
+        self.clock.sleep(sleep_time)
     def _brc(self, state): # pylint: disable=method-hidden
         """Default BRC state change function uses the serial port's RTS and DTR pins."""
         self.serial.rts = state
@@ -195,11 +319,8 @@ class Roomba: # pylint: disable=too-many-public-methods
 
         This function blocks for at least 100ms.
         """
-        baud_codes = {300:b'\x00', 600:b'\x01', 1200:b'\x02', 2400:b'\x03', 4800:b'\x04',
-                      9600:b'\x05', 14400:b'\x06', 19200:b'\x07', 28800:b'\x08', 38400:b'\x09',
-                      57600:b'\x0A', 115200:b'\x0B'}
-        self.serial.write(Opcode.BAUD + baud_codes[baudrate])
-        time.sleep(0.1) # required
+        self._write(Opcode.BAUD + BAUD_CODES[baudrate], True)
+        self.clock.sleep(0.1) # required
         self.serial.baudrate = baudrate
 
     # Mode Commands
@@ -211,7 +332,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Available: passive, safe, full
         Changes mode to: safe
         """
-        self.serial.write(Opcode.SAFE)
+        self._write(Opcode.SAFE)
     def full(self):
         """
         This command gives you complete control over Roomba by putting the OI into Full mode, and
@@ -222,7 +343,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Available: passive, safe, full
         Changes mode to: full
         """
-        self.serial.write(Opcode.FULL)
+        self._write(Opcode.FULL)
 
     # Cleaning commands
     def clean(self):
@@ -233,7 +354,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Available: passive, safe, full
         Changes mode to: passive
         """
-        self.serial.write(Opcode.CLEAN)
+        self._write(Opcode.CLEAN)
     def max(self):
         """
         This command starts the Max cleaning mode, which will clean until the battery is dead. This
@@ -242,7 +363,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Available: passive, safe, full
         Changes mode to: passive
         """
-        self.serial.write(Opcode.MAX)
+        self._write(Opcode.MAX)
     def spot(self):
         """
         This command starts the Spot cleaning mode. This is the same as pressing Roomba's Spot
@@ -251,7 +372,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Available: passive, safe, full
         Changes mode to: passive
         """
-        self.serial.write(Opcode.SPOT)
+        self._write(Opcode.SPOT)
     def seek_dock(self):
         """
         This command directs Roomba to drive onto the dock the next time it encounters the docking
@@ -261,7 +382,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Available: passive, safe, full
         Changes mode to: passive
         """
-        self.serial.write(Opcode.SEEK_DOCK)
+        self._write(Opcode.SEEK_DOCK)
     def power(self):
         """
         This command powers down Roomba. The OI can be in Passive, Safe, or Full mode to accept
@@ -270,7 +391,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Available: passive, safe, full
         Changes mode to: passive
         """
-        self.serial.write(Opcode.POWER)
+        self._write(Opcode.POWER)
     def schedule(self, sun=None, mon=None, tue=None, wed=None, thu=None, fri=None, sat=None): # pylint: disable=too-many-arguments
         """
         This command sends Roomba a new schedule. To disable scheduled cleaning give no arguments.
@@ -297,7 +418,7 @@ class Roomba: # pylint: disable=too-many-public-methods
             else:
                 data += b'\x00\x00'
         data = struct.pack('B', int(days)) + data
-        self.serial.write(Opcode.SCHEDULE + data)
+        self._write(Opcode.SCHEDULE + data)
     def set_day_time(self, day_of_week, hour, minute):
         """
         This command sets Roomba's clock.
@@ -313,7 +434,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         if minute < 0 or minute > 59:
             raise ValueError('minute')
         data = struct.pack('BBB', day_of_week, hour, minute)
-        self.serial.write(Opcode.SET_DAY_TIME + data)
+        self._write(Opcode.SET_DAY_TIME + data)
 
     # Actuator Commands
     # These are all available in safe and full modes
@@ -345,7 +466,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         velocity = clamp(velocity, -500, 500)
         radius = Drive.STRAIGHT if radius is None else clamp(radius, -2000, 2000)
         data = struct.pack('>hh', velocity, radius)
-        self.serial.write(Opcode.DRIVE + data)
+        self._write(Opcode.DRIVE + data)
     def drive_direct(self, r_vel, l_vel):
         """
         This command lets you control the forward and backward motion of Roomba's drive wheels
@@ -359,7 +480,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         Velocities are clamped between -500 and 500 mm/s.
         """
         data = struct.pack('>hh', clamp(r_vel, -500, 500), clamp(l_vel, -500, 500))
-        self.serial.write(Opcode.DRIVE_DIRECT + data)
+        self._write(Opcode.DRIVE_DIRECT + data)
     def drive_pwm(self, r_pwm, l_pwm):
         """
         This command lets you control the raw forward and backward motion of Roomba's drive wheels
@@ -370,7 +491,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         PWMs are clamped between -255 and 255 mm/s.
         """
         data = struct.pack('>hh', clamp(r_pwm, -255, 255), clamp(l_pwm, -255, 255))
-        self.serial.write(Opcode.DRIVE_PWM + data)
+        self._write(Opcode.DRIVE_PWM + data)
 
     # Convience functions
     def drive_stop(self):
@@ -379,42 +500,50 @@ class Roomba: # pylint: disable=too-many-public-methods
     def drive_rotate(self, velocity):
         """Rotates in place counter clockwise (negative velocity will go clockwise)."""
         self.drive(velocity, Drive.TURN_CCW)
-    def turn_angle(self, angle, velocity=100):
-        """
-        Attempts to rotate a specific angle (in degrees) in place overall at a given velocity (the
-        default is 100 mm/s). Returns the estimated angle in degrees turned.
-        """
-        # pylint: disable=no-member
-        _ = self.angle # clear the angle counter
-        turned = 0
-        if angle > 0:
-            self.drive_direct(velocity, -velocity)
-            while turned < angle:
-                turned += self.angle
-        else:
-            self.drive_direct(-velocity, velocity)
-            while turned > angle:
-                turned += self.angle
-        self.drive_direct(0, 0)
-        return turned
-    def drive_distance(self, distance, velocity=100):
-        """
-        Attempts to drive a specific distance (in mm) at a given velocity (the default is 100
-        mm/s). Returns the estimated distance travelled in mm.
-        """
-        # pylint: disable=no-member
-        _ = self.distance # clear the distance counter
-        traveled = 0
-        if distance > 0:
-            self.drive_direct(velocity, velocity)
-            while traveled < distance:
-                traveled += self.distance
-        else:
-            self.drive_direct(-velocity, -velocity)
-            while traveled > distance:
-                traveled += self.distance
-        self.drive_direct(0, 0)
-        return traveled
+    def turn_angle(self, angle, velocity=100, timeout=None, wait=True):
+        """
+        Rotates a specific angle (in degrees, positive is counter clockwise) in place at a given
+        velocity (the default is 100 mm/s). Returns the angle in degrees turned as measured by the
+        wheel encoders.
+
+        The move is controlled every 15 ms using a stream (or the background stream, see
+        `yarc.motion.run_move()`), slowing down near the end so that it doesn't overshoot (see
+        `yarc.motion.Move`). If the wheels stall or the move takes longer than timeout seconds then
+        the robot is stopped and a `TimeoutError` is raised.
+
+        If wait is False then the move is done on another thread and a `yarc.motion.MoveFuture` of
+        the result is returned immediately. Cancelling it stops the move.
+        """
+        return run_move(self, Move(self, angle=angle, velocity=velocity, timeout=timeout), wait)
+    def drive_distance(self, distance, velocity=100, timeout=None, wait=True):
+        """
+        Drives a specific distance (in mm) at a given velocity (the default is 100 mm/s). Returns
+        the distance travelled in mm as measured by the wheel encoders.
+
+        The move is controlled every 15 ms using a stream (or the background stream, see
+        `yarc.motion.run_move()`), slowing down near the end so that it doesn't overshoot (see
+        `yarc.motion.Move`). If the wheels stall or the move takes longer than timeout seconds then
+        the robot is stopped and a `TimeoutError` is raised.
+
+        If wait is False then the move is done on another thread and a `yarc.motion.MoveFuture` of
+        the result is returned immediately. Cancelling it stops the move.
+        """
+        move = Move(self, distance=distance, velocity=velocity, timeout=timeout)
+        return run_move(self, move, wait)
+    def play_trajectory(self, setpoints, command='drive_direct', wait=True):
+        """
+        Plays a precomputed trajectory, a sequence of `(t, right_velocity, left_velocity)` rows
+        (or `(t, velocity, radius)` if the command is 'drive'), sending each setpoint at its time
+        in seconds from the start. The setpoints are sent in step with the robot's 15 ms cycles
+        using a stream (see `yarc.trajectory.TrajectoryPlayer`). Returns the
+        `yarc.trajectory.TrajectoryStats` of how far off the timing of the setpoints was. The robot
+        is left doing the last setpoint.
+
+        If wait is False then the trajectory is played on another thread and a
+        `yarc.motion.MoveFuture` of the result is returned immediately. Cancelling it stops sending
+        setpoints.
+        """
+        return run_move(self, TrajectoryPlayer(self, setpoints, command), wait)
 
     def motors(self, # pylint: disable=too-many-arguments
                side_brush=False, vacuum=False, main_brush=False,
@@ -427,7 +556,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         """
         data = struct.pack('B', bitflags(side_brush, vacuum, main_brush,
                                          side_brush_cw, main_brush_outward))
-        self.serial.write(Opcode.MOTORS + data)
+        self._write(Opcode.MOTORS + data)
     def motors_pwm(self, main_brush=0, side_brush=0, vacuum=0):
         """
         This command lets you control the speed of Roomba's main brush, side brush, and vacuum
@@ -445,7 +574,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         side_brush = clamp(side_brush, -127, 127)
         vacuum = clamp(vacuum, 0, 127)
         data = struct.pack('BBB', main_brush, side_brush, vacuum)
-        self.serial.write(Opcode.MOTORS_PWM + data)
+        self._write(Opcode.MOTORS_PWM + data)
     def leds(self, # pylint: disable=too-many-arguments
              home=False, spot=False, check=False, debris=False,
              power_color=0, power_intensity=0):
@@ -463,7 +592,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         power_color = clamp(power_color, 0, 255)
         power_intensity = clamp(power_intensity, 0, 255)
         data = struct.pack('BBB', bitflags(debris, spot, home, check), power_color, power_intensity)
-        self.serial.write(Opcode.LEDS + data)
+        self._write(Opcode.LEDS + data)
     def scheduling_leds(self, # pylint: disable=too-many-arguments, invalid-name
                         sun=False, mon=False, tue=False, wed=False, thu=False, fri=False, sat=False,
                         colon=False, pm=False, am=False, clock=False, schedule=False):
@@ -473,7 +602,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         data = struct.pack('BB',
                            bitflags(sun, mon, tue, wed, thu, fri, sat),
                            bitflags(colon, pm, am, clock, schedule))
-        self.serial.write(Opcode.LEDS_SCHEDULING + data)
+        self._write(Opcode.LEDS_SCHEDULING + data)
     @staticmethod
     def digit(top=False, top_right=False, bottom_right=False, # pylint: disable=too-many-arguments
               bottom=False, bottom_left=False, top_left=False, middle=False):
@@ -503,7 +632,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         if isinstance(digit0, tuple):
             digit0 = Roomba.digit(*digit0)
         data = struct.pack('BBBB', digit3, digit2, digit1, digit0)
-        self.serial.write(Opcode.LEDS_DIGIT_RAW + data)
+        self._write(Opcode.LEDS_DIGIT_RAW + data)
     def digit_leds_ascii(self, string):
         """
         This command controls the four 7 segment displays on the Roomba 560 and 570 using ASCII
@@ -521,7 +650,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         if any(ch < 32 or ch > 126 for ch in string):
             raise ValueError('invalid characters')
         string += b' '*(4-len(string))
-        self.serial.write(Opcode.LEDS_DIGIT_ASCII + string)
+        self._write(Opcode.LEDS_DIGIT_ASCII + string)
     def press_buttons(self, buttons=Buttons.NONE, # pylint: disable=too-many-arguments
                       clean=False, spot=False, dock=False,
                       minute=False, hour=False, day=False, schedule=False, clock=False):
@@ -531,7 +660,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         """
         buttons |= bitflags(clean, spot, dock, minute, hour, day, schedule, clock)
         data = struct.pack('B', buttons)
-        self.serial.write(Opcode.BUTTONS + data)
+        self._write(Opcode.BUTTONS + data)
     @staticmethod
     def note(name):
         """
@@ -577,7 +706,7 @@ class Roomba: # pylint: disable=too-many-public-methods
         notes = [Roomba.note(n) if isinstance(n, str) else n for n in notes]
         data = struct.pack('BB', song_num, len(notes))
         data += b''.join(struct.pack('BB', n, d) for n, d in zip(notes, durations))
-        self.serial.write(Opcode.SONG + data)
+        self._write(Opcode.SONG + data)
         return sum(durations) / 64
     def play_song(self, song_num):
         """
@@ -589,11 +718,11 @@ class Roomba: # pylint: disable=too-many-public-methods
         if song_num < 0 or song_num > 3:
             raise ValueError('song number must be 0 to 3')
         data = struct.pack('B', song_num)
-        self.serial.write(Opcode.PLAY + data)
+        self._write(Opcode.PLAY + data)
 
     # Input Commands
     @staticmethod
-    def __get_sensor(sensor):
+    def _get_sensor(sensor):
         if isinstance(sensor, int):
             return Sensor(sensor) # pylint: disable=no-value-for-parameter
         if isinstance(sensor, str):
@@ -601,97 +730,231 @@ class Roomba: # pylint: disable=too-many-public-methods
         if isinstance(sensor, Sensor):
             return sensor
         raise TypeError()
-    def __required_time(self, nbytes):
+    def __read(self, nbytes):
+        """
+        Reads exactly nbytes from the serial port into a reusable buffer with a single
+        `stream.readinto()` and returns a `memoryview` of them. The data is only valid until the
+        next read.
+        """
+        if len(self.__read_buffer) < nbytes:
+            self.__read_buffer = bytearray(nbytes)
+        view = memoryview(self.__read_buffer)[:nbytes]
+        if readinto(self.serial, view) != nbytes:
+            raise serial.SerialTimeoutException('did not recieve expected data from Roomba')
+        return view
+    @staticmethod
+    def _query_layout(sensors, optimize=False):
+        """
+        Gets the `QueryPlan` (or None if not optimizing) and the `FrameLayout` to use for a query
+        list of the given sensors.
+        """
+        num = len(sensors)
+        if num < 1 or num > 255:
+            raise ValueError('invalid number of sensors')
+        sensors = [Roomba._get_sensor(sensor) for sensor in sensors]
+        if optimize:
+            plan = plan_query(tuple(sensors))
+            return plan, plan.layout
+        return None, FrameLayout.of(sensors)
+    def _stream_layout(self, sensors, optimize=False):
+        """
+        Gets the `QueryPlan` (or None if not optimizing) and the `StreamLayout` to use for a stream
+        of the given sensors, making sure that it can be sent at the current baudrate.
+        """
+        num = len(sensors)
+        if num < 1 or num > 255:
+            raise ValueError('invalid number of sensors')
+        sensors = [Roomba._get_sensor(sensor) for sensor in sensors]
+        if optimize:
+            plan = plan_query(tuple(sensors), True)
+            sensors = plan.packets
+        else:
+            plan = None
+        layout = StreamLayout.of(sensors)
+        if self._required_time(layout.frame_size) > 0.015:
+            raise ValueError('requesting too much data to stream')
+        return plan, layout
+    def _required_time(self, nbytes):
         return nbytes*10/self.serial.baudrate
-    def sensor(self, sensor):
+    def sensor(self, sensor, lazy=False):
         """
         This command requests the OI to send a packet of sensor data bytes. There are 58 different
         sensor data packets. Each provides a value of a specific sensor or group of sensors.
 
         The sensor can be the packet id, the name of a sensor, or the Sensor value.
+
+        If lazy is True and the sensor is a group packet then a `FrameView` of the raw data is
+        returned instead of a `namedtuple` which only decodes the values as they are accessed.
         """
-        sensor = Roomba.__get_sensor(sensor)
+        sensor = Roomba._get_sensor(sensor)
         data = struct.pack('B', sensor.packet_id)
-        self.serial.write(Opcode.SENSORS + data)
+        self._write(Opcode.SENSORS + data, True)
         self.serial.reset_input_buffer()
-        wait = self.__required_time(sensor.size) - 0.0005
+        wait = self._required_time(sensor.size) - 0.0005
         if wait > 0:
-            time.sleep(wait)
-        return sensor.parse(self.serial.read(sensor.size))
-    def query_list(self, *sensors):
+            self.clock.sleep(wait)
+        data = self.__read(sensor.size)
+        if lazy and hasattr(sensor, 'layout'):
+            return sensor.layout.view(data.tobytes())
+        return sensor.parse(data)
+    def cached_sensor(self, sensor, ttl=None):
+        """
+        Gets the value of a single sensor from the most recent streamed data if it is available
+        and no older than `ttl` seconds (defaulting to the `sensor_ttl` attribute), otherwise the
+        sensor is read from the robot with `sensor()`. All of the sensor attributes use this.
+
+        While a stream is running only the sensors included in the stream should be read since
+        reading other sensors from the robot interferes with the stream.
+
+        Inside of a `snapshot()` block the sensors in the snapshot are always given from it.
+        """
+        sensor = Roomba._get_sensor(sensor)
+        try:
+            return self._cached_value(sensor, ttl)
+        except KeyError:
+            return self.sensor(sensor)
+    def _cached_value(self, sensor, ttl=None):
+        """
+        Gets the value of a sensor from the current snapshot or the recent stream data, raising a
+        `KeyError` if it is not available.
+        """
+        if self._snapshot is not None:
+            try:
+                return self._snapshot.get(sensor, float('inf'))
+            except KeyError:
+                pass
+        ttl = self.sensor_ttl if ttl is None else ttl
+        if ttl is None:
+            raise KeyError(sensor)
+        return self._sensor_cache.get(sensor, ttl)
+    def query_list(self, *sensors, optimize=False, lazy=False):
         """
         This command lets you ask for a list of sensor packets. The result is returned once, as in
         the Sensors command. The robot returns the packets in the order you specify.
 
         The sensors can be the packet ids, the names of the sensors, or the Sensors values.
+
+        If optimize is True then the sensors are read using the combination of individual and group
+        packets that transfers the fewest bytes (see `planner.plan_query()`). The result still only
+        has the sensors requested.
+
+        If lazy is True then a `FrameView` of the raw data is returned instead of a `namedtuple`
+        which only decodes the values as they are accessed.
         """
-        num = len(sensors)
-        if num < 1 or num > 255:
-            raise ValueError('invalid number of sensors')
-        sensors = [Roomba.__get_sensor(sensor) for sensor in sensors]
-        data = struct.pack(str(num+1) + 'B', num, *[sensor.packet_id for sensor in sensors])
-        self.serial.write(Opcode.QUERY_LIST + data)
+        plan, layout = self._query_layout(sensors, optimize)
+        self._write(Opcode.QUERY_LIST + layout.request, True)
         self.serial.reset_input_buffer()
-        datatype, size, struct_format = Sensor.summarize_group(sensors)
-        wait = self.__required_time(size) - 0.001
+        wait = self._required_time(layout.size) - 0.001
         if wait > 0:
-            time.sleep(wait)
-        return datatype._make(
-            Sensor.convert_list(sensors, struct.unpack(struct_format, self.serial.read(size))))
-    def stream(self, callback, *sensors):
+            self.clock.sleep(wait)
+        data = self.__read(layout.size)
+        data = layout.view(data.tobytes()) if lazy else layout.decode(data)
+        return data if plan is None else plan.extract(data)
+    @contextmanager
+    def snapshot(self, *sensors):
+        """
+        Reads a list of sensors with a single `query_list()` and, for the rest of the `with` block,
+        answers all sensor attribute reads for those sensors from that one response. For example:
+
+            with bot.snapshot('BATTERY_CHARGE', 'BATTERY_CAPACITY'):
+                print(bot.battery_charge / bot.battery_capacity)
+
+        only communicates with the robot once. If no sensors are given then all sensors are read
+        using the `ALL_SENSORS` group packet. Group packets are used instead of the individual
+        sensors whenever that is faster. The value of the `with` statement is the result of
+        the `query_list()`.
+
+        Like reading them from the robot, the `distance` and `angle` attributes are reset to 0
+        after they are read within the block.
+        """
+        sensors = Roomba._snapshot_sensors(sensors)
+        data = self.query_list(*sensors, optimize=True)
+        previous, self._snapshot = self._snapshot, Roomba._make_snapshot(sensors, data)
+        try:
+            yield data
+        finally:
+            self._snapshot = previous
+    @staticmethod
+    def _snapshot_sensors(sensors):
+        """Gets the list of `Sensor`s to use for a snapshot."""
+        return [Roomba._get_sensor(sensor) for sensor in sensors or (Sensor.ALL_SENSORS,)]
+    @staticmethod
+    def _make_snapshot(sensors, data):
+        """Makes the `SensorCache` for a snapshot of the given sensors and query list result."""
+        snapshot = SensorCache()
+        snapshot.update(FrameLayout.of(sensors).paths, data, time.monotonic())
+        return snapshot
+    def stream(self, callback, *sensors, optimize=False, lazy=False, recorder=None): # pylint: disable=too-many-arguments
         """
         This command starts a stream of data packets. The list of packets requested is sent every
         15 ms, which is the rate Roomba uses to update data.
 
         The callback function will be called for each packet recieved and given a single argument
-        with the collection of sensor data. That function must return True if it wishes to keep
-        recieving data. To stop recieving data it can return False or another thread (not the
-        callback) can call pause_stream(). If pause_stream() is called then a timeout exception
-        will be raised from this function.
+        with the collection of sensor data as a `namedtuple`. That function must return True if it
+        wishes to keep recieving data. To stop recieving data it can return False or another thread
+        (not the callback) can call pause_stream(). If pause_stream() is called then a timeout
+        exception will be raised from this function.
+
+        Any corrupted data recieved is skipped and the stream continues with the next valid packet.
+        The number of bad packets and bytes skipped is available from `stream_stats`.
+
+        All of the data must be able to be sent within the 15 ms between packets at the current
+        baudrate. If optimize is True then the sensors are streamed using the combination of
+        individual and group packets that transfers the fewest bytes (see `planner.plan_query()`)
+        which allows more sensors to fit at lower baudrates. The callback is still only given the
+        sensors requested.
+
+        If lazy is True then the callback is given a `FrameView` of the raw data of each packet
+        instead of a `namedtuple` which only decodes the values as they are accessed.
+
+        If a recorder (a `telemetry.TelemetryRecorder`) is given then every valid packet is also
+        written to it along with the time it was recieved. When optimizing, the packets recorded
+        are the ones actually streamed and not the sensors requested.
         """
-        num = len(sensors)
-        if num < 1 or num > 255:
-            raise ValueError('invalid number of sensors')
-        sensors = [Roomba.__get_sensor(sensor) for sensor in sensors]
-        data = struct.pack(str(num+1) + 'B', num, *[sensor.packet_id for sensor in sensors])
-        size = sum(s.size for s in sensors)
-        if size+num+3 > 15/10*self.serial.baudrate:
-            raise ValueError('requesting too much data to stream')
+        plan, layout = self._stream_layout(sensors, optimize)
 
         # Start the stream
-        self.serial.write(Opcode.STREAM + data)
+        self.__stream_layout, self.__stream_plan = layout, plan
+        self._write(Opcode.STREAM + layout.request, True)
         self.serial.reset_input_buffer()
-        self.__stream_read(callback)
-    def __stream_read(self, callback):
-        # Keep reading data from the stream until the callback returns False
-        try:
-            orig_timeout = self.serial.timeout
-            self.serial.timeout = 0.1 # first iteration needs a bit longer wait time
-            while True:
-                header, n_bytes = struct.unpack('BB', self.serial.read(2))
-                if header != 19:
-                    raise ValueError('did not recieve expected data from Roomba')
-                self.serial.timeout = 0.015
-                data = self.serial.read(n_bytes)
-                checksum = struct.unpack('B', self.serial.read(1))[0]
-                self.serial.timeout = 0.03
-                #print(time.perf_counter()) # comes about every 16ms
-                if (header + n_bytes + checksum + sum(x for x in data)) & 0xFF != 0:
-                    raise ValueError('did not recieve expected data from Roomba')
-                pos, sensors, out = 0, [], []
-                while pos < n_bytes:
-                    packet_id = data[pos]
-                    pos += 1
-                    sensor = Sensor(packet_id) # pylint: disable=no-value-for-parameter
-                    sensors.append(sensor)
-                    out.append(sensor.parse(data[pos:pos+sensor.size]))
-                    pos += sensor.size
-                out = Sensor.convert_list(sensors, out)
-                if not callback(out):
-                    break
-        finally:
-            self.pause_stream()
-            self.serial.timeout = orig_timeout
+        self.__stream_read(callback, lazy, recorder)
+    def __stream_read(self, callback, lazy=False, recorder=None):
+        reader = StreamReader(self, self.__stream_layout, self.__stream_plan, lazy, recorder)
+        reader.run(callback)
+    @property
+    def stream_stats(self):
+        """
+        The statistics of the current (or last) stream as a `StreamStats` `namedtuple` with the
+        number of valid frames, dropped bytes, bad checksums, and resynchronizations. Corrupted
+        data in the stream does not stop the stream, instead the bad data is skipped and counted.
+        """
+        if self._stream_parser is None:
+            return StreamStats(0, 0, 0, 0)
+        return self._stream_parser.stats
+    def start_background_stream(self, *sensors, history=256, optimize=False, lazy=False, # pylint: disable=too-many-arguments
+                                recorder=None):
+        """
+        Starts a stream of data packets like `stream()` except that the data is read on a
+        dedicated thread instead of blocking this one. Returns a `BackgroundStream` object (which
+        is also saved as the `background_stream` attribute) which always has the most recent frame
+        available without blocking along with a history of the last `history` frames. The optimize,
+        lazy, and recorder arguments are the same as for `stream()`.
+
+        Only a single stream can be running at a time. The background stream is stopped with
+        `stop_background_stream()`.
+        """
+        if self.background_stream is not None and self.background_stream.running:
+            raise ValueError('a background stream is already running')
+        if len(sensors) < 1 or len(sensors) > 255:
+            raise ValueError('invalid number of sensors')
+        sensors = [Roomba._get_sensor(sensor) for sensor in sensors]
+        self.background_stream = BackgroundStream(self, sensors, history, optimize, lazy, recorder)
+        return self.background_stream
+    def stop_background_stream(self):
+        """Stops the stream started with `start_background_stream()` if there is one."""
+        if self.background_stream is not None:
+            self.background_stream.stop()
+            self.background_stream = None
     def pause_stream(self):
         """
         This command lets you stop the stream without clearing the list of requested packets.
@@ -700,14 +963,18 @@ class Roomba: # pylint: disable=too-many-public-methods
         place it can be called from is another thread in which case the thread reading the
         streaming data will have a timeout exception.
         """
-        self.serial.write(Opcode.STREAM_PAUSE_RESUME + b'\x00')
-    def resume_stream_raw(self, callback):
+        self._write(Opcode.STREAM_PAUSE_RESUME + b'\x00', True)
+    def resume_stream_raw(self, callback, lazy=False, recorder=None):
         """
         This command lets you start the stream using the list of packets last requested. Like
-        stream this will block until the callback returns False or the stream is paused.
-        """
-        self.serial.write(Opcode.STREAM_PAUSE_RESUME + b'\x01')
-        self.__stream_read(callback)
+        stream this will block until the callback returns False or the stream is paused. This
+        can only be used after `stream()` has been called on this object since the list of packets
+        is needed to decode the data.
+        """
+        if self.__stream_layout is None:
+            raise ValueError('no stream has been started')
+        self._write(Opcode.STREAM_PAUSE_RESUME + b'\x01', True)
+        self.__stream_read(callback, lazy, recorder)
 
     # Add all sensors (except unused and groups) as named properties for easy access
     Roomba = vars()
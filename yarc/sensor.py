@@ -19,6 +19,7 @@ import struct
 from collections import namedtuple
 from collections.abc import Sequence
 from enum import Enum, EnumMeta, unique
+from functools import lru_cache
 
 from .enums import (
     BumpAndWheelDrops, WheelOvercurrents, Buttons,
@@ -38,6 +39,10 @@ class Sensor(Enum):
         or a `namedtuple` type
       * `size` - number of bytes to be read for this sensor
       * `struct_format` - the `struct.unpack` format string to be used for this sensor
+      * `lookup` - only for sensors whose datatype is an `Enum`, an `EnumTable` for converting the
+        raw byte values to the `Enum` values
+      * `sensors` and `layout` - only for group packets, the list of `Sensor`s in the group and the
+        `FrameLayout` of the group
     A few useful methods are available as well.
     """
     BUMPS_AND_WHEEL_DROPS       = ( 7, BumpAndWheelDrops)
@@ -130,6 +135,8 @@ class Sensor(Enum):
         `int`, `bool`, one of the `IntEnum` or `IntFlag` objects from `enums`, or a `namedtuple` of
         values for multiple values.
         """
+        if hasattr(self, 'layout'):
+            return self.layout.decode(raw) # pylint: disable=no-member
         return self.convert(struct.unpack(self.struct_format, raw))
 
     def convert(self, data):
@@ -147,7 +154,7 @@ class Sensor(Enum):
                 if len(data) != 1:
                     raise ValueError()
                 data = data[0]
-            return self.datatype(data)
+            return self.lookup[data] # pylint: disable=no-member
         if issubclass(self.datatype, tuple):
             # pylint: disable=no-member
             return self.datatype._make(Sensor.convert_list(self.sensors, data))
@@ -172,18 +179,252 @@ class Sensor(Enum):
 
         The `namedtuple` will default to having the class name 'Group'. The second argument can
         change this.
+
+        The results are cached so the same sequence of sensors always gives the same `namedtuple`
+        type without having to create a new one.
         """
-        group = namedtuple(name, [s.name for s in sensors if s.name[0] != '_'])
-        size = sum(s.size for s in sensors)
-        frmt = ('>' + ''.join(s.struct_format.strip('>') for s in sensors))
-        return group, size, frmt
+        return _summarize_group(tuple(sensors), name)
+
+@lru_cache(maxsize=256)
+def _summarize_group(sensors, name):
+    """Cached implementation of `Sensor.summarize_group()`."""
+    group = namedtuple(name, [s.name for s in sensors if s.name[0] != '_'])
+    size = sum(s.size for s in sensors)
+    frmt = ('>' + ''.join(s.struct_format.strip('>') for s in sensors))
+    return group, size, frmt
+
+
+class EnumTable(dict):
+    """
+    A lookup table from the raw byte values of a sensor to the values of its `IntEnum` or `IntFlag`
+    datatype. All 256 possible values are converted ahead of time so that converting is a single
+    lookup instead of calling the `Enum` constructor which is slow, especially for `IntFlag`s with
+    multiple bits set. Values that are not valid for the `Enum` are passed to the constructor when
+    looked up so that they raise the same errors as before.
+    """
+    def __init__(self, datatype):
+        super().__init__()
+        self.datatype = datatype
+        for value in range(256):
+            try:
+                self[value] = datatype(value)
+            except ValueError:
+                pass
+    def __missing__(self, key):
+        return self.datatype(key)
+
+
+class FrameLayout: # pylint: disable=too-many-instance-attributes
+    """
+    The compiled layout of the data for a list of sensors, like the response to a query list
+    command. Everything about the data is known ahead of time so it can be decoded with a single
+    `struct.Struct.unpack_from()` call and then only the values that are enumerations or part of
+    group packets need any further conversion.
+
+    Attributes:
+      * `sensors` - the tuple of `Sensor`s
+      * `datatype` - the `namedtuple` type that the decoded data is returned as
+      * `size` - the number of bytes of data
+      * `frame_size` - the number of bytes of each frame read from the robot, the same as `size`
+      * `struct` - the compiled `struct.Struct` for the data
+      * `paths` - a `dict` of each individual `Sensor` in the data (including those inside of
+        group packets) to a tuple of the indices needed to get its value from the decoded data
+      * `request` - the `bytes` of the number of sensors followed by their packet ids, as sent with
+        the query list and stream commands
+      * `offsets` - the offset of the data of each sensor
+
+    If `id_bytes` is True then each sensor's data is preceded by its packet id (like in a stream).
+    The `name` is the class name of the `namedtuple` type.
+
+    Compiling a layout takes much longer than decoding data with it so `of()` should be used to
+    get a cached layout for a sequence of sensors.
+    """
+    def __init__(self, sensors, id_bytes=False, name='Group'):
+        self.sensors = sensors = tuple(sensors)
+        self.datatype = Sensor.summarize_group(sensors, name)[0]
+        prefix = 'x' if id_bytes else ''
+        self.struct = struct.Struct('>' + ''.join(prefix + s.struct_format[1:] for s in sensors))
+        self.size = self.frame_size = self.struct.size
+        self.request = bytes([len(sensors)] + [s.packet_id for s in sensors])
+        self.offsets, offset = [], 0
+        for packet in sensors:
+            offset += len(prefix)
+            self.offsets.append(offset)
+            offset += packet.size
+        self.__view_type = None
+
+        # Figure out which of the flat values need to be converted (enumerations) and how the flat
+        # values are grouped back together (group packets)
+        self._converters, self._groups, self.paths = [], [], {}
+        index = position = 0 # index in the flat values and position in the decoded data
+        for packet in sensors:
+            if packet.name[0] == '_':
+                continue # filler, produces no values
+            if hasattr(packet, 'sensors'):
+                start = index
+                for sub in packet.sensors:
+                    if sub.name[0] == '_':
+                        continue
+                    if isinstance(sub.datatype, EnumMeta):
+                        self._converters.append((index, sub.lookup.__getitem__))
+                    self.paths.setdefault(sub, (position, index - start))
+                    index += 1
+                self._groups.append((packet.datatype, start, index))
+            else:
+                if isinstance(packet.datatype, EnumMeta):
+                    self._converters.append((index, packet.lookup.__getitem__))
+                self.paths.setdefault(packet, (position,))
+                index += 1
+            position += 1
+        self._groups.reverse() # replaced from the end so that the earlier indices stay valid
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join(s.name for s in self.sensors))
+
+    @classmethod
+    def of(cls, sensors):
+        """
+        Gets the layout for the given sequence of sensors. The most recently used layouts are
+        cached so that reading the same sensors repeatedly does not compile them each time.
+        """
+        return _layout(cls, tuple(sensors))
+
+    @property
+    def view_type(self):
+        """The `FrameView` subclass for this layout, see `view()`."""
+        if self.__view_type is None:
+            self.__view_type = _make_view_type(self)
+        return self.__view_type
+
+    def view(self, data, offset=0):
+        """
+        Get a lazy view of the data (starting at the given offset in data) instead of decoding all
+        of it. This is a `FrameView` which has the same attributes as `datatype` but each value is
+        only decoded from the raw data when it is accessed. This is much faster when only a few of
+        the values will ever be looked at.
+        """
+        return self.view_type(data, offset) # pylint: disable=not-callable
+
+    def decode(self, data, offset=0):
+        """
+        Decode the data (starting at the given offset in data) into an instance of `datatype`. No
+        checking of the data is done by this method.
+        """
+        values = self.struct.unpack_from(data, offset)
+        if self._converters:
+            values = list(values)
+            for index, converter in self._converters:
+                values[index] = converter(values[index])
+        if self._groups:
+            values = list(values)
+            for group, start, end in self._groups:
+                values[start:end] = [group._make(values[start:end])]
+        return self.datatype._make(values)
+
+
+class FrameView:
+    """
+    A read-only view of the raw data for a list of sensors, with the same attributes as the
+    `namedtuple` the data would be decoded into. The raw data is kept as a `memoryview` and each
+    value is decoded every time it is accessed. These are created with `FrameLayout.view()`.
+
+    Like a `namedtuple` the values can also be accessed by index, iterated over, and converted to a
+    `dict` with `_asdict()`. The `decode()` method decodes all of the values into the `namedtuple`.
+    """
+    __slots__ = ('_data', '_offset')
+    _layout = None # set on subclasses
+    _fields = ()
+
+    def __init__(self, data, offset=0):
+        self._data = memoryview(data)
+        self._offset = offset
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self)[index]
+        return getattr(self, self._fields[index])
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self._fields)
+
+    def __eq__(self, other):
+        if not isinstance(other, (tuple, FrameView)):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        values = ', '.join('%s=%r' % (name, getattr(self, name)) for name in self._fields)
+        return '%s(%s)' % (type(self).__name__, values)
+
+    @property
+    def raw(self):
+        """The raw bytes of the data."""
+        return self._data[self._offset:self._offset+self._layout.size].tobytes()
+
+    def _asdict(self):
+        """Get the values as a `dict`."""
+        return {name: getattr(self, name) for name in self._fields}
+
+    def decode(self):
+        """Decode all of the values into the `namedtuple` type of the layout."""
+        return self._layout.decode(self._data, self._offset)
+
+class _ViewField: # pylint: disable=too-few-public-methods
+    """Descriptor for a single value of a `FrameView`."""
+    __slots__ = ('unpack_from', 'offset', 'convert')
+    def __init__(self, packet, offset):
+        self.unpack_from = struct.Struct(packet.struct_format).unpack_from
+        self.offset = offset
+        self.convert = packet.lookup.__getitem__ if hasattr(packet, 'lookup') else None
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        value = self.unpack_from(obj._data, obj._offset + self.offset)[0] # pylint: disable=protected-access
+        return value if self.convert is None else self.convert(value)
+
+class _ViewGroup: # pylint: disable=too-few-public-methods
+    """Descriptor for a group packet within a `FrameView`, which is itself a `FrameView`."""
+    __slots__ = ('view_type', 'offset')
+    def __init__(self, packet, offset):
+        self.view_type = packet.layout.view_type
+        self.offset = offset
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return self.view_type(obj._data, obj._offset + self.offset) # pylint: disable=protected-access
+
+def _make_view_type(layout):
+    """Create the `FrameView` subclass for a `FrameLayout`."""
+    attrs = {'__slots__': (), '_layout': layout, '_fields': layout.datatype._fields}
+    for packet, offset in zip(layout.sensors, layout.offsets):
+        if packet.name[0] != '_':
+            field = _ViewGroup if hasattr(packet, 'sensors') else _ViewField
+            attrs[packet.name] = field(packet, offset)
+    return type(layout.datatype.__name__ + 'View', (FrameView,), attrs)
+
+@lru_cache(maxsize=64)
+def _layout(cls, sensors):
+    """Cached implementation of `FrameLayout.of()`."""
+    return cls(sensors)
 
 
-# Calculate the size and struct format of the list-based sensors
+# Calculate the size and struct format of the list-based sensors and the enum lookup tables
 for sensor in Sensor.__members__.values():
-    if isinstance(sensor.datatype, list):
+    if isinstance(sensor.datatype, EnumMeta):
+        sensor.lookup = EnumTable(sensor.datatype)
+    elif isinstance(sensor.datatype, list):
         sensor.sensors = [Sensor(i) for i in sensor.datatype] # pylint: disable=no-value-for-parameter
         sensor.datatype, sensor.size, sensor.struct_format = \
             Sensor.summarize_group(sensor.sensors,
                                    ''.join(word.capitalize() for word in sensor.name.split('_')))
+        sensor.layout = FrameLayout(sensor.sensors, name=sensor.datatype.__name__)
 del sensor # pylint: disable=undefined-loop-variable
@@ -0,0 +1,320 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from concurrent.futures import Future
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+
+from .fleet import Fleet
+from .roomba import Roomba
+from .stream import StreamLayout
+
+# Each slot of the shared memory is a sequence number (an unsigned 64-bit integer), a timestamp (a
+# double), and the stream frame. The sequence number is odd while the slot is being written and 0
+# before the first frame. They are accessed through views of the memory cast to those types since
+# single aligned values are written all at once while `struct.pack_into()` zeros the memory first.
+SLOT_HEADER_SIZE = 16
+
+def _shared_memory():
+    """Imports `multiprocessing.shared_memory` which is only available in Python 3.8 and newer."""
+    try:
+        from multiprocessing import shared_memory # pylint: disable=import-outside-toplevel
+    except ImportError:
+        raise ImportError('shared memory requires Python 3.8 or newer') from None
+    return shared_memory
+
+
+class SharedFrames: # pylint: disable=too-many-instance-attributes
+    """
+    The latest stream frame of each of a number of robots kept in a block of shared memory so that
+    any process can read them without any communication with the process writing them. The layout
+    of the block is fixed by the `StreamLayout` of the sensors: one slot for each robot with a
+    sequence number, the timestamp, and the raw frame.
+
+    Each slot is protected by a seqlock: the writer makes the sequence number odd, writes the
+    frame, and then makes it even again while a reader retries if the sequence number was odd or
+    changed while it was copying the frame. A reader never blocks the writer and never sees half
+    of one frame and half of another. There must be only one writer for each slot.
+
+    Create a new block with `SharedFrames(sensors, count)` and attach to it from another process
+    with `SharedFrames(sensors, count, name)` using its `name`. Requires Python 3.8 or newer.
+    """
+    def __init__(self, sensors, count, name=None):
+        shared_memory = _shared_memory()
+        self.layout = StreamLayout.of([Roomba._get_sensor(s) for s in sensors]) # pylint: disable=protected-access
+        self.count = count
+        size = SLOT_HEADER_SIZE + self.layout.frame_size
+        self.slot_size = size + (-size % 8) # keep the sequence numbers aligned
+        self.owner = name is None
+        if self.owner:
+            self.memory = shared_memory.SharedMemory(create=True, size=self.slot_size * count)
+            self.memory.buf[:self.slot_size * count] = bytes(self.slot_size * count)
+        else:
+            self.memory = _attach(shared_memory, name)
+        self.name = self.memory.name
+        self.__buf = self.memory.buf
+        self.__seqs = self.__buf.cast('Q')
+        self.__stamps = self.__buf.cast('d')
+
+    def publish(self, index, frame, timestamp):
+        """
+        Write the raw frame (from the header through the checksum) of the robot with the given
+        index along with the time it was recieved.
+        """
+        offset = index * self.slot_size
+        seqs, word = self.__seqs, offset // 8
+        seq = seqs[word]
+        seqs[word] = seq + 1
+        self.__stamps[word + 1] = timestamp
+        start = offset + SLOT_HEADER_SIZE
+        self.__buf[start:start+len(frame)] = frame
+        seqs[word] = seq + 2
+
+    def read_raw(self, index, timeout=0.1):
+        """
+        Read the latest `(sequence number, timestamp, raw frame)` of the robot with the given
+        index. The sequence number increases by 2 with each frame and is 0 (with no frame) if none
+        have been published.
+
+        If a whole frame cannot be read within timeout seconds (for example the writer died while
+        writing it) then a `TimeoutError` is raised.
+        """
+        offset = index * self.slot_size
+        buf, seqs, word = self.__buf, self.__seqs, offset // 8
+        start = offset + SLOT_HEADER_SIZE
+        end = start + self.layout.frame_size
+        deadline = None
+        while True:
+            seq = seqs[word]
+            if seq == 0:
+                return 0, None, None
+            if not seq & 1:
+                timestamp = self.__stamps[word + 1]
+                frame = bytes(buf[start:end])
+                if seqs[word] == seq:
+                    return seq, timestamp, frame
+            # Being written, let the writer finish
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() >= deadline:
+                raise TimeoutError('the frame of robot %d is still being written' % index)
+            time.sleep(0)
+
+    def latest(self, index):
+        """
+        Gets the latest `(timestamp, frame)` of the robot with the given index with the frame
+        decoded, or None if no frames have been published.
+        """
+        _, timestamp, frame = self.read_raw(index)
+        return None if frame is None else (timestamp, self.layout.decode(frame, 2))
+
+    def close(self):
+        """Detach from the shared memory, and free it if this created it."""
+        if self.__buf is None:
+            return
+        self.__seqs.release()
+        self.__stamps.release()
+        self.__buf.release()
+        self.__buf = self.__seqs = self.__stamps = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+def _attach(shared_memory, name):
+    """Attach to existing shared memory without tracking it so it is only freed by its creator."""
+    try:
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        # Before Python 3.13 it is always tracked, which is fine for the worker processes since
+        # they share the resource tracker of the process that created it
+        return shared_memory.SharedMemory(name)
+
+
+def _send_result(results, ident, future):
+    """
+    Puts the `(id, exception, result)` of a finished command on the results queue. If they cannot
+    be pickled then a `TypeError` is sent instead since the queue would drop them.
+    """
+    ex = future.exception()
+    result = None if ex is not None else future.result()
+    try:
+        pickle.dumps((ex, result))
+    except Exception as pickle_ex: # pylint: disable=broad-except
+        ex, result = TypeError('the result of the command cannot be sent: %r' % pickle_ex), None
+    results.put((ident, ex, result))
+
+def _worker(name, sensors, count, robots, kwargs, commands, results, errors, timeout): # pylint: disable=too-many-arguments, too-many-locals
+    """
+    The main function of a worker process of a `ShardedFleet`. Runs a `Fleet` of the robots, given
+    as a list of `(index, port)`, publishing their frames to the `SharedFrames` with the given
+    name. The commands queue gives `(id, index, method, args, kwargs)` for the robots with None to
+    stop, the results queue gets `(id, exception, result)` for every command, and the errors queue
+    gets `(index, message)` for every error.
+    """
+    frames = SharedFrames(sensors, count, name)
+    fleet = Fleet(timeout, lambda index, ex: errors.put((index, repr(ex))))
+    def publish(index, frame):
+        frames.publish(index, frame, time.monotonic())
+        return True
+    for index, port in robots:
+        fleet.add(index, Roomba(port, **kwargs))
+        fleet.submit(index, 'start')
+        fleet.stream(index, publish, *sensors, raw=True)
+
+    def forward():
+        while True:
+            command = commands.get()
+            if command is None:
+                fleet.stop()
+                break
+            future = fleet.submit(command[1], command[2], *command[3], **command[4])
+            future.add_done_callback(
+                lambda future, ident=command[0]: _send_result(results, ident, future))
+    thread = threading.Thread(target=forward, name='yarc-shard-commands', daemon=True)
+    thread.start()
+    try:
+        fleet.run()
+    finally:
+        try:
+            fleet.close()
+        finally:
+            frames.close()
+
+
+class ShardedFleet: # pylint: disable=too-many-instance-attributes
+    """
+    A fleet of robots divided among a number of worker processes (defaulting to the number of CPUs)
+    so that every core can be used. Each worker runs a `Fleet` for its robots which streams the
+    sensors and publishes each frame to `SharedFrames` so that this process can get the latest
+    frame of any robot with `latest()` without communicating with the workers. For example:
+
+        with ShardedFleet(ports, ['VOLTAGE', 'BUMPS_AND_WHEEL_DROPS']) as fleet:
+            fleet.submit(0, 'safe')
+            timestamp, frame = fleet.latest(0)
+
+    The robots are given by the list of their ports and identified by their index in it. The
+    workers send the start command to each robot and then start streaming. The keyword arguments
+    are given to the `Roomba` constructor in the workers so they must be picklable. The
+    timestamps are from `time.monotonic()` in the workers.
+
+    Commands are sent to the workers with `submit()` which returns a `concurrent.futures.Future`
+    of the result like `Fleet.submit()`, so the results and exceptions must be picklable. Errors
+    from the workers (such as a stream stopping) are collected in `errors`.
+
+    Requires Python 3.8 or newer.
+    """
+    def __init__(self, ports, sensors, workers=None, timeout=0.1, **kwargs):
+        ports = list(ports)
+        if not ports:
+            raise ValueError('no robots given')
+        workers = min(workers or os.cpu_count() or 1, len(ports))
+        self.frames = SharedFrames(sensors, len(ports))
+        self.__errors = multiprocessing.Queue()
+        self.__results = multiprocessing.Queue()
+        self.__queues = [multiprocessing.Queue() for _ in range(workers)]
+        self.__futures = {} # the futures of the commands waiting for results by their ids
+        self.__ids = itertools.count()
+        self.__lock = threading.Lock()
+        self.__shards = [i % workers for i in range(len(ports))]
+        self.__error_log = {}
+        self.__processes = []
+        for worker, commands in enumerate(self.__queues):
+            robots = [(i, port) for i, port in enumerate(ports) if i % workers == worker]
+            process = multiprocessing.Process(
+                target=_worker, name='yarc-shard-%d' % worker, daemon=True,
+                args=(self.frames.name, tuple(sensors), len(ports), robots, kwargs, commands,
+                      self.__results, self.__errors, timeout))
+            process.start()
+            self.__processes.append(process)
+        self.__thread = threading.Thread(target=self.__receive, name='yarc-shard-results',
+                                         daemon=True)
+        self.__thread.start()
+
+    def __receive(self):
+        """Gives the results from the workers to the futures until None is recieved."""
+        while True:
+            message = self.__results.get()
+            if message is None:
+                break
+            ident, ex, result = message
+            with self.__lock:
+                future = self.__futures.pop(ident, None)
+            if future is None or not future.set_running_or_notify_cancel():
+                continue
+            if ex is not None:
+                future.set_exception(ex)
+            else:
+                future.set_result(result)
+
+    def __len__(self):
+        return self.frames.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def latest(self, index):
+        """Gets the latest `(timestamp, frame)` of a robot or None if there isn't one yet."""
+        return self.frames.latest(index)
+
+    def submit(self, index, command, *args, **kwargs):
+        """
+        Send a command (the name of a `Roomba` method) to a robot. Returns a
+        `concurrent.futures.Future` of the result.
+        """
+        future = Future()
+        with self.__lock:
+            ident = next(self.__ids)
+            self.__futures[ident] = future
+        self.__queues[self.__shards[index]].put((ident, index, command, args, kwargs))
+        return future
+
+    @property
+    def errors(self):
+        """A `dict` of the index of each robot that had an error and the message of the error."""
+        try:
+            while True:
+                index, message = self.__errors.get_nowait()
+                self.__error_log[index] = message
+        except queue.Empty:
+            pass
+        return self.__error_log
+
+    def close(self, timeout=5):
+        """Stop the workers (which stops the robots) and free the shared memory."""
+        for commands in self.__queues:
+            commands.put(None)
+        for process in self.__processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.__processes = []
+        self.__results.put(None)
+        self.__thread.join(timeout)
+        with self.__lock:
+            futures, self.__futures = self.__futures, {}
+        for future in futures.values():
+            future.cancel() # never ran
+        self.frames.close()
@@ -0,0 +1,183 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import threading
+
+from .enums import BumpAndWheelDrops
+from .emulator import Emulator
+from .motion import WHEEL_BASE, COUNTS_PER_MM, int16
+from .sensor import Sensor
+
+ROBOT_RADIUS = 174 # mm
+MAX_VELOCITY = 500 # mm/s
+
+# The cliff sensors as (sensor, signal sensor, angle from the front in radians)
+CLIFF_SENSORS = (
+    (Sensor.CLIFF_LEFT, Sensor.CLIFF_SIGNAL_LEFT, math.radians(65)),
+    (Sensor.CLIFF_FRONT_LEFT, Sensor.CLIFF_SIGNAL_FRONT_LEFT, math.radians(20)),
+    (Sensor.CLIFF_FRONT_RIGHT, Sensor.CLIFF_SIGNAL_FRONT_RIGHT, math.radians(-20)),
+    (Sensor.CLIFF_RIGHT, Sensor.CLIFF_SIGNAL_RIGHT, math.radians(-65)),
+)
+CLIFF_SENSOR_DISTANCE = 150 # mm from the center of the robot
+FLOOR_SIGNAL = 2500
+
+class VirtualClock:
+    """
+    A clock where time only passes when something sleeps, which makes sleeping instant. This can be
+    given as the `clock` of `Roomba` and `Emulator` to run faster than real time. The time starts
+    at 0 and is in seconds.
+
+    Only one thread should be sleeping on the clock at a time, otherwise time passes faster for
+    each of them.
+    """
+    def __init__(self, start=0.0):
+        self.__now = start
+        self.__lock = threading.Lock()
+
+    def monotonic(self):
+        """The current virtual time."""
+        return self.__now
+    time = perf_counter = monotonic
+
+    def sleep(self, seconds):
+        """Advance the virtual time by the given number of seconds without waiting."""
+        if seconds > 0:
+            with self.__lock:
+                self.__now += seconds
+
+
+class World:
+    """
+    A simple map for the simulated robot to drive around in. It is a rectangular room with walls
+    from (0, 0) to (width, height) in mm along with rectangular obstacles that the robot will bump
+    into and rectangular cliffs that the cliff sensors will detect. The rectangles are given as
+    (x0, y0, x1, y1). Without a width and height the floor goes on forever.
+    """
+    def __init__(self, width=None, height=None, obstacles=(), cliffs=()):
+        self.width, self.height = width, height
+        self.obstacles = [World.__rect(rect) for rect in obstacles]
+        self.cliffs = [World.__rect(rect) for rect in cliffs]
+
+    @staticmethod
+    def __rect(rect):
+        x0, y0, x1, y1 = rect
+        return (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+
+    def contacts(self, x, y, radius):
+        """
+        Gets the directions (in radians) from the point (x, y) to every wall or obstacle closer
+        than the radius.
+        """
+        directions = []
+        if self.width is not None:
+            for dist, direction in ((x, math.pi), (self.width - x, 0),
+                                    (y, -math.pi/2), (self.height - y, math.pi/2)):
+                if dist < radius:
+                    directions.append(direction)
+        for x0, y0, x1, y1 in self.obstacles:
+            closest_x, closest_y = min(max(x, x0), x1), min(max(y, y0), y1)
+            dx, dy = closest_x - x, closest_y - y
+            if dx*dx + dy*dy < radius*radius:
+                directions.append(math.atan2(dy, dx))
+        return directions
+
+    def is_cliff(self, x, y):
+        """Checks if the point (x, y) is over a cliff."""
+        return any(x0 <= x <= x1 and y0 <= y <= y1 for x0, y0, x1, y1 in self.cliffs)
+
+
+class Simulator(Emulator): # pylint: disable=too-many-instance-attributes
+    """
+    An emulated robot (see `Emulator`) that moves like a differential-drive robot. The drive
+    commands set the speed of each wheel and every 15 ms cycle the robot moves in the `world`
+    (a `World`) and the `DISTANCE`, `ANGLE`, `LEFT_ENCODER_COUNTS`, and `RIGHT_ENCODER_COUNTS`
+    sensors change to match. Running into a wall or obstacle stalls the wheels, so neither the robot
+    nor its odometry moves, and sets the bump sensors. The cliff sensors are set when they are over
+    a cliff.
+
+    The simulation uses a `VirtualClock` by default so that a `Roomba` connected to it with
+    `roomba()` never actually waits, allowing many simulated runs to be done quickly.
+
+    The position of the robot is in `x` and `y` (in mm) and `heading` (in radians counter clockwise
+    from the x axis).
+    """
+    def __init__(self, world=None, x=0.0, y=0.0, heading=0.0, clock=None): # pylint: disable=too-many-arguments
+        super().__init__(VirtualClock() if clock is None else clock)
+        self.world = World() if world is None else world
+        self.x, self.y, self.heading = x, y, heading
+        self.__distance = self.__angle = 0.0 # partial mm and degrees not yet reported
+        self.__left_counts = self.__right_counts = 0.0
+        self.__update_sensors()
+
+    def step(self, seconds):
+        left, right = self.velocities
+        left = min(max(left, -MAX_VELOCITY), MAX_VELOCITY) * seconds
+        right = min(max(right, -MAX_VELOCITY), MAX_VELOCITY) * seconds
+
+        # Move the robot unless it would run into something, in which case the wheels stall
+        heading = self.heading + (right - left) / WHEEL_BASE
+        forward = (left + right) / 2
+        x = self.x + forward * math.cos((self.heading + heading) / 2)
+        y = self.y + forward * math.sin((self.heading + heading) / 2)
+        contacts = self.world.contacts(x, y, ROBOT_RADIUS)
+        if contacts:
+            left = right = 0.0
+        else:
+            self.x, self.y = x, y
+            self.heading = math.atan2(math.sin(heading), math.cos(heading))
+
+        # Odometry, based on how far the wheels turned
+        self.__left_counts += left * COUNTS_PER_MM
+        self.__right_counts += right * COUNTS_PER_MM
+        self.__distance += (left + right) / 2
+        self.__angle += math.degrees((right - left) / WHEEL_BASE)
+        self.__update_sensors(contacts)
+
+    def __update_sensors(self, contacts=()):
+        values = self.values
+
+        # Odometry, the whole mm and degrees are reported and the rest is kept for later
+        distance, angle = int(self.__distance), int(self.__angle)
+        self.__distance -= distance
+        self.__angle -= angle
+        values[Sensor.DISTANCE] = int16(values[Sensor.DISTANCE] + distance)
+        values[Sensor.ANGLE] = int16(values[Sensor.ANGLE] + angle)
+        values[Sensor.LEFT_ENCODER_COUNTS] = int16(int(self.__left_counts))
+        values[Sensor.RIGHT_ENCODER_COUNTS] = int16(int(self.__right_counts))
+
+        # Bumpers, the contacts (of the robot pushing against something or touching it) are left or
+        # right of the front of the robot
+        bumps = BumpAndWheelDrops.NONE
+        for direction in contacts or self.world.contacts(self.x, self.y, ROBOT_RADIUS + 1):
+            relative = math.atan2(math.sin(direction - self.heading),
+                                  math.cos(direction - self.heading))
+            if abs(relative) < math.pi/2:
+                if relative > -math.radians(10):
+                    bumps |= BumpAndWheelDrops.BUMP_LEFT
+                if relative < math.radians(10):
+                    bumps |= BumpAndWheelDrops.BUMP_RIGHT
+        values[Sensor.BUMPS_AND_WHEEL_DROPS] = (
+            (values[Sensor.BUMPS_AND_WHEEL_DROPS] & ~3) | int(bumps))
+
+        # Cliffs
+        for sensor, signal, angle in CLIFF_SENSORS:
+            cliff = self.world.is_cliff(
+                self.x + CLIFF_SENSOR_DISTANCE * math.cos(self.heading + angle),
+                self.y + CLIFF_SENSOR_DISTANCE * math.sin(self.heading + angle))
+            values[sensor] = int(cliff)
+            values[signal] = 0 if cliff else FLOOR_SIGNAL
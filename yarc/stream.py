@@ -0,0 +1,479 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import select
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+import serial
+from serial.serialutil import SerialBase
+
+from .sensor import Sensor, FrameLayout
+
+STREAM_HEADER = 19
+
+def readinto(port, buffer):
+    """
+    Reads up to `len(buffer)` bytes from a serial port into the buffer, waiting no longer than the
+    port's timeout, and returns the number of bytes read.
+
+    The `readinto()` of pyserial ports just calls `read()` and copies the result, so a pyserial
+    port on a POSIX system is read from its file descriptor directly into the buffer instead, which
+    does not create any new objects. Other ports use their own `readinto()` if they have one
+    (like `TranscriptRecorder`), otherwise they are read with `read()` and the data is copied.
+    """
+    if isinstance(port, serial.Serial) and hasattr(os, 'readv'):
+        return _read_fd(port.fileno(), buffer, port.timeout)
+    if getattr(type(port), 'readinto', SerialBase.readinto) is not SerialBase.readinto:
+        return port.readinto(buffer)
+    data = port.read(len(buffer))
+    buffer[:len(data)] = data
+    return len(data)
+
+def _read_fd(fd, buffer, timeout):
+    """Reads into the buffer from a file descriptor like `serial.Serial.read()`."""
+    size, nread = len(buffer), 0
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while nread < size:
+        wait = None if deadline is None else max(deadline - time.monotonic(), 0)
+        ready, _, _ = select.select([fd], [], [], wait)
+        if not ready:
+            break
+        try:
+            nbytes = os.readv(fd, [buffer[nread:]])
+        except (BlockingIOError, InterruptedError):
+            continue
+        if not nbytes:
+            raise serial.SerialException('device reports readiness to read but returned no data '
+                                         '(device disconnected or multiple access on port?)')
+        nread += nbytes
+    return nread
+
+class StreamLayout(FrameLayout):
+    """
+    The compiled layout of a stream frame for a fixed list of sensors. Since the list of packets
+    cannot change once a stream is started, everything about the frame is known ahead of time: its
+    length, where each packet id byte is, and the struct format for the entire frame. This makes it
+    possible to decode an entire frame with a single `struct.Struct.unpack_from()` call instead of
+    looking up and parsing each packet individually.
+
+    The frame data given to the methods of this class is the data between the length byte and the
+    checksum of a stream packet, which includes the packet ids before each sensor's data.
+
+    In addition to the attributes of `FrameLayout` this has:
+      * `size` - the number of data bytes in each frame (the value of the length byte)
+      * `frame_size` - the total number of bytes of each stream packet including the header, length
+        byte and checksum
+      * `struct` - the compiled `struct.Struct` for the frame data, skipping over the packet ids
+    """
+    def __init__(self, sensors):
+        super().__init__(sensors, True)
+        if self.size > 255:
+            raise ValueError('requesting too much data to stream')
+        self.frame_size = self.size + 3
+        self.id_offsets, offset = [], 0
+        for sensor in self.sensors:
+            self.id_offsets.append(offset)
+            offset += sensor.size + 1
+        self.header = bytes((STREAM_HEADER, self.size))
+
+    def check_ids(self, data):
+        """
+        Checks that the packet ids in the frame data are where they are expected to be. This only
+        needs to be done on the first frame after synchronizing with the stream since the robot
+        always sends the same list of packets.
+        """
+        if len(data) != self.size:
+            return False
+        return all(data[offset] == sensor.packet_id
+                   for offset, sensor in zip(self.id_offsets, self.sensors))
+
+    @staticmethod
+    def checksum_ok(frame):
+        """Checks the checksum of an entire stream packet (header through checksum)."""
+        return sum(frame) & 0xFF == 0
+
+
+StreamStats = namedtuple('StreamStats', ['frames', 'dropped_bytes', 'bad_checksums', 'resyncs'])
+
+class StreamParser: # pylint: disable=too-many-instance-attributes
+    """
+    A self-resynchronizing parser for the stream packets described by a `StreamLayout`. Data read
+    from the serial port is given to `feed()` in chunks of any size and the complete and valid
+    frames are returned. If the data is corrupted (for example by noise on the serial line) the
+    parser drops bytes until it finds the next valid header, length, and checksum and then keeps
+    going instead of giving up on the stream.
+
+    Alternatively, `read_from()` reads from the serial port into a preallocated buffer with
+    `readinto()` so that, for pyserial ports on POSIX systems, no new objects need to be allocated
+    for each frame.
+
+    The following counters are available:
+      * `frames` - the number of valid frames found
+      * `dropped_bytes` - the number of bytes thrown away while looking for a valid frame
+      * `bad_checksums` - the number of frames with a valid header but a bad checksum
+      * `resyncs` - the number of times a valid frame was found after losing synchronization
+    """
+    def __init__(self, layout):
+        self.layout = layout
+        self.frames = self.dropped_bytes = self.bad_checksums = self.resyncs = 0
+        self.__buffer = bytearray(2*layout.frame_size)
+        self.__view = memoryview(self.__buffer)
+        self.__start = self.__end = 0
+        self.__synced = False
+        self.__lost_sync = False
+
+    @property
+    def stats(self):
+        """The current counters as a `StreamStats` `namedtuple`."""
+        return StreamStats(self.frames, self.dropped_bytes, self.bad_checksums, self.resyncs)
+
+    @property
+    def buffer(self):
+        """
+        The internal buffer that the offsets returned by `read_from()` refer to. The data in it is
+        only valid until the next call to `read_from()` or `feed()`.
+        """
+        return self.__buffer
+
+    def frame(self, offset):
+        """Get a copy of the frame at the given offset in `buffer` as a `bytes` object."""
+        return bytes(self.__view[offset:offset+self.layout.frame_size])
+
+    def reset(self):
+        """Throws away any buffered data, for example after the stream is paused."""
+        self.__start = self.__end = 0
+        self.__synced = False
+
+    def __make_room(self, nbytes):
+        """Makes sure there is room for nbytes more bytes at the end of the buffer."""
+        start, end = self.__start, self.__end
+        if len(self.__buffer) - end >= nbytes:
+            return
+        if len(self.__buffer) - (end - start) < nbytes:
+            # Need to grow the buffer
+            self.__buffer = self.__buffer[start:end] + bytearray(nbytes + self.layout.frame_size)
+            self.__view = memoryview(self.__buffer)
+        else:
+            # Move the remaining data to the beginning of the buffer
+            self.__buffer[:end-start] = self.__buffer[start:end]
+        self.__start, self.__end = 0, end - start
+
+    def __drop(self, nbytes):
+        self.__start += nbytes
+        self.dropped_bytes += nbytes
+        if self.__synced:
+            self.__synced = False
+            self.__lost_sync = True
+
+    def __parse(self):
+        """Finds all of the valid frames in the buffer and returns their offsets."""
+        layout, buf, view = self.layout, self.__buffer, self.__view
+        header, frame_size = layout.header, layout.frame_size
+        offsets = []
+        while self.__end - self.__start >= 2:
+            start, end = self.__start, self.__end
+            # Look for the header
+            if buf[start] != header[0] or buf[start+1] != header[1]:
+                index = buf.find(header, start, end)
+                self.__drop(end - 1 - start if index == -1 else index - start)
+                continue
+            if end - start < frame_size:
+                break
+            if sum(view[start:start+frame_size]) & 0xFF != 0:
+                self.bad_checksums += 1
+                self.__drop(1)
+                continue
+            if not self.__synced and not layout.check_ids(view[start+2:start+frame_size-1]):
+                self.__drop(1)
+                continue
+            # Valid frame
+            self.__start += frame_size
+            if self.__lost_sync:
+                self.resyncs += 1
+                self.__lost_sync = False
+            self.__synced = True
+            self.frames += 1
+            offsets.append(start)
+        return offsets
+
+    def feed(self, data):
+        """
+        Add data read from the serial port to the parser. Returns a list of the complete frames
+        (each a `bytes` object from the header through the checksum) that are now available. These
+        can be decoded with `layout.decode(frame, 2)`.
+        """
+        self.__make_room(len(data))
+        self.__buffer[self.__end:self.__end+len(data)] = data
+        self.__end += len(data)
+        return [self.frame(offset) for offset in self.__parse()]
+
+    def read_from(self, port):
+        """
+        Reads the data needed to complete the next frame from the serial port into the internal
+        buffer using a single `readinto()` call. Returns a list of the offsets of the complete
+        frames now in `buffer` (which can be decoded with `layout.decode(buffer, offset+2)`) or
+        None if no data could be read before the port timed out.
+        """
+        nbytes = self.layout.frame_size - (self.__end - self.__start)
+        if nbytes <= 0:
+            nbytes = self.layout.frame_size
+        self.__make_room(nbytes)
+        nread = readinto(port, self.__view[self.__end:self.__end+nbytes])
+        if not nread:
+            return None
+        self.__end += nread
+        return self.__parse()
+
+
+class StreamReader: # pylint: disable=too-few-public-methods
+    """
+    Reads the stream packets of a `StreamLayout` from the serial port of a `Roomba` and gives each
+    frame to a callback until it returns False. This is used by `Roomba.stream()` and
+    `Roomba.resume_stream_raw()` once the stream has been requested.
+
+    Each frame updates the Roomba's sensor cache and is recorded to the recorder (a
+    `telemetry.TelemetryRecorder`) if one is given. If there is a `QueryPlan` then the callback is
+    only given the sensors that were requested.
+    """
+    def __init__(self, roomba, layout, plan=None, lazy=False, recorder=None): # pylint: disable=too-many-arguments
+        self.roomba = roomba
+        self.layout, self.plan = layout, plan
+        self.lazy, self.recorder = lazy, recorder
+        self.parser = StreamParser(layout)
+
+    def run(self, callback):
+        """
+        Keep reading data from the stream until the callback returns False. The stream is always
+        paused when this returns. Raises a `serial.SerialTimeoutException` if the stream stops.
+        """
+        roomba, port, parser, layout = self.roomba, self.roomba.serial, self.parser, self.layout
+        plan, lazy, recorder = self.plan, self.lazy, self.recorder
+        cache = roomba._sensor_cache # pylint: disable=protected-access
+        roomba._stream_parser = parser # pylint: disable=protected-access
+        if recorder is not None:
+            recorder.begin(layout)
+        orig_timeout = port.timeout
+        try:
+            port.timeout = 0.1 # first iteration needs a bit longer wait time
+            while True:
+                offsets = parser.read_from(port)
+                port.timeout = 0.03
+                if offsets is None:
+                    raise serial.SerialTimeoutException('stream stopped')
+                for offset in offsets:
+                    timestamp = roomba._cycle = roomba.clock.monotonic() # pylint: disable=protected-access
+                    if recorder is not None:
+                        recorder.record(timestamp, parser.frame(offset))
+                    if lazy:
+                        frame = layout.view(parser.frame(offset), 2)
+                    else:
+                        frame = layout.decode(parser.buffer, offset+2)
+                    cache.update(layout.paths, frame, timestamp)
+                    if plan is not None:
+                        frame = plan.extract(frame)
+                    if not callback(frame):
+                        return
+        finally:
+            roomba.pause_stream()
+            port.timeout = orig_timeout
+
+
+class BaseBackgroundStream: # pylint: disable=too-many-instance-attributes
+    """
+    The parts of a background stream that do not depend on how its frames are read, shared by
+    `BackgroundStream` and `yarc.async_roomba.AsyncBackgroundStream`. Subclasses give each frame to
+    `_publish()` and provide `running`, `stop()`, and `paused()`.
+
+    The newest frame is always available from `latest` without blocking. It is published by
+    replacing a single reference to an immutable `(timestamp, frame)` tuple so a reader never sees
+    a partially updated frame and never needs to take a lock, no matter which thread it is on or
+    how often it reads. The timestamps are from the `monotonic()` function of the Roomba's `clock`
+    when the frame was recieved.
+
+    A bounded ring of the most recent frames is also kept and is available from `history()`.
+    Callbacks can also be given every new frame with `subscribe()`.
+    """
+    def __init__(self, roomba, sensors, history=256, optimize=False, lazy=False, recorder=None): # pylint: disable=too-many-arguments
+        self.roomba = roomba
+        self.sensors = tuple(sensors)
+        self.optimize, self.lazy, self.recorder = optimize, lazy, recorder
+        self.error = None
+        self.__latest = None
+        self.__history = deque(maxlen=history)
+        self.__callbacks = ()
+        self.__lock = threading.Lock()
+
+    def _publish(self, frame):
+        """Makes a new frame the latest one and gives it to the callbacks."""
+        latest = (self.roomba.clock.monotonic(), frame)
+        self.__latest = latest
+        self.__history.append(latest)
+        for callback in self.__callbacks:
+            if not callback(frame):
+                self.unsubscribe(callback)
+
+    def subscribe(self, callback):
+        """
+        Calls the callback with each new frame as it is read until it returns False or is given to
+        `unsubscribe()`. Like the callback of `Roomba.stream()` it must not block.
+        """
+        with self.__lock:
+            self.__callbacks += (callback,)
+
+    def unsubscribe(self, callback):
+        """Stops calling a callback given to `subscribe()`."""
+        with self.__lock:
+            self.__callbacks = tuple(cb for cb in self.__callbacks if cb is not callback)
+
+    @property
+    def latest(self):
+        """The most recent `(timestamp, frame)` or None if no frames have been recieved yet."""
+        return self.__latest
+
+    @property
+    def frame(self):
+        """The most recent frame or None if no frames have been recieved yet."""
+        latest = self.__latest
+        return None if latest is None else latest[1]
+
+    def history(self):
+        """Gets a list of the most recent `(timestamp, frame)` tuples, oldest first."""
+        return list(self.__history)
+
+
+class BackgroundStream(BaseBackgroundStream):
+    """
+    A stream of sensor data being read by a dedicated thread. This is created with
+    `Roomba.start_background_stream()`. The callbacks given to `subscribe()` are called on the
+    reader thread. See `BaseBackgroundStream` for how the frames are made available.
+    """
+    def __init__(self, roomba, sensors, history=256, optimize=False, lazy=False, recorder=None): # pylint: disable=too-many-arguments
+        super().__init__(roomba, sensors, history, optimize, lazy, recorder)
+        self.__stopping = False
+        self.__thread = None
+        self.__start()
+
+    def __start(self):
+        self.__stopping = False
+        self.__thread = threading.Thread(target=self.__run, name='yarc-stream', daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        try:
+            self.roomba.stream(self.__on_frame, *self.sensors, optimize=self.optimize,
+                               lazy=self.lazy, recorder=self.recorder)
+        except Exception as ex: # pylint: disable=broad-except
+            if not self.__stopping:
+                self.error = ex
+
+    def __on_frame(self, frame):
+        self._publish(frame)
+        return not self.__stopping
+
+    @property
+    def running(self):
+        """True if the reader thread is still running."""
+        return self.__thread.is_alive()
+
+    def stop(self, timeout=1):
+        """
+        Stop the stream and wait up to timeout seconds for the reader thread to finish. Returns
+        False if the reader thread is still running, for example because a callback is blocking.
+        When called from a callback the stream stops once the callback returns.
+        """
+        self.__stopping = True
+        if threading.current_thread() is self.__thread:
+            return True
+        self.__thread.join(timeout)
+        return not self.__thread.is_alive()
+
+    @contextmanager
+    def paused(self, timeout=1):
+        """
+        Stops the stream for the `with` block so that other sensors can be read from the robot and
+        then starts it again with the same sensors. The latest frame and history are kept. Raises
+        a `TimeoutError` if the reader thread does not stop within timeout seconds since it would
+        still be reading from the robot.
+        """
+        running = self.running
+        if not self.stop(timeout):
+            raise TimeoutError('the background stream did not stop')
+        try:
+            yield
+        finally:
+            if running:
+                self.__start()
+
+
+class SensorCache:
+    """
+    The most recent values of the sensors recieved from a stream. This is used so that reading
+    sensors while a stream is running (or shortly after) does not need a round trip to the robot.
+
+    The `DISTANCE` and `ANGLE` sensors report the change since they were last read so they are
+    accumulated from every frame and reset each time they are read from the cache.
+
+    The ages of the values are checked with the `monotonic()` function of `clock`.
+    """
+    ACCUMULATED = (Sensor.DISTANCE, Sensor.ANGLE)
+
+    def __init__(self, clock=time):
+        self.__clock = clock
+        self.__latest = None
+        self.__accumulated = {}
+        self.__lock = threading.Lock()
+
+    def clear(self):
+        """Remove all cached values."""
+        with self.__lock:
+            self.__latest = None
+            self.__accumulated = {}
+
+    def update(self, paths, frame, timestamp):
+        """
+        Record a decoded frame that was recieved at `timestamp`. The paths are the `paths` attribute
+        of the `FrameLayout` or `StreamLayout` of the frame.
+        """
+        with self.__lock:
+            latest = self.__latest
+            if latest is None or latest[2] is not paths:
+                self.__accumulated = {}
+            for sensor in SensorCache.ACCUMULATED:
+                path = paths.get(sensor)
+                if path is not None:
+                    value = frame[path[0]] if len(path) == 1 else frame[path[0]][path[1]]
+                    self.__accumulated[sensor] = self.__accumulated.get(sensor, 0) + value
+            self.__latest = (timestamp, frame, paths)
+
+    def get(self, sensor, ttl):
+        """
+        Get the value of an individual sensor from the cache as long as the data is not older than
+        `ttl` seconds. Raises a `KeyError` if the sensor is not available or too old.
+        """
+        latest = self.__latest
+        if latest is None or self.__clock.monotonic() - latest[0] > ttl:
+            raise KeyError(sensor)
+        _, frame, paths = latest
+        path = paths[sensor]
+        if sensor in SensorCache.ACCUMULATED:
+            with self.__lock:
+                return self.__accumulated.pop(sensor, 0)
+        return frame[path[0]] if len(path) == 1 else frame[path[0]][path[1]]
@@ -0,0 +1,493 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import struct
+import time
+from bisect import bisect_left, bisect_right
+from enum import EnumMeta
+
+import serial
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .enums import IntFlag
+from .roomba import Roomba
+from .sensor import Sensor
+from .stream import StreamLayout
+
+# The format of a telemetry log is:
+#   * the magic bytes b'YARCTLM' followed by the format version (1)
+#   * the number of packets in each frame followed by their packet ids (like the stream command)
+#   * fixed-size records of a big-endian double timestamp followed by the entire stream packet
+#     (header through checksum)
+MAGIC = b'YARCTLM\x01'
+TIMESTAMP = struct.Struct('>d')
+
+# The sparse time index is written next to the log (with '.idx' added to the name) and is:
+#   * the magic bytes b'YARCIDX' followed by the format version (1)
+#   * the number of records between index entries as a big-endian unsigned int
+#   * entries of the record number, its timestamp, and the wall-clock time (from `time.time()`)
+#     when it was recorded (or NaN if not known) for every interval-th record
+INDEX_MAGIC = b'YARCIDX\x01'
+INDEX_HEADER = struct.Struct('>I')
+INDEX_ENTRY = struct.Struct('>Qdd')
+INDEX_INTERVAL = 256
+
+def _read_timestamp(file, header_size, record_size, record):
+    """Reads the timestamp of a single record from a log file."""
+    file.seek(header_size + record * record_size)
+    return TIMESTAMP.unpack(file.read(TIMESTAMP.size))[0]
+
+def _read_index(path, count):
+    """
+    Reads the index file at the given path of a log with the given number of records. Returns the
+    interval and the list of valid entries, or None if the index file does not exist or is not
+    valid.
+    """
+    try:
+        with open(path, 'rb') as file:
+            if file.read(len(INDEX_MAGIC)) != INDEX_MAGIC:
+                return None
+            interval = INDEX_HEADER.unpack(file.read(INDEX_HEADER.size))[0]
+            data = file.read()
+    except (OSError, struct.error):
+        return None
+    data = data[:len(data) // INDEX_ENTRY.size * INDEX_ENTRY.size]
+    entries = []
+    for entry in INDEX_ENTRY.iter_unpack(data):
+        if entry[0] >= count or entry[0] != len(entries) * interval:
+            break # past the end of the log or otherwise not valid
+        entries.append(entry)
+    return interval, entries
+
+def _read_header(file):
+    """Reads the header of a telemetry log, returning the `StreamLayout` of its frames."""
+    magic = file.read(len(MAGIC))
+    if magic != MAGIC:
+        raise ValueError('not a telemetry log')
+    count = file.read(1)
+    ids = file.read(count[0]) if count else b''
+    if not count or len(ids) != count[0]:
+        raise ValueError('truncated telemetry log header')
+    return StreamLayout.of(Sensor(packet_id) for packet_id in ids) # pylint: disable=no-value-for-parameter
+
+# The NumPy types for the struct formats of the individual sensors
+NUMPY_TYPES = {'B': 'u1', 'b': 'i1', '?': '?', 'H': '>u2', 'h': '>i2'}
+
+def numpy_dtype(layout):
+    """
+    Gets the NumPy structured dtype of the records of a telemetry log of the given `StreamLayout`.
+    There is a `timestamp` field and a field for each individual sensor named the same as in the
+    decoded `namedtuple`s. The bytes that aren't sensor data (such as packet ids) are skipped over.
+    Sensors that are `IntEnum`s or `IntFlag`s are given as their raw integers, see
+    `flag_columns()` for splitting up the flags.
+    """
+    names, formats, offsets = ['timestamp'], ['>f8'], [0]
+    offset = TIMESTAMP.size + 2 # skip the header and length bytes of the stream packet
+    for sensor, data_offset in zip(layout.sensors, layout.offsets):
+        position = offset + data_offset
+        for sub in (sensor.sensors if hasattr(sensor, 'sensors') else (sensor,)):
+            if sub.name[0] != '_' and sub.name not in names:
+                names.append(sub.name)
+                formats.append(NUMPY_TYPES[sub.struct_format[1:]])
+                offsets.append(position)
+            position += sub.size
+    return numpy.dtype({'names': names, 'formats': formats, 'offsets': offsets,
+                        'itemsize': TIMESTAMP.size + layout.frame_size})
+
+def flag_columns(values, sensor):
+    """
+    Splits up the values of a sensor that is an `IntFlag` (like `BUMPS_AND_WHEEL_DROPS`) from a
+    NumPy array (such as a column of `Replay.array()`) into a structured array with a boolean
+    column for each flag.
+    """
+    datatype = sensor.datatype
+    if not isinstance(datatype, EnumMeta) or not issubclass(datatype, IntFlag):
+        raise TypeError('sensor must be a flag sensor')
+    flags = [flag for flag in datatype.__members__.values()
+             if flag.value and flag.value & (flag.value - 1) == 0]
+    result = numpy.empty(values.shape, [(flag.name, '?') for flag in flags])
+    for flag in flags:
+        numpy.not_equal(numpy.bitwise_and(values, flag.value), 0, out=result[flag.name])
+    return result
+
+
+class TelemetryRecorder: # pylint: disable=too-many-instance-attributes
+    """
+    Records the raw stream packets of a stream to an append-only binary log, each with the time it
+    was recieved. This is given to `Roomba.stream()` with the `recorder` argument. Only the raw data
+    is written so recording takes almost no time and each frame only takes 8 bytes more than it did
+    over the serial connection. The logs are read with `Replay`.
+
+    If the file already exists then the new frames are added to the end of it. In that case the
+    stream must be of the same packets as the ones already in the log. An incomplete record at the
+    end of the log (like from a crash) is removed.
+
+    A sparse index of the timestamps of every `index_interval`-th frame is written next to the log
+    (with '.idx' added to the name) so that `Replay` can find the frames in a range of time without
+    reading the entire log. If the index is missing or out of date when adding to an existing log
+    it is fixed.
+
+    This can be used as a context manager to close it when done.
+    """
+    def __init__(self, path, index_interval=INDEX_INTERVAL):
+        self.path = path
+        self.index_path = path + '.idx'
+        self.index_interval = index_interval
+        self.layout = None
+        self.frames = 0
+        self.__records = 0 # the total number of records in the log
+        self.__file = open(path, 'a+b') # pylint: disable=consider-using-with
+        self.__index = None
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def begin(self, layout):
+        """
+        Called when a stream starts with its `StreamLayout`. The header is written for a new log,
+        otherwise the layout must be the same as the existing log's.
+        """
+        if self.layout is not None:
+            if self.layout.sensors != layout.sensors:
+                raise ValueError('the stream packets do not match the telemetry log')
+            return
+        file = self.__file
+        file.seek(0, os.SEEK_END)
+        if file.tell() == 0:
+            file.write(MAGIC + layout.request)
+            entries = []
+        else:
+            file.seek(0)
+            existing = _read_header(file)
+            if existing.sensors != layout.sensors:
+                raise ValueError('the stream packets do not match the telemetry log')
+            header_size = file.tell()
+            record_size = TIMESTAMP.size + layout.frame_size
+            file.seek(0, os.SEEK_END)
+            self.__records = (file.tell() - header_size) // record_size
+            file.truncate(header_size + self.__records * record_size)
+
+            # Fix up the index, adding any entries that are missing
+            index = _read_index(self.index_path, self.__records)
+            if index is not None:
+                self.index_interval, entries = index
+            else:
+                entries = []
+            for record in range(len(entries) * self.index_interval, self.__records,
+                                self.index_interval):
+                timestamp = _read_timestamp(file, header_size, record_size, record)
+                entries.append((record, timestamp, float('nan')))
+            file.seek(0, os.SEEK_END)
+        self.__index = open(self.index_path, 'wb') # pylint: disable=consider-using-with
+        self.__index.write(INDEX_MAGIC + INDEX_HEADER.pack(self.index_interval))
+        self.__index.write(b''.join(INDEX_ENTRY.pack(*entry) for entry in entries))
+        self.layout = layout
+
+    def record(self, timestamp, frame):
+        """Record a single stream packet (the header through the checksum) and its timestamp."""
+        if self.__records % self.index_interval == 0:
+            self.__index.write(INDEX_ENTRY.pack(self.__records, timestamp, time.time()))
+        self.__file.write(TIMESTAMP.pack(timestamp))
+        self.__file.write(frame)
+        self.frames += 1
+        self.__records += 1
+
+    def flush(self):
+        """Make sure all of the recorded frames are written to the files."""
+        self.__file.flush()
+        if self.__index is not None:
+            self.__index.flush()
+
+    def close(self):
+        """Close the log and index files."""
+        self.__file.close()
+        if self.__index is not None:
+            self.__index.close()
+
+
+class Replay:
+    """
+    Reads a telemetry log written by a `TelemetryRecorder`.
+
+    The frames can be read directly by iterating over this object which gives the timestamp and
+    raw stream packet of each frame or with `decoded()` which gives the timestamp and decoded
+    frame. The frames can also be played back with `play()` which gives them to a callback through
+    the same code that decodes a live stream, optionally at the original speed.
+
+    For analyzing large logs, `array()` memory-maps the log as a NumPy structured array so the
+    sensors can be used as columns without decoding each frame and `summarize()` gives the minimum,
+    maximum, and mean of each sensor over intervals of time. These require NumPy.
+
+    All of these can be limited to the frames with timestamps in the range `[t0, t1)`. The frames
+    are found using the index written by the `TelemetryRecorder` so only a few records need to be
+    read no matter how long the log is. The timestamps in a log must never decrease, which is true
+    for timestamps from `time.monotonic()` as long as the computer is not restarted while adding to
+    a log. Use `to_timestamp()` to convert a wall-clock time to a timestamp.
+
+    Attributes:
+      * `sensors` - the tuple of `Sensor` packets in each frame
+      * `layout` - the `StreamLayout` of the frames
+    """
+    CHUNK_RECORDS = 1024 # number of records read at a time
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as file:
+            self.layout = _read_header(file)
+            self.__header_size = file.tell()
+        self.sensors = self.layout.sensors
+        self.record_size = TIMESTAMP.size + self.layout.frame_size
+        self.__interval, self.__index = INDEX_INTERVAL, []
+
+    def __len__(self):
+        return (os.path.getsize(self.path) - self.__header_size) // self.record_size
+
+    def __iter__(self):
+        """Iterate over the `(timestamp, frame)` of each record with the raw frame `bytes`."""
+        return self.frames()
+
+    ##### Index #####
+    @property
+    def index(self):
+        """
+        The list of index entries, each a tuple of the record number, timestamp, and wall-clock
+        time (NaN if not known). The index file is used if it exists and any entries missing from
+        it are read from the log.
+        """
+        count = len(self)
+        if not self.__index:
+            index = _read_index(self.path + '.idx', count)
+            if index is not None:
+                self.__interval, self.__index = index
+        index, interval = self.__index, self.__interval
+        if len(index) * interval < count:
+            with open(self.path, 'rb') as file:
+                for record in range(len(index) * interval, count, interval):
+                    timestamp = _read_timestamp(file, self.__header_size, self.record_size, record)
+                    index.append((record, timestamp, float('nan')))
+        return index
+
+    def find(self, timestamp):
+        """Gets the number of the first record with a timestamp at or after the given one."""
+        index = self.index
+        count = len(self)
+        block = bisect_right([entry[1] for entry in index], timestamp) - 1
+        if block < 0:
+            return 0
+        start = index[block][0]
+        stop = index[block+1][0] if block + 1 < len(index) else count
+        with open(self.path, 'rb') as file:
+            file.seek(self.__header_size + start * self.record_size)
+            data = file.read((stop - start) * self.record_size)
+        timestamps = [TIMESTAMP.unpack_from(data, offset)[0]
+                      for offset in range(0, len(data), self.record_size)]
+        return start + bisect_left(timestamps, timestamp)
+
+    def range(self, t0=None, t1=None):
+        """
+        Gets the numbers of the first record at or after t0 and the first record at or after t1,
+        which are the start and stop of the records in the range `[t0, t1)`. If either is None
+        then the range goes to the beginning or end of the log.
+        """
+        start = 0 if t0 is None else self.find(t0)
+        stop = len(self) if t1 is None else self.find(t1)
+        return start, max(start, stop)
+
+    def to_timestamp(self, wall_time):
+        """
+        Convert a wall-clock time (like from `time.time()` or `datetime.timestamp()`) to the
+        timestamps used in the log using the wall-clock times recorded in the index.
+        """
+        known = [entry for entry in self.index if entry[2] == entry[2]] # skips NaNs
+        if not known:
+            raise ValueError('the index has no wall-clock times')
+        block = max(bisect_right([entry[2] for entry in known], wall_time) - 1, 0)
+        _, timestamp, wall = known[block]
+        return wall_time - wall + timestamp
+
+    ##### Reading #####
+    def frames(self, t0=None, t1=None):
+        """
+        Iterate over the `(timestamp, frame)` of each record in the range `[t0, t1)` with the raw
+        frame `bytes`.
+        """
+        start, stop = self.range(t0, t1)
+        size, stamp_size = self.record_size, TIMESTAMP.size
+        unpack = TIMESTAMP.unpack_from
+        with open(self.path, 'rb') as file:
+            file.seek(self.__header_size + start * size)
+            while start < stop:
+                records = min(stop - start, Replay.CHUNK_RECORDS)
+                data = file.read(size * records)
+                for offset in range(0, len(data) - size + 1, size):
+                    yield unpack(data, offset)[0], data[offset+stamp_size:offset+size]
+                if len(data) < size * records:
+                    break
+                start += records
+
+    def array(self, t0=None, t1=None):
+        """
+        Memory-map the log as a read-only NumPy structured array with a record for each frame in
+        the range `[t0, t1)`. See `numpy_dtype()` for the fields. No data is read or decoded until
+        it is used.
+        """
+        if numpy is None:
+            raise ImportError('Replay.array() requires NumPy')
+        start, stop = self.range(t0, t1)
+        dtype = numpy_dtype(self.layout)
+        if start == stop:
+            return numpy.empty(0, dtype)
+        return numpy.memmap(self.path, dtype, 'r', self.__header_size + start * self.record_size,
+                            (stop - start,))
+
+    def summarize(self, resolution, sensors=None, t0=None, t1=None):
+        """
+        Downsample the sensors (defaulting to all of them) in the range `[t0, t1)` to the minimum,
+        maximum, and mean of each sensor over every `resolution` seconds. The intervals line up
+        with multiples of the resolution so that the intervals are the same no matter the range.
+
+        Returns a NumPy structured array with a record for each interval that has any frames with
+        the fields `start` (the timestamp of the start of the interval), `count` (the number of
+        frames), and for each sensor a field with the sub-fields `min`, `max`, and `mean`. For
+        example `summary['VOLTAGE']['mean']`.
+        """
+        data = self.array(t0, t1)
+        if sensors is None:
+            names = data.dtype.names[1:]
+        else:
+            names = [sensor.name if isinstance(sensor, Sensor) else sensor for sensor in sensors]
+        fields = data.dtype.fields
+        dtype = [('start', 'f8'), ('count', 'i8')] + [
+            (name, [('min', fields[name][0].newbyteorder('=')),
+                    ('max', fields[name][0].newbyteorder('=')), ('mean', 'f8')])
+            for name in names]
+        if len(data) == 0: # pylint: disable=len-as-condition
+            return numpy.empty(0, dtype)
+        intervals = numpy.floor(data['timestamp'] / resolution)
+        starts = numpy.flatnonzero(numpy.diff(intervals)) + 1
+        starts = numpy.concatenate(([0], starts))
+        summary = numpy.empty(len(starts), dtype)
+        summary['start'] = intervals[starts] * resolution
+        summary['count'] = numpy.diff(numpy.append(starts, len(data)))
+        for name in names:
+            column = data[name]
+            if column.dtype == numpy.bool_:
+                column = column.view(numpy.uint8)
+            summary[name]['min'] = numpy.minimum.reduceat(column, starts)
+            summary[name]['max'] = numpy.maximum.reduceat(column, starts)
+            summary[name]['mean'] = numpy.add.reduceat(column, starts, dtype='f8')
+            summary[name]['mean'] /= summary['count']
+        return summary
+
+    def decoded(self, lazy=False, t0=None, t1=None):
+        """
+        Iterate over the `(timestamp, frame)` of each record in the range `[t0, t1)` with the frame
+        decoded into a `namedtuple` (or a `FrameView` if lazy is True).
+        """
+        layout = self.layout
+        decode = layout.view if lazy else layout.decode
+        for timestamp, frame in self.frames(t0, t1):
+            yield timestamp, decode(frame, 2)
+
+    def serial(self, speed=1.0, clock=time, t0=None, t1=None): # pylint: disable=too-many-arguments
+        """
+        Get an object that acts like a serial port that a stream of the recorded frames is read
+        from. See `play()` for the arguments.
+        """
+        return ReplaySerial(self, speed, clock, t0, t1)
+
+    def play(self, callback, speed=1.0, lazy=False, clock=time, t0=None, t1=None): # pylint: disable=too-many-arguments
+        """
+        Play back the recorded frames, calling the callback with each one just like
+        `Roomba.stream()` does, including stopping if the callback returns False. The frames are
+        read by a `Roomba` so they go through the same code as a live stream.
+
+        The frames are given at the speed they were recorded at (based on the clock's `sleep()` and
+        `monotonic()` functions) times the speed argument, or as fast as possible if the speed is
+        None. Only the frames in the range `[t0, t1)` are played. Returns the `StreamStats` of the
+        playback.
+        """
+        port = self.serial(speed, clock, t0, t1)
+        bot = Roomba(port, clock=clock)
+        try:
+            bot.stream(callback, *self.sensors, lazy=lazy)
+        except serial.SerialTimeoutException:
+            if not port.finished:
+                raise
+        return bot.stream_stats
+
+
+class ReplaySerial:
+    """
+    A read-only serial port that sends the frames from a `Replay` like a robot streaming them.
+    Everything written to it is ignored. Once all frames have been read, reads return nothing and
+    `finished` is True.
+    """
+    baudrate = 115200
+    is_open = False # nothing to close
+
+    def __init__(self, replay, speed=1.0, clock=time, t0=None, t1=None): # pylint: disable=too-many-arguments
+        self.timeout = None
+        self.finished = False
+        self.__records = replay.frames(t0, t1)
+        self.__speed = speed
+        self.__clock = clock
+        self.__start = None # (clock time, recorded time) of the first frame
+        self.__frame = memoryview(b'')
+
+    def write(self, data):
+        """Ignores the data."""
+        return len(data)
+
+    def reset_input_buffer(self):
+        """Does nothing, the frames are only read once."""
+
+    def __next_frame(self):
+        try:
+            timestamp, frame = next(self.__records)
+        except StopIteration:
+            self.finished = True
+            return False
+        if self.__speed is not None:
+            if self.__start is None:
+                self.__start = (self.__clock.monotonic(), timestamp)
+            due = self.__start[0] + (timestamp - self.__start[1]) / self.__speed
+            delay = due - self.__clock.monotonic()
+            if delay > 0:
+                self.__clock.sleep(delay)
+        self.__frame = memoryview(frame)
+        return True
+
+    def readinto(self, buffer):
+        """Reads the next part of the recorded stream, waiting until the time it was recieved."""
+        if not self.__frame and not self.__next_frame():
+            return 0
+        nbytes = min(len(buffer), len(self.__frame))
+        buffer[:nbytes] = self.__frame[:nbytes]
+        self.__frame = self.__frame[nbytes:]
+        return nbytes
+
+    def read(self, nbytes=1):
+        """Reads up to nbytes of the recorded stream."""
+        buffer = bytearray(nbytes)
+        return bytes(buffer[:self.readinto(buffer)])
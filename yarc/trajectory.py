@@ -0,0 +1,124 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from collections import namedtuple
+import math
+
+from .enums import OIMode
+from .motion import CYCLE
+from .sensor import Sensor
+
+TrajectoryStats = namedtuple('TrajectoryStats', ('sent', 'skipped', 'mean_error', 'rms_error',
+                                                 'max_error'))
+TrajectoryStats.__doc__ = """
+The timing of a played trajectory. The number of setpoints sent and skipped (because a later
+setpoint was due in the same cycle) along with the mean, root-mean-square, and maximum absolute
+difference between when each setpoint was sent and when it was supposed to be sent, in seconds.
+"""
+
+class TrajectoryPlayer: # pylint: disable=too-many-instance-attributes
+    """
+    Plays a precomputed trajectory, sending each setpoint to the robot at its time. This is created
+    and run with `Roomba.play_trajectory()`.
+
+    The setpoints are a sequence (such as a list or a 2D NumPy array) of rows of either
+    `(t, right_velocity, left_velocity)` for `drive_direct()` (the default) or
+    `(t, velocity, radius)` for `drive()` with the command given as 'drive'. The times are in
+    seconds from the start and must be increasing.
+
+    Instead of sleeping until each setpoint is due, the player runs on a stream: the robot sends a
+    stream packet at the start of each of its 15 ms cycles and any setpoint due closest to that
+    packet is sent right away so it is used during that cycle. This keeps the setpoints locked to
+    the robot's cycles without drifting. If several setpoints are due in the same cycle only the
+    last of them is sent.
+
+    The stream includes the `OI_MODE` sensor and if the robot drops to passive mode (for example
+    from a cliff in safe mode) the player stops and `result()` raises a `RuntimeError`.
+
+    The time each setpoint was actually sent is kept in `timing` as a list of
+    `(commanded time, sent time)` pairs, both relative to the start, and `stats` summarizes them.
+    """
+    SENSORS = (Sensor.OI_MODE,)
+
+    def __init__(self, roomba, setpoints, command='drive_direct'):
+        if command not in ('drive_direct', 'drive'):
+            raise ValueError('command must be drive_direct or drive')
+        self.roomba = roomba
+        self.command = getattr(roomba, command)
+        self.setpoints = [(float(t), int(a), int(b)) for t, a, b in setpoints]
+        if any(t1 < t0 for (t0, _, _), (t1, _, _) in zip(self.setpoints, self.setpoints[1:])):
+            raise ValueError('setpoint times must be increasing')
+        self.timing = []
+        self.skipped = 0
+        self.error = None
+        self.done = not self.setpoints
+        self.__next = 0 # index of the next setpoint to send
+        self.__start = None
+        self.__cancelled = False
+
+    def update(self, frame):
+        """
+        Updates the player with a frame of a stream of the `SENSORS`, sending the setpoint that is
+        due. Returns True until all of the setpoints have been sent.
+        """
+        if self.done or self.__cancelled:
+            self.done = True
+            return False
+        now = self.roomba.clock.monotonic()
+        if self.__start is None:
+            self.__start = now
+        elif frame[0] not in (OIMode.SAFE, OIMode.FULL):
+            self.error = RuntimeError('robot changed to %s mode' % OIMode(frame[0]).name.lower())
+            self.done = True
+            return False
+
+        # Find the last setpoint due by the middle of this cycle
+        elapsed, setpoints, index = now - self.__start, self.setpoints, self.__next
+        due = elapsed + CYCLE / 2
+        while index < len(setpoints) and setpoints[index][0] <= due:
+            index += 1
+        if index > self.__next:
+            self.skipped += index - self.__next - 1
+            t, first, second = setpoints[index - 1]
+            self.command(first, second)
+            self.timing.append((t, elapsed))
+            self.__next = index
+        self.done = index == len(setpoints)
+        return not self.done
+
+    def cancel(self):
+        """
+        Stop sending setpoints. The robot is left doing the last setpoint sent. Returns False if
+        the trajectory was already done.
+        """
+        self.__cancelled = True
+        return not self.done
+
+    @property
+    def stats(self):
+        """The `TrajectoryStats` of the setpoints sent so far."""
+        errors = [abs(sent - t) for t, sent in self.timing]
+        if not errors:
+            return TrajectoryStats(0, self.skipped, 0.0, 0.0, 0.0)
+        return TrajectoryStats(len(errors), self.skipped, sum(errors) / len(errors),
+                               math.sqrt(sum(e*e for e in errors) / len(errors)), max(errors))
+
+    def result(self):
+        """The `stats` of the trajectory. Raises a `RuntimeError` if it was stopped early."""
+        if self.error is not None:
+            raise self.error
+        return self.stats
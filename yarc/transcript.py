@@ -0,0 +1,256 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import struct
+import time
+
+# The format of a transcript is the magic bytes b'YARCTXS' followed by the format version (1) and
+# then events which are a big-endian double timestamp, the kind of event, and the length of the
+# data followed by the data. The data of a WRITE or READ is the bytes written or read (a READ with
+# no data is a read that timed out), the data of a BAUDRATE is the new baudrate as an unsigned int,
+# the data of an RTS or DTR is a single byte of 0 or 1, and a RESET_INPUT has no data (the data it
+# threw away is recorded as a READ right before it).
+MAGIC = b'YARCTXS\x01'
+EVENT = struct.Struct('>dBI')
+WRITE, READ, BAUDRATE, RTS, DTR, RESET_INPUT = range(6)
+EVENT_NAMES = ('WRITE', 'READ', 'BAUDRATE', 'RTS', 'DTR', 'RESET_INPUT')
+BAUD = struct.Struct('>I')
+
+def read_transcript(path):
+    """Reads all of the events in a transcript as a list of `(timestamp, kind, data)`."""
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError('not a serial transcript')
+        data = file.read()
+    events, offset = [], 0
+    while offset + EVENT.size <= len(data):
+        timestamp, kind, length = EVENT.unpack_from(data, offset)
+        offset += EVENT.size
+        if offset + length > len(data):
+            break # incomplete event at the end
+        events.append((timestamp, kind, data[offset:offset+length]))
+        offset += length
+    return events
+
+
+class TranscriptRecorder:
+    """
+    Wraps a serial port (such as the `serial` attribute of a `Roomba`) and records every byte
+    written to and read from it along with when it happened, the baudrate changes, and the changes
+    to the RTS and DTR pins. This includes everything, even the messages the robot prints after a
+    reset and the battery messages it sends on its own. The transcript can be replayed with
+    `TranscriptReplay` to re-run a session without a robot. For example:
+
+        bot = Roomba('/dev/ttyUSB0')
+        bot.serial = TranscriptRecorder(bot.serial, 'session.ytx')
+
+    The timestamps come from the `monotonic()` function of the clock. Everything not recorded is
+    passed through to the wrapped port. Closing the port closes the transcript.
+    """
+    def __init__(self, port, path, clock=time):
+        self.__dict__['_TranscriptRecorder__port'] = port
+        self.__dict__['path'] = path
+        self.__dict__['clock'] = clock
+        self.__dict__['_TranscriptRecorder__file'] = open(path, 'wb') # pylint: disable=consider-using-with
+        self.__file.write(MAGIC)
+        self.__record(BAUDRATE, BAUD.pack(port.baudrate))
+
+    def __record(self, kind, data):
+        self.__file.write(EVENT.pack(self.clock.monotonic(), kind, len(data)))
+        self.__file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.__port, name)
+
+    def __setattr__(self, name, value):
+        setattr(self.__port, name, value)
+        if name == 'baudrate':
+            self.__record(BAUDRATE, BAUD.pack(value))
+        elif name in ('rts', 'dtr'):
+            self.__record(RTS if name == 'rts' else DTR, b'\x01' if value else b'\x00')
+
+    def write(self, data):
+        """Write the data to the port and record it."""
+        nbytes = self.__port.write(data)
+        self.__record(WRITE, bytes(data))
+        return nbytes
+
+    def read(self, size=1):
+        """Read from the port and record what was read."""
+        data = self.__port.read(size)
+        self.__record(READ, data)
+        return data
+
+    def readinto(self, buffer):
+        """Read from the port into a buffer and record what was read."""
+        nbytes = self.__port.readinto(buffer)
+        self.__record(READ, bytes(buffer[:nbytes]))
+        return nbytes
+
+    def reset_input_buffer(self):
+        """
+        Throw away the data waiting to be read. That data is read first and recorded as a READ
+        since the robot did send it, then the reset is recorded.
+        """
+        waiting = self.__port.in_waiting
+        if waiting:
+            self.__record(READ, self.__port.read(waiting))
+        self.__port.reset_input_buffer()
+        self.__record(RESET_INPUT, b'')
+
+    def flush(self):
+        """Flush the port and the transcript."""
+        self.__port.flush()
+        self.__file.flush()
+
+    def close(self):
+        """Close the port and the transcript."""
+        self.__port.close()
+        self.__file.close()
+
+
+class TranscriptReplay: # pylint: disable=too-many-instance-attributes
+    """
+    A fake serial port that replays a transcript recorded with `TranscriptRecorder` so a session
+    can be re-run deterministically without a robot, for example `Roomba(TranscriptReplay(path))`.
+
+    The bytes that were read are given back in order, but only after the bytes that were written
+    before them in the transcript have been written again. Reads that timed out in the transcript
+    time out again at the same place. The bytes written are checked against the transcript and a
+    `ValueError` is raised if they differ, unless strict is False. How the bytes are split up into
+    writes and reads does not matter, so the library can change how it reads and writes and still
+    be checked against an old transcript.
+
+    If speed is given then the bytes are not available to be read until the time they were read
+    in the transcript (sped up by speed) based on the clock's `sleep()` and `monotonic()`
+    functions, otherwise everything happens as quickly as possible.
+
+    Once the entire transcript has been replayed `finished` is True and reads return nothing.
+    """
+    def __init__(self, path, strict=True, speed=None, clock=time):
+        self.events = read_transcript(path)
+        self.strict = strict
+        self.speed = speed
+        self.clock = clock
+        self.timeout = None
+        self.baudrate = BAUD.unpack(self.events[0][2])[0] if self.events else 115200
+        self.rts = self.dtr = True
+        self.is_open = True
+        self.written = 0 # the number of bytes written so far
+        self.__next = 0 # index of the next event
+        self.__partial = 0 # number of bytes of the next WRITE event already written
+        self.__available = bytearray()
+        self.__start = None # (clock time, transcript time) of the first event
+
+    @property
+    def finished(self):
+        """True once all of the events have been replayed and all data read."""
+        return self.__next >= len(self.events) and not self.__available
+
+    @property
+    def in_waiting(self):
+        """The number of bytes that can be read now."""
+        self.__advance(False)
+        return len(self.__available)
+
+    def __advance(self, wait):
+        """
+        Makes all of the read data available up to the next write or timeout. If wait is True and
+        replaying at a set speed then this waits for the data to be due, otherwise it stops at
+        data that isn't due yet.
+        """
+        events = self.events
+        while self.__next < len(events):
+            timestamp, kind, data = events[self.__next]
+            if kind in (WRITE, RESET_INPUT) or (kind == READ and not data):
+                break
+            if kind == READ and self.speed is not None:
+                if self.__start is None:
+                    self.__start = (self.clock.monotonic(), timestamp)
+                delay = (self.__start[0] + (timestamp - self.__start[1]) / self.speed -
+                         self.clock.monotonic())
+                if delay > 0:
+                    if not wait:
+                        break
+                    self.clock.sleep(delay)
+            if kind == READ:
+                self.__available += data
+            self.__next += 1
+
+    def write(self, data):
+        """Check that the data matches what was written in the transcript."""
+        data = bytes(data)
+        events, offset = self.events, 0
+        while offset < len(data):
+            self.__advance(False)
+            # Skip any timeouts and resets the library no longer has, reads are still available
+            while self.__next < len(events) and events[self.__next][1] != WRITE:
+                if events[self.__next][1] == READ:
+                    self.__available += events[self.__next][2]
+                elif events[self.__next][1] == RESET_INPUT:
+                    del self.__available[:]
+                self.__next += 1
+            if self.__next >= len(events):
+                if self.strict:
+                    raise ValueError('wrote %r past the end of the transcript' % data[offset:])
+                break
+            expected = events[self.__next][2][self.__partial:]
+            actual = data[offset:offset+len(expected)]
+            if self.strict and actual != expected[:len(actual)]:
+                raise ValueError('wrote %r at byte %d but the transcript has %r' %
+                                 (actual, self.written + offset, expected[:len(actual)]))
+            offset += len(actual)
+            self.__partial += len(actual)
+            if self.__partial == len(events[self.__next][2]):
+                self.__next += 1
+                self.__partial = 0
+        self.written += len(data)
+        return len(data)
+
+    def read(self, size=1):
+        """Read up to size bytes, returning less if the transcript has a timeout here."""
+        self.__advance(True)
+        if len(self.__available) < size and self.__next < len(self.events):
+            _, kind, data = self.events[self.__next]
+            if kind == READ and not data:
+                self.__next += 1 # the timeout in the transcript happens now
+        data = bytes(self.__available[:size])
+        del self.__available[:size]
+        return data
+
+    def readinto(self, buffer):
+        """Read into the buffer, returning less if the transcript has a timeout here."""
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def reset_input_buffer(self):
+        """Throw away the data that was waiting to be read up to the reset in the transcript."""
+        self.__advance(True)
+        if self.__next < len(self.events) and self.events[self.__next][1] == RESET_INPUT:
+            self.__next += 1
+        del self.__available[:]
+
+    def reset_output_buffer(self):
+        """Does nothing."""
+
+    def flush(self):
+        """Does nothing."""
+
+    def close(self):
+        """Close the fake port."""
+        self.is_open = False
@@ -0,0 +1,137 @@
+"""
+This file is part of YARC (https://github.com/coderforlife/yarc).
+Copyright (c) 2019 Jeffrey Bush.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, version 3.
+
+This program is distributed in the hope that it will be useful, but
+WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from urllib.parse import urlsplit
+
+from serial.serialutil import SerialBase, SerialException, PortNotOpenError, to_bytes
+
+from ..emulator import Emulator
+
+class Serial(SerialBase):
+    """
+    A pyserial port connected to an emulated robot. This is created by pyserial for the URL
+    `roomba://`, for example with `serial.serial_for_url('roomba://')` or `Roomba('roomba://')`.
+    The `Emulator` is available from the `emulator` attribute. To use an existing emulator, set the
+    `emulator` attribute before opening the port.
+
+    Like a real serial port, if the baudrate of the port does not match the baudrate of the robot
+    then nothing sent either way makes it through.
+    """
+    def __init__(self, *args, **kwargs):
+        self.emulator = None
+        super().__init__(*args, **kwargs)
+
+    def open(self):
+        """Open the port, which starts a new emulated robot unless one was already given."""
+        if self.is_open:
+            raise SerialException('Port is already open.')
+        if self._port is None:
+            raise SerialException('Port must be configured before it can be used.')
+        self.from_url(self.port)
+        if self.emulator is None:
+            self.emulator = Emulator()
+        self.is_open = True
+
+    def close(self):
+        """Close the port, the emulated robot keeps running."""
+        self.is_open = False
+
+    def from_url(self, url):
+        """Check the URL, which has no options."""
+        parts = urlsplit(url)
+        if parts.scheme != 'roomba' or parts.netloc or parts.path or parts.query:
+            raise SerialException('expected the URL "roomba://", got %r' % url)
+
+    def _reconfigure_port(self, *args, **kwargs):
+        pass # settings (besides the baudrate which is checked on use) have no effect
+
+    def __connected(self):
+        if not self.is_open:
+            raise PortNotOpenError()
+        return self.emulator.baudrate == self._baudrate
+
+    @property
+    def in_waiting(self):
+        """The number of bytes the robot has sent that have not been read."""
+        return self.emulator.in_waiting if self.__connected() else 0
+
+    def read(self, size=1):
+        """
+        Read size bytes from the robot, waiting up to the timeout for them to be sent. Less bytes
+        are returned if they don't all arrive in time.
+        """
+        connected = self.__connected()
+        emulator = self.emulator
+        deadline = None if self._timeout is None else emulator.clock.monotonic() + self._timeout
+        data = bytearray()
+        while True:
+            if connected:
+                data += emulator.read(size - len(data))
+            if len(data) >= size:
+                break
+            now = emulator.clock.monotonic()
+            if deadline is not None and now >= deadline:
+                break
+            wake = emulator.next_output()
+            if deadline is not None and (wake is None or wake > deadline):
+                wake = deadline
+            emulator.clock.sleep(0.001 if wake is None else max(wake - now, 0))
+        return bytes(data)
+
+    def write(self, data):
+        """Send data to the robot."""
+        data = to_bytes(data)
+        if self.__connected():
+            self.emulator.write(data)
+        return len(data)
+
+    def reset_input_buffer(self):
+        """Throw away all of the bytes the robot has sent that have not been read."""
+        self.__connected()
+        self.emulator.reset_input_buffer()
+
+    def reset_output_buffer(self):
+        """Nothing is buffered on the way to the robot."""
+
+    def _update_break_state(self):
+        pass
+
+    def _update_rts_state(self):
+        pass
+
+    def _update_dtr_state(self):
+        pass
+
+    @property
+    def cts(self):
+        """The CTS pin follows the RTS pin."""
+        return self._rts_state
+
+    @property
+    def dsr(self):
+        """The DSR pin follows the DTR pin."""
+        return self._dtr_state
+
+    @property
+    def ri(self):
+        """There is no ring indicator."""
+        return False
+
+    @property
+    def cd(self):
+        """The carrier is always detected."""
+        return True